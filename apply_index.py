@@ -1,7 +1,9 @@
 import sqlite3
 import configparser
+import argparse
 import os
 import sys
+import time
 
 def get_config():
     """Reads configuration from config.ini"""
@@ -41,7 +43,7 @@ def apply_schema(db_path, table_name, schema_file_path):
         cursor.executescript(sql_script)
         conn.commit()
         
-        print(f"Index 'idx_sector_date' created successfully on table '{table_name}'.")
+        print(f"Indexes from '{os.path.basename(schema_file_path)}' applied to table '{table_name}'.")
         
     except sqlite3.Error as e:
         print(f"An error occurred while applying the index: {e}")
@@ -52,7 +54,121 @@ def apply_schema(db_path, table_name, schema_file_path):
         if conn:
             conn.close()
 
+def _probe_queries(table_name, date_column):
+    """
+    The four UDF query shapes, filtered on the given date column.
+    'date(date)' is the original function-wrapped form; 'date_key' is the
+    normalized column added by migrate_date_key().
+    """
+    if date_column == 'date_key':
+        day = "date_key = ?"
+        between = "date_key BETWEEN ? AND ?"
+        order = "date_key"
+    else:
+        day = "date(date) = ?"
+        between = "date(date) BETWEEN ? AND ?"
+        order = "date(date)"
+
+    return {
+        'single': (f"SELECT curr_ttm_ebitda_margins FROM {table_name} WHERE sector = ? AND {day}",
+                   ('IT', '2020-03-31')),
+        'series': (f"SELECT {order}, curr_ttm_ebitda_margins FROM {table_name} WHERE sector = ? AND {between} ORDER BY {order}",
+                   ('IT', '2015-03-31', '2020-03-31')),
+        'matrix': (f"SELECT sector, {order}, curr_ttm_ebitda_margins FROM {table_name} WHERE {day} ORDER BY sector",
+                   ('2020-03-31',)),
+        'history': (f"SELECT {order}, curr_ttm_ebitda_margins FROM {table_name} WHERE sector = ? ORDER BY {order}",
+                    ('IT',)),
+    }
+
+def explain_queries(db_path, table_name, date_column, repeat=200):
+    """
+    Prints EXPLAIN QUERY PLAN and the mean execution time for each UDF query.
+    Returns {name: (plan_details, mean_ms)} so callers can compare runs.
+    """
+    results = {}
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.cursor()
+        print(f"\n--- Query plans using '{date_column}' ---")
+        for name, (query, params) in _probe_queries(table_name, date_column).items():
+            cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+            plan = [row[3] for row in cursor.fetchall()]
+
+            start_time = time.perf_counter()
+            for _ in range(repeat):
+                cursor.execute(query, params).fetchall()
+            mean_ms = (time.perf_counter() - start_time) * 1000 / repeat
+
+            results[name] = (plan, mean_ms)
+            print(f"{name:8s} | {mean_ms:.3f} ms | {' / '.join(plan)}")
+    finally:
+        conn.close()
+    return results
+
+def has_date_key(db_path, table_name):
+    """True if migrate_date_key() has already been applied."""
+    conn = sqlite3.connect(db_path)
+    try:
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+    finally:
+        conn.close()
+    return 'date_key' in columns
+
+def migrate_date_key(db_path, table_name):
+    """
+    Adds a normalized 'YYYY-MM-DD' date_key column next to the TIMESTAMP
+    'date' column, backfills it, indexes it, and installs triggers so rows
+    inserted or updated later keep it in sync.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.cursor()
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table_name})")]
+
+        if 'date_key' not in columns:
+            print(f"Adding date_key column to '{table_name}'...")
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN date_key TEXT")
+        cursor.execute(f"UPDATE {table_name} SET date_key = date(date) WHERE date_key IS NOT date(date)")
+        print(f"Backfilled date_key for {cursor.rowcount} rows.")
+
+        cursor.executescript(f"""
+            CREATE INDEX IF NOT EXISTS idx_sector_date_key
+            ON {table_name} (sector, date_key);
+
+            CREATE INDEX IF NOT EXISTS idx_date_key
+            ON {table_name} (date_key, sector);
+
+            CREATE TRIGGER IF NOT EXISTS trg_{table_name}_date_key_insert
+            AFTER INSERT ON {table_name}
+            BEGIN
+                UPDATE {table_name} SET date_key = date(NEW.date) WHERE rowid = NEW.rowid;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_{table_name}_date_key_update
+            AFTER UPDATE OF date ON {table_name}
+            BEGIN
+                UPDATE {table_name} SET date_key = date(NEW.date) WHERE rowid = NEW.rowid;
+            END;
+
+            ANALYZE;
+        """)
+        conn.commit()
+        print(f"date_key migration complete on table '{table_name}'.")
+    finally:
+        conn.close()
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply indexes and migrations to the sectoral DB.")
+    parser.add_argument('--migrate-dates', action='store_true',
+                        help="Add the indexed date_key column and compare query plans before/after.")
+    parser.add_argument('--explain', action='store_true',
+                        help="Only print query plans and timings, without changing the DB.")
+    parser.add_argument('--materialize', action='store_true',
+                        help="Build or incrementally refresh the wide pivot and sector summary tables.")
+    parser.add_argument('--materialize-full', action='store_true',
+                        help="Rebuild the materialized tables from scratch.")
+    args = parser.parse_args()
+
     try:
         config = get_config()
         DB_PATH = config.get('db_path')
@@ -63,7 +179,28 @@ if __name__ == "__main__":
         db_full_path = os.path.join(script_dir, DB_PATH)
         schema_full_path = os.path.join(script_dir, SCHEMA_FILE)
 
+        if args.explain:
+            explain_queries(db_full_path, TABLE_NAME, 'date(date)')
+            if has_date_key(db_full_path, TABLE_NAME):
+                explain_queries(db_full_path, TABLE_NAME, 'date_key')
+            sys.exit(0)
+
         apply_schema(db_full_path, TABLE_NAME, schema_full_path)
+
+        if args.migrate_dates:
+            before = explain_queries(db_full_path, TABLE_NAME, 'date(date)')
+            migrate_date_key(db_full_path, TABLE_NAME)
+            after = explain_queries(db_full_path, TABLE_NAME, 'date_key')
+
+            print("\n--- Before / after ---")
+            for name in before:
+                speedup = before[name][1] / after[name][1] if after[name][1] else float('inf')
+                print(f"{name:8s} | {before[name][1]:.3f} ms -> {after[name][1]:.3f} ms ({speedup:.1f}x)")
+
+        if args.materialize or args.materialize_full:
+            from sectoral_materialize import refresh_materialized
+            result = refresh_materialized(db_full_path, TABLE_NAME, full=args.materialize_full)
+            print(f"Materialized tables refreshed ({result['mode']}): {result['dates']} quarter(s) in {result['time_ms']} ms.")
         
     except Exception as e:
         print(f"Failed to run: {e}")
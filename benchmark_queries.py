@@ -0,0 +1,422 @@
+# Benchmark harness for the UDF query paths. Runs without Excel by calling the
+# UDF functions directly, the same way the UDF server does.
+#
+#   python benchmark_queries.py                         # shipped DB
+#   python benchmark_queries.py --synthetic 1000x400    # generated DB
+#   python benchmark_queries.py --output run.json --compare baseline.json
+#   python benchmark_queries.py --import-time --target-ms 200
+#   python benchmark_queries.py --spill --synthetic 1000x400
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, date, timedelta
+
+import sectoral_data_udf
+
+FIELD = 'curr_ttm_ebitda_margins'
+
+# --- Datasets ---
+
+def _quarter_ends(n_quarters, first_year=1990):
+    dates = []
+    year, month = first_year, 3
+    for _ in range(n_quarters):
+        next_month = date(year + (month == 12), month % 12 + 1, 1)
+        dates.append(next_month - timedelta(days=1))
+        month += 3
+        if month > 12:
+            year, month = year + 1, 3
+    return dates
+
+def generate_synthetic_db(path, n_sectors, n_quarters, seed=42):
+    """Writes a DB with the shipped schema and n_sectors x n_quarters rows."""
+    rng = random.Random(seed)
+    dates = [d.strftime('%Y-%m-%d 00:00:00') for d in _quarter_ends(n_quarters)]
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(f"""
+            DROP TABLE IF EXISTS {sectoral_data_udf.TABLE_NAME};
+            CREATE TABLE "{sectoral_data_udf.TABLE_NAME}" (
+                "sector" TEXT,
+                "date" TIMESTAMP,
+                "{FIELD}" REAL
+            );
+        """)
+        rows = []
+        for i in range(n_sectors):
+            sector = f"Sector {i:04d}"
+            level = rng.uniform(0.05, 0.4)
+            for d in dates:
+                level = min(max(level + rng.gauss(0, 0.005), 0.0), 0.8)
+                rows.append((sector, d, round(level, 5)))
+        with conn:
+            conn.executemany(f"INSERT INTO {sectoral_data_udf.TABLE_NAME} VALUES (?, ?, ?)", rows)
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')) as f:
+            conn.executescript(f.read().replace('sectoral_ebitda_margins', sectoral_data_udf.TABLE_NAME))
+    finally:
+        conn.close()
+
+def describe_db(path):
+    conn = sqlite3.connect(path)
+    try:
+        table = sectoral_data_udf.TABLE_NAME
+        sectors = [r[0] for r in conn.execute(f"SELECT DISTINCT sector FROM {table} ORDER BY sector")]
+        dates = [r[0] for r in conn.execute(f"SELECT DISTINCT date(date) AS d FROM {table} ORDER BY d")]
+        n_rows = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+    return sectors, dates, n_rows
+
+# --- Workloads ---
+#
+# Each workload returns a list of (callable, args) pairs. Dates are passed as
+# datetimes, the way xlwings hands Excel dates to the UDFs.
+
+def _dt(date_str):
+    return datetime.strptime(date_str, '%Y-%m-%d')
+
+def workload_single_grid(sectors, dates, max_calls, rng):
+    cells = [(s, d) for s in sectors for d in dates]
+    if len(cells) > max_calls:
+        cells = rng.sample(cells, max_calls)
+    return [(sectoral_data_udf.get_sectoral_quarterly_data, (s, FIELD, _dt(d))) for s, d in cells]
+
+def workload_series(sectors, dates, max_calls, rng):
+    start, end = _dt(dates[max(0, len(dates) - 20)]), _dt(dates[-1])
+    return [(sectoral_data_udf.get_series, (s, FIELD, start, end)) for s in sectors[:max_calls]]
+
+def workload_history(sectors, dates, max_calls, rng):
+    return [(sectoral_data_udf.get_all_revenue_growth, (s, FIELD)) for s in sectors[:max_calls]]
+
+def workload_matrix(sectors, dates, max_calls, rng):
+    return [(sectoral_data_udf.get_quarterly_matrix, (_dt(d), FIELD)) for d in dates[:max_calls]]
+
+def workload_grid_batch(sectors, dates, max_calls, rng):
+    return [(sectoral_data_udf.get_sectoral_grid, (sectors, [_dt(d) for d in dates], FIELD))]
+
+WORKLOADS = {
+    'single_grid': workload_single_grid,
+    'series_all_sectors': workload_series,
+    'history_all_sectors': workload_history,
+    'matrix_all_dates': workload_matrix,
+    'grid_batch': workload_grid_batch,
+}
+
+# --- Measurement ---
+
+def _percentile(sorted_ms, p):
+    if not sorted_ms:
+        return 0.0
+    k = min(len(sorted_ms) - 1, max(0, int(round(p / 100 * len(sorted_ms) + 0.5)) - 1))
+    return sorted_ms[k]
+
+def run_calls(calls):
+    latencies = []
+    start_time = time.perf_counter()
+    for func, args in calls:
+        t0 = time.perf_counter()
+        func(*args)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    total_s = time.perf_counter() - start_time
+
+    latencies.sort()
+    return {
+        'calls': len(latencies),
+        'total_s': round(total_s, 4),
+        'throughput_per_s': round(len(latencies) / total_s, 1) if total_s else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+        'p50_ms': round(_percentile(latencies, 50), 4),
+        'p95_ms': round(_percentile(latencies, 95), 4),
+        'p99_ms': round(_percentile(latencies, 99), 4),
+        'max_ms': round(latencies[-1], 4) if latencies else 0.0,
+    }
+
+def benchmark_dataset(name, db_path, workloads, max_calls, snapshot=False, seed=0):
+    """Runs every workload cold (empty cache) and then warm (same calls again)."""
+    sectoral_data_udf.use_database(db_path)
+    sectors, dates, n_rows = describe_db(db_path)
+
+    load = None
+    if snapshot:
+        load = sectoral_data_udf.load_snapshot().stats()
+
+    results = []
+    for workload in workloads:
+        calls = WORKLOADS[workload](sectors, dates, max_calls, random.Random(seed))
+        sectoral_data_udf.RESULT_CACHE.clear()
+        for cache_state in ('cold', 'warm'):
+            stats = run_calls(calls)
+            results.append({'dataset': name, 'workload': workload, 'cache': cache_state, **stats})
+            print(
+                f"{name:10s} {workload:20s} {cache_state:5s} | {stats['calls']:6d} calls | "
+                f"{stats['throughput_per_s'] or 0:10.1f}/s | p50 {stats['p50_ms']:.3f} ms | "
+                f"p95 {stats['p95_ms']:.3f} ms | p99 {stats['p99_ms']:.3f} ms",
+                file=sys.stderr,
+            )
+
+    dataset = {
+        'name': name,
+        'sectors': len(sectors),
+        'dates': len(dates),
+        'rows': n_rows,
+        'snapshot': load,
+    }
+    return dataset, results
+
+# --- Cold Start ---
+
+COLD_START_SCRIPT = """
+import time
+t0 = time.perf_counter()
+import sectoral_data_udf
+t1 = time.perf_counter()
+sectoral_data_udf.get_sectoral_quarterly_data({sector!r}, {field!r}, {date!r})
+t2 = time.perf_counter()
+print((t1 - t0) * 1000, (t2 - t1) * 1000)
+"""
+
+def measure_cold_start(runs=5, top=10):
+    """
+    Imports the UDF module in fresh interpreters, like "Restart UDF Server",
+    and reports import time, time to the first formula result, and the
+    slowest modules from `python -X importtime`.
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    sectors, dates, _ = describe_db(sectoral_data_udf.DB_PATH)
+    script = COLD_START_SCRIPT.format(sector=sectors[0], field=FIELD, date=dates[-1])
+
+    imports, first_calls = [], []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, '-c', script], cwd=script_dir,
+            capture_output=True, text=True, check=True,
+        ).stdout.split()
+        imports.append(float(out[0]))
+        first_calls.append(float(out[1]))
+
+    # Self time per module, as printed by -X importtime on stderr
+    trace = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import sectoral_data_udf'],
+        cwd=script_dir, capture_output=True, text=True, check=True,
+    ).stderr
+    modules = []
+    for line in trace.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    modules.sort(key=lambda m: m[1], reverse=True)
+
+    imports.sort()
+    first_calls.sort()
+    return {
+        'runs': runs,
+        'import_ms_median': round(imports[len(imports) // 2], 2),
+        'import_ms_max': round(imports[-1], 2),
+        'first_call_ms_median': round(first_calls[len(first_calls) // 2], 2),
+        'cold_start_ms_median': round(imports[len(imports) // 2] + first_calls[len(first_calls) // 2], 2),
+        'slowest_modules': [
+            {'module': name, 'self_ms': round(s / 1000, 2), 'cumulative_ms': round(c / 1000, 2)}
+            for name, s, c in modules[:top]
+        ],
+    }
+
+# --- Spill Encoding ---
+
+SPILL_WORKLOADS = ('history_all_sectors', 'matrix_all_dates')
+
+def _to_cells(result):
+    """The hand-off xlwings does on return: ndarray.tolist(), or list() per row."""
+    if hasattr(result, 'tolist'):
+        return result.tolist()
+    return [list(row) for row in result]
+
+def _spill_pass(calls, trace=False):
+    """
+    Times each call plus its hand-off; with `trace`, records tracemalloc's
+    peak per call instead (tracing slows both formats alike).
+    """
+    samples = []
+    if trace:
+        tracemalloc.start()
+    try:
+        for func, args in calls:
+            if trace:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            t0 = time.perf_counter()
+            cells = _to_cells(func(*args))
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            samples.append(tracemalloc.get_traced_memory()[1] - before if trace else elapsed_ms)
+            del cells
+    finally:
+        if trace:
+            tracemalloc.stop()
+    return samples
+
+def measure_spill(name, db_path, max_calls):
+    """
+    Runs the full-history and cross-section spills with spill_format = rows
+    and = compact, warm cache, and reports time and peak allocation per call
+    including the conversion to cell lists.
+    """
+    sectoral_data_udf.use_database(db_path)
+    sectors, dates, _ = describe_db(db_path)
+    original_format = sectoral_data_udf.SPILL_FORMAT
+    results = []
+    try:
+        for workload in SPILL_WORKLOADS:
+            calls = WORKLOADS[workload](sectors, dates, max_calls, random.Random(0))
+            for spill_format in ('rows', 'compact'):
+                sectoral_data_udf.SPILL_FORMAT = spill_format
+                _spill_pass(calls)
+                latencies = sorted(_spill_pass(calls))
+                peaks = _spill_pass(calls, trace=True)
+                results.append({
+                    'dataset': name, 'workload': workload, 'spill_format': spill_format,
+                    'calls': len(latencies),
+                    'mean_ms': round(sum(latencies) / len(latencies), 4),
+                    'p95_ms': round(_percentile(latencies, 95), 4),
+                    'peak_kb_mean': round(sum(peaks) / len(peaks) / 1024, 2),
+                    'peak_kb_max': round(max(peaks) / 1024, 2),
+                })
+                print(
+                    f"{name:10s} {workload:20s} {spill_format:7s} | mean {results[-1]['mean_ms']:.3f} ms | "
+                    f"peak {results[-1]['peak_kb_mean']:.1f} KB/call",
+                    file=sys.stderr,
+                )
+    finally:
+        sectoral_data_udf.SPILL_FORMAT = original_format
+    return results
+
+# --- Reporting ---
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def compare(current, baseline_path):
+    """Prints throughput and p95 ratios against an earlier run's JSON."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old = {(r['dataset'], r['workload'], r['cache']): r for r in baseline['results']}
+
+    print(f"\nCompared with {baseline_path} ({baseline['meta'].get('commit')}):", file=sys.stderr)
+    for r in current['results']:
+        prev = old.get((r['dataset'], r['workload'], r['cache']))
+        if not prev or not prev['throughput_per_s'] or not r['p95_ms']:
+            continue
+        speedup = r['throughput_per_s'] / prev['throughput_per_s']
+        p95_ratio = prev['p95_ms'] / r['p95_ms']
+        print(
+            f"{r['dataset']:10s} {r['workload']:20s} {r['cache']:5s} | "
+            f"throughput x{speedup:.2f} | p95 x{p95_ratio:.2f}",
+            file=sys.stderr,
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the UDF query paths without Excel.")
+    parser.add_argument('--synthetic', metavar='SECTORSxQUARTERS',
+                        help="Also benchmark a generated DB, e.g. 1000x400.")
+    parser.add_argument('--skip-shipped', action='store_true', help="Skip the shipped DB.")
+    parser.add_argument('--workloads', default=','.join(WORKLOADS),
+                        help=f"Comma-separated subset of: {', '.join(WORKLOADS)}")
+    parser.add_argument('--max-calls', type=int, default=20000,
+                        help="Cap on calls per workload (single lookups are sampled).")
+    parser.add_argument('--snapshot', action='store_true', help="Run with the in-memory snapshot loaded.")
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+    parser.add_argument('--compare', metavar='BASELINE_JSON', help="Compare against an earlier report.")
+    parser.add_argument('--import-time', action='store_true',
+                        help="Only measure UDF-server cold start (import + first call).")
+    parser.add_argument('--target-ms', type=float,
+                        help="With --import-time, exit non-zero if median cold start exceeds this.")
+    parser.add_argument('--spill', action='store_true',
+                        help="Only compare spill formats (rows vs compact): time and peak memory per call.")
+    args = parser.parse_args()
+
+    if args.import_time:
+        cold = measure_cold_start()
+        print(json.dumps(cold, indent=2))
+        if args.target_ms is not None and cold['cold_start_ms_median'] > args.target_ms:
+            print(f"Cold start {cold['cold_start_ms_median']} ms exceeds target {args.target_ms} ms", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+
+    if args.spill:
+        shipped_db = sectoral_data_udf.DB_PATH
+        spill = measure_spill('shipped', shipped_db, args.max_calls)
+        if args.synthetic:
+            n_sectors, n_quarters = (int(x) for x in args.synthetic.lower().split('x'))
+            with tempfile.TemporaryDirectory() as tmp:
+                synthetic_db = os.path.join(tmp, 'synthetic.db')
+                generate_synthetic_db(synthetic_db, n_sectors, n_quarters)
+                spill += measure_spill(f"synthetic-{n_sectors}x{n_quarters}", synthetic_db, args.max_calls)
+                sectoral_data_udf.use_database(shipped_db)
+        print(json.dumps(spill, indent=2))
+        sys.exit(0)
+
+    workloads = [w.strip() for w in args.workloads.split(',') if w.strip()]
+    unknown = [w for w in workloads if w not in WORKLOADS]
+    if unknown:
+        parser.error(f"Unknown workloads: {unknown}")
+
+    shipped_db = sectoral_data_udf.DB_PATH
+    datasets, results = [], []
+
+    if not args.skip_shipped:
+        dataset, rows = benchmark_dataset('shipped', shipped_db, workloads, args.max_calls, args.snapshot)
+        datasets.append(dataset)
+        results.extend(rows)
+
+    if args.synthetic:
+        n_sectors, n_quarters = (int(x) for x in args.synthetic.lower().split('x'))
+        with tempfile.TemporaryDirectory() as tmp:
+            synthetic_db = os.path.join(tmp, 'synthetic.db')
+            t0 = time.perf_counter()
+            generate_synthetic_db(synthetic_db, n_sectors, n_quarters)
+            print(f"Generated {n_sectors}x{n_quarters} DB in {time.perf_counter() - t0:.1f} s", file=sys.stderr)
+            dataset, rows = benchmark_dataset(
+                f"synthetic-{n_sectors}x{n_quarters}", synthetic_db, workloads, args.max_calls, args.snapshot
+            )
+            datasets.append(dataset)
+            results.extend(rows)
+            sectoral_data_udf.use_database(shipped_db)
+
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'snapshot': args.snapshot,
+            'max_calls': args.max_calls,
+        },
+        'datasets': datasets,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        compare(report, args.compare)
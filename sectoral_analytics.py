@@ -0,0 +1,127 @@
+# numpy is imported on first use so the UDF server starts without it
+np = None
+
+# --- Vectorized Sector x Date Analytics ---
+#
+# Every function takes a 2-D float array shaped (sectors, dates), with NaN
+# for missing cells, and returns an array of the same shape. The dates need
+# not be consecutive: functions that look back in time also take each
+# column's quarter_number() (ascending) and work on a full quarterly grid,
+# so a quarter missing from the table compares as NaN rather than against
+# an older quarter. Where several dates fall in one quarter, each sector's
+# last value in it stands for the quarter. Callers run require_numpy() once
+# before using them.
+
+QUARTERS_PER_YEAR = 4
+
+
+def quarter_number(date_str):
+    """Quarter number (year * 4 + 0..3) of a 'YYYY-MM-DD' date."""
+    return int(date_str[:4]) * 4 + (int(date_str[5:7]) - 1) // 3
+
+
+def require_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("The analytics UDFs require numpy (pip install numpy).")
+        np = numpy
+    return np
+
+
+def _shift(values, periods):
+    """Shifts every row right by `periods` columns, filling with NaN."""
+    shifted = np.full_like(values, np.nan)
+    if periods < values.shape[1]:
+        shifted[:, periods:] = values[:, :values.shape[1] - periods]
+    return shifted
+
+
+def _quarter_grid(values, quarters):
+    """
+    (grid, positions): the columns spread onto every quarter from the first
+    to the last, NaN in between, and each column's position in the grid.
+    Columns sharing a quarter collapse to each row's last non-NaN value.
+    """
+    positions = np.asarray(quarters, dtype=np.int64)
+    if len(positions) == 0:
+        return values, positions
+    positions = positions - positions[0]
+    steps = np.diff(positions)
+    if np.any(steps < 0):
+        raise ValueError("Dates must be in ascending order.")
+    grid = np.full((values.shape[0], int(positions[-1]) + 1), np.nan)
+    if np.all(steps > 0):
+        grid[:, positions] = values
+    else:
+        for j, p in enumerate(positions):
+            column = values[:, j]
+            grid[:, p] = np.where(np.isnan(column), grid[:, p], column)
+    return grid, positions
+
+
+def change(values, quarters, periods=1):
+    """Absolute change versus `periods` quarters earlier (e.g. margin points)."""
+    grid, positions = _quarter_grid(values, quarters)
+    return (grid - _shift(grid, periods))[:, positions]
+
+
+def rolling_mean(values, quarters, window):
+    """Trailing mean over `window` quarters; NaN until the window is full of data."""
+    if window < 1:
+        raise ValueError("window must be at least 1.")
+    values, positions = _quarter_grid(values, quarters)
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+
+    zeros = np.zeros((values.shape[0], 1))
+    sums = np.cumsum(np.hstack([zeros, filled]), axis=1)
+    counts = np.cumsum(np.hstack([zeros, valid.astype(float)]), axis=1)
+
+    result = np.full_like(values, np.nan)
+    if window <= values.shape[1]:
+        window_sums = sums[:, window:] - sums[:, :-window]
+        window_counts = counts[:, window:] - counts[:, :-window]
+        with np.errstate(invalid='ignore'):
+            result[:, window - 1:] = np.where(window_counts == window, window_sums / window, np.nan)
+    return result[:, positions]
+
+
+def zscore(values):
+    """Each value's z-score against its own sector's full history."""
+    with np.errstate(invalid='ignore'):
+        mean = np.nanmean(values, axis=1, keepdims=True)
+        std = np.nanstd(values, axis=1, keepdims=True)
+        result = (values - mean) / std
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+
+def cross_sector_percentile(values):
+    """
+    Percentile rank (0-1) of each sector within its date column, ignoring
+    missing sectors. Ties share the average rank.
+    """
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=0)
+
+    # Double argsort gives 0-based ranks; NaN sorts last so valid ranks come first
+    order = np.argsort(values, axis=0, kind='stable')
+    ranks = np.empty_like(order, dtype=float)
+    np.put_along_axis(ranks, order, np.arange(values.shape[0], dtype=float)[:, None], axis=0)
+
+    # Average ranks across ties
+    for j in np.nonzero(counts)[0]:
+        column = values[:, j]
+        uniques, inverse = np.unique(column[valid[:, j]], return_inverse=True)
+        if len(uniques) < counts[j]:
+            sums = np.bincount(inverse, weights=ranks[valid[:, j], j])
+            sizes = np.bincount(inverse)
+            ranks[valid[:, j], j] = (sums / sizes)[inverse]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.where(counts > 1, ranks / (counts - 1), 1.0)
+    result[~valid] = np.nan
+    return result
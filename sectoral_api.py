@@ -0,0 +1,219 @@
+import sqlite3
+import argparse
+import csv
+import pathlib
+import sys
+from itertools import islice
+
+import sectoral_blobs as blobs
+import sectoral_data_udf as udf
+
+# --- Streaming Python API ---
+#
+# Generators for scripts and notebooks that read more than fits comfortably
+# in memory, e.g. every sector x every field. Unlike the UDF queries they
+# build no result list and cache nothing: each generator opens its own
+# read-only connection when first advanced, fetches rows `chunk_size` at a
+# time with fetchmany() (or one blob block at a time with storage = blobs)
+# and closes the connection when it is exhausted or closed. A generator that
+# is never iterated never opens one. offset/limit page through a
+# result in SQL, so skipped rows are never fetched.
+#
+#   from sectoral_api import iter_series, iter_table
+#   for date, value in iter_series("IT", "curr_ttm_ebitda_margins"):
+#       ...
+#   for sector, date, *values in iter_table():
+#       ...
+#
+#   python sectoral_api.py all_sectors.csv              # stream the table to CSV
+#   python sectoral_api.py it.csv --sectors IT --fields curr_ttm_ebitda_margins
+
+DEFAULT_CHUNK_SIZE = 1000
+KEY_COLUMNS = ('sector', 'date', 'date_key')
+
+
+class _Reader:
+    """
+    The table and fields of the default DB or a named source. Its generators
+    each open a private read-only connection when first advanced.
+    """
+
+    def __init__(self, source=None):
+        src = udf._source(source)
+        db_path, self.table = (udf.DB_PATH, udf.TABLE_NAME) if src is None else (src.db_path, src.table_name)
+        # Named sources are always row tables
+        self.blobs = src is None and udf.STORAGE == 'blobs'
+        self.uri = pathlib.Path(db_path).resolve().as_uri() + '?mode=ro'
+        conn = self.connect()
+        try:
+            if self.blobs:
+                self.columns = []
+                self.fields = blobs.fields(conn, self.table)
+            else:
+                self.columns = [row[1] for row in conn.execute(f"PRAGMA table_info({self.table})")]
+                self.fields = tuple(c for c in self.columns if c not in KEY_COLUMNS)
+        finally:
+            conn.close()
+
+    def connect(self):
+        return sqlite3.connect(self.uri, uri=True)
+
+    def validate(self, fields):
+        for field in fields:
+            if field not in self.fields:
+                raise ValueError(f"Invalid field: '{field}'.")
+        return list(fields)
+
+    def date_columns(self):
+        if 'date_key' in self.columns:
+            return 'date_key', 'date_key'
+        return 'date(date)', 'date'
+
+    def date_filter(self, start_date_str, end_date_str):
+        """Index-friendly date range, as in the UDF queries."""
+        _, date_column = self.date_columns()
+        if date_column == 'date_key':
+            return "date_key BETWEEN ? AND ?", (start_date_str, end_date_str)
+        return "date BETWEEN ? AND ?", (start_date_str, end_date_str + udf.DAY_END)
+
+    def stream(self, sql, params, offset, limit, chunk_size):
+        """Rows of one query, fetched chunk_size at a time on a connection of its own."""
+        conn = self.connect()
+        try:
+            cursor = conn.execute(
+                f"{sql} LIMIT ? OFFSET ?", (*params, -1 if limit is None else limit, offset)
+            )
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                yield from chunk
+        finally:
+            conn.close()
+
+    def slice(self, read, offset, limit):
+        """Pages the iterator read(conn) returns (the blob reads) on a connection of its own."""
+        conn = self.connect()
+        try:
+            yield from islice(read(conn), offset, None if limit is None else offset + limit)
+        finally:
+            conn.close()
+
+
+def _page_args(offset, limit, chunk_size):
+    offset = int(offset or 0)
+    if offset < 0 or (limit is not None and int(limit) < 0) or chunk_size < 1:
+        raise ValueError("offset and limit must be >= 0 and chunk_size >= 1.")
+    return offset, None if limit is None else int(limit)
+
+def value_fields(source=None):
+    """The metric fields available from the default DB or a named source."""
+    return _Reader(source).fields
+
+def iter_series(sector, field, start_date=None, end_date=None, offset=0, limit=None,
+                chunk_size=DEFAULT_CHUNK_SIZE, source=None):
+    """
+    Yields (date, value) for one sector in date order, between two optional
+    dates (YYYY-MM-DD strings or datetimes).
+    """
+    offset, limit = _page_args(offset, limit, chunk_size)
+    start_date_str = udf._format_date(start_date) if start_date is not None else '0000-01-01'
+    end_date_str = udf._format_date(end_date) if end_date is not None else '9999-12-31'
+    sector = udf._resolve_sector(sector, udf._source(source))
+    reader = _Reader(source)
+    field, = reader.validate([field])
+
+    if reader.blobs:
+        def read(conn):
+            return blobs.iter_range(conn, reader.table, sector, field, start_date_str, end_date_str)
+        return reader.slice(read, offset, limit)
+
+    date_select, date_column = reader.date_columns()
+    date_filter, date_params = reader.date_filter(start_date_str, end_date_str)
+    sql = (
+        f"SELECT {date_select}, {field} FROM {reader.table} "
+        f"WHERE sector = ? AND {date_filter} ORDER BY {date_column}"
+    )
+    return reader.stream(sql, (sector, *date_params), offset, limit, chunk_size)
+
+def iter_matrix(date, field, offset=0, limit=None, chunk_size=DEFAULT_CHUNK_SIZE, source=None):
+    """Yields (sector, date, value) for every sector on one date, in sector order."""
+    offset, limit = _page_args(offset, limit, chunk_size)
+    date_str = udf._format_date(date)
+    reader = _Reader(source)
+    field, = reader.validate([field])
+
+    if reader.blobs:
+        # At most one value per sector; read_matrix decodes a single row of each block
+        def read(conn):
+            return iter(blobs.read_matrix(conn, reader.table, field, date_str))
+        return reader.slice(read, offset, limit)
+
+    date_select, _ = reader.date_columns()
+    date_filter, date_params = reader.date_filter(date_str, date_str)
+    sql = f"SELECT sector, {date_select}, {field} FROM {reader.table} WHERE {date_filter} ORDER BY sector"
+    return reader.stream(sql, date_params, offset, limit, chunk_size)
+
+def iter_table(fields=None, sectors=None, offset=0, limit=None, chunk_size=DEFAULT_CHUNK_SIZE, source=None):
+    """
+    Yields (sector, date, *values) for `fields` (default: all) of `sectors`
+    (default: all), ordered by sector and date.
+    """
+    offset, limit = _page_args(offset, limit, chunk_size)
+    if sectors is not None:
+        sectors = [udf._resolve_sector(sector, udf._source(source)) for sector in sectors]
+    reader = _Reader(source)
+    fields = reader.validate(fields or reader.fields)
+
+    if reader.blobs:
+        def read(conn):
+            return _iter_blob_table(conn, reader.table, fields, sectors)
+        return reader.slice(read, offset, limit)
+
+    date_select, date_column = reader.date_columns()
+    sql = f"SELECT sector, {date_select}, {', '.join(fields)} FROM {reader.table}"
+    params = ()
+    if sectors is not None:
+        sql += f" WHERE sector IN ({', '.join('?' * len(sectors))})"
+        params = tuple(sectors)
+    return reader.stream(f"{sql} ORDER BY sector, {date_column}", params, offset, limit, chunk_size)
+
+def _iter_blob_table(conn, table, fields, sectors):
+    """Every field of a sector is encoded over the same dates, so their blocks zip row by row."""
+    names = blobs.sectors(conn, table)
+    if sectors is not None:
+        wanted = set(sectors)
+        names = [s for s in names if s in wanted]
+    for sector in names:
+        columns = [blobs.iter_range(conn, table, sector, field) for field in fields]
+        for cells in zip(*columns):
+            yield (sector, cells[0][0], *(value for _, value in cells))
+
+def export_csv(path, fields=None, sectors=None, chunk_size=DEFAULT_CHUNK_SIZE, source=None):
+    """Streams iter_table() to a CSV file with a header row; returns the number of data rows."""
+    fields = list(fields or value_fields(source))
+    n_rows = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['sector', 'date'] + fields)
+        rows = iter_table(fields, sectors, chunk_size=chunk_size, source=source)
+        for chunk in iter(lambda: list(islice(rows, chunk_size)), []):
+            writer.writerows(chunk)
+            n_rows += len(chunk)
+    return n_rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream the sectoral table to a CSV file in bounded memory.")
+    parser.add_argument('out_path', help="CSV file to write.")
+    parser.add_argument('--fields', nargs='+', help="Fields to export (default: all).")
+    parser.add_argument('--sectors', nargs='+', help="Sectors to export (default: all).")
+    parser.add_argument('--source', help="Named source from config.ini (default: [Database]).")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Rows fetched per round trip.")
+    args = parser.parse_args()
+
+    try:
+        n_rows = export_csv(args.out_path, args.fields, args.sectors, args.chunk_size, args.source)
+        print(f"Wrote {n_rows} rows to {args.out_path}")
+    except Exception as e:
+        print(f"Failed to export: {e}")
+        sys.exit(1)
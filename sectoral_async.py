@@ -0,0 +1,67 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Coalescing Worker Pool ---
+#
+# Async UDFs hand their work to a bounded thread pool so a recalc storm cannot
+# open an unbounded number of SQLite readers. Identical calls that arrive
+# while one is still running share its Future instead of querying again.
+
+
+def _freeze(value):
+    """Makes range arguments (lists of lists) usable as part of a dict key."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class CoalescingExecutor:
+    """Bounded ThreadPoolExecutor that de-duplicates identical in-flight calls."""
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.submitted = 0
+        self.coalesced = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='sectoral-udf'
+        )
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args):
+        """Returns a Future for func(*args), shared with any identical running call."""
+        key = (func.__name__,) + _freeze(args)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            future = self._executor.submit(func, *args)
+            self._in_flight[key] = future
+            self.submitted += 1
+
+        # Registered outside the lock: it runs immediately if already done
+        future.add_done_callback(lambda f: self._release(key, f))
+        return future
+
+    def run(self, func, *args):
+        """Submits and blocks for the result (called from xlwings' async thread)."""
+        return self.submit(func, *args).result()
+
+    def _release(self, key, future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._in_flight)
+        return {
+            'max_workers': self.max_workers,
+            'submitted': self.submitted,
+            'coalesced': self.coalesced,
+            'in_flight': in_flight,
+        }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,270 @@
+import sqlite3
+import argparse
+import functools
+import os
+import sys
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from itertools import accumulate, groupby
+
+from apply_index import get_config
+
+# --- Delta-encoded Blob Storage ---
+#
+# Stores each sector's series per field as a few blocks in <table>_blobs
+# instead of one row per (sector, date):
+#
+#   days    zlib-compressed int32 day deltas from the block's first_day
+#           (a quarterly series is mostly 90/91/92, a daily one all 1s)
+#   vals    raw little-endian float64 (or float32) values, NaN for blanks
+#
+# Each block covers at most BLOCK_SIZE dates and records its first and last
+# day, so a range or single-date query only fetches and decodes the blocks
+# it overlaps. With storage = blobs in config.ini the UDFs read histories,
+# series, cross-sections and grids from here; the row table is only needed
+# to build it, so the blob table may also live in a DB of its own.
+#
+#   python sectoral_blobs.py                           # into the configured DB
+#   python sectoral_blobs.py --out sectoral_blobs.db   # separate blob-only DB
+#   python sectoral_blobs.py --float32                 # half the value bytes
+
+KEY_COLUMNS = ('sector', 'date', 'date_key')
+BLOCK_SIZE = 512
+VALUE_TYPES = {'float64': 'd', 'float32': 'f'}
+MISSING = float('nan')
+
+
+def blob_table(table_name):
+    return f"{table_name}_blobs"
+
+def ensure_blob_schema(conn, table_name, schema='main'):
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {schema}.{blob_table(table_name)} (
+        sector TEXT NOT NULL,
+        field TEXT NOT NULL,
+        block INTEGER NOT NULL,
+        first_day INTEGER NOT NULL,
+        last_day INTEGER NOT NULL,
+        n INTEGER NOT NULL,
+        value_type TEXT NOT NULL,
+        days BLOB NOT NULL,
+        vals BLOB NOT NULL,
+        PRIMARY KEY (sector, field, block)
+    ) WITHOUT ROWID""")
+    # Cross-sections look up one block per sector by date
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS {schema}.idx_{blob_table(table_name)}_field_day "
+        f"ON {blob_table(table_name)} (field, last_day)"
+    )
+
+def has_blobs(conn, table_name):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (blob_table(table_name),)
+    ).fetchone()
+    return row is not None
+
+# --- Encoding ---
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def day_number(date_str):
+    return date.fromisoformat(date_str[:10]).toordinal()
+
+@functools.lru_cache(maxsize=None)
+def day_string(day):
+    """'YYYY-MM-DD' for a day number, interned once per distinct day."""
+    return sys.intern(date.fromordinal(day).isoformat())
+
+def encode_block(days, values, typecode='d'):
+    """(days blob, vals blob) for parallel lists of day numbers and values (None = blank)."""
+    deltas = array('i', [0] + [b - a for a, b in zip(days, days[1:])])
+    vals = array(typecode, [MISSING if v is None else v for v in values])
+    return zlib.compress(_little_endian(deltas).tobytes()), _little_endian(vals).tobytes()
+
+def decode_days(first_day, blob):
+    deltas = _little_endian(array('i', zlib.decompress(blob)))
+    return list(accumulate(deltas, initial=first_day))[1:]
+
+def decode_values(blob, typecode='d', lo=0, hi=None):
+    """Values lo:hi of a block, decoding only that slice; NaN becomes None."""
+    size = array(typecode).itemsize
+    values = array(typecode)
+    values.frombytes(memoryview(blob)[lo * size:None if hi is None else hi * size])
+    _little_endian(values)
+    return [None if v != v else v for v in values]
+
+# --- Reads ---
+
+def fields(conn, table_name):
+    return tuple(row[0] for row in conn.execute(f"SELECT DISTINCT field FROM {blob_table(table_name)} ORDER BY field"))
+
+def sectors(conn, table_name):
+    return [row[0] for row in conn.execute(f"SELECT DISTINCT sector FROM {blob_table(table_name)} ORDER BY sector")]
+
+def read_range(conn, table_name, sector, field, start_date_str=None, end_date_str=None):
+    """(date, value) rows of one sector between two dates, from the overlapping blocks only."""
+    return list(iter_range(conn, table_name, sector, field, start_date_str, end_date_str))
+
+def iter_range(conn, table_name, sector, field, start_date_str=None, end_date_str=None):
+    """Like read_range, but yields the rows one block at a time."""
+    start_day = day_number(start_date_str) if start_date_str else None
+    end_day = day_number(end_date_str) if end_date_str else None
+
+    where = "sector = ? AND field = ?"
+    params = [sector, field]
+    if start_day is not None:
+        where += " AND last_day >= ?"
+        params.append(start_day)
+    if end_day is not None:
+        where += " AND first_day <= ?"
+        params.append(end_day)
+
+    cursor = conn.execute(
+        f"SELECT first_day, value_type, days, vals FROM {blob_table(table_name)} WHERE {where} ORDER BY block",
+        params,
+    )
+    # One block fetched and decoded at a time
+    for first_day, value_type, days_blob, vals_blob in iter(cursor.fetchone, None):
+        days = decode_days(first_day, days_blob)
+        lo = 0 if start_day is None else bisect_left(days, start_day)
+        hi = len(days) if end_day is None else bisect_right(days, end_day)
+        values = decode_values(vals_blob, value_type, lo, hi)
+        yield from zip(map(day_string, days[lo:hi]), values)
+
+def history(conn, table_name, sector, field):
+    """(dates, rows) for one sector's whole history, like the row-table query."""
+    rows = read_range(conn, table_name, sector, field)
+    return [row[0] for row in rows], rows
+
+def read_matrix(conn, table_name, field, date_str):
+    """(sector, date, value) rows for every sector with a value on date_str."""
+    day = day_number(date_str)
+    matrix = []
+    for sector, first_day, value_type, days_blob, vals_blob in conn.execute(
+        f"SELECT sector, first_day, value_type, days, vals FROM {blob_table(table_name)} "
+        f"WHERE field = ? AND last_day >= ? AND first_day <= ? ORDER BY sector",
+        (field, day, day),
+    ):
+        days = decode_days(first_day, days_blob)
+        i = bisect_left(days, day)
+        if i < len(days) and days[i] == day:
+            value = decode_values(vals_blob, value_type, i, i + 1)[0]
+            if value is not None:
+                matrix.append((sector, date_str, value))
+    return matrix
+
+def plan_statements(table_name, field):
+    """The blob reads above, for the startup query plan check."""
+    table = blob_table(table_name)
+    return {
+        'blob history': (
+            f"SELECT first_day, value_type, days, vals FROM {table} "
+            f"WHERE sector = ? AND field = ? AND last_day >= ? AND first_day <= ? ORDER BY block",
+            ('IT', field, 0, 0), False,
+        ),
+        'blob matrix': (
+            f"SELECT sector, first_day, value_type, days, vals FROM {table} "
+            f"WHERE field = ? AND last_day >= ? AND first_day <= ? ORDER BY sector",
+            (field, 0, 0), False,
+        ),
+    }
+
+# --- Build ---
+
+def update_blobs(conn, table_name, sectors=None, value_type='float64', block_size=BLOCK_SIZE, schema='main'):
+    """
+    Re-encodes the blocks of `sectors` (every sector if None) inside the
+    caller's transaction, into <table>_blobs of the attached `schema`.
+    Returns (sectors, blocks, payload bytes) written.
+    """
+    typecode = VALUE_TYPES[value_type]
+    target = f"{schema}.{blob_table(table_name)}"
+    columns = [row[1] for row in conn.execute(f"PRAGMA main.table_info({table_name})")]
+    value_fields = [c for c in columns if c not in KEY_COLUMNS]
+    select = f"SELECT sector, date(date), {', '.join(value_fields)} FROM main.{table_name}"
+    params = ()
+    if sectors is not None:
+        sectors = sorted(set(sectors))
+        select += f" WHERE sector IN ({', '.join('?' * len(sectors))})"
+        params = tuple(sectors)
+
+    ensure_blob_schema(conn, table_name, schema)
+    if sectors is None:
+        conn.execute(f"DELETE FROM {target}")
+    else:
+        conn.execute(f"DELETE FROM {target} WHERE sector IN ({', '.join('?' * len(sectors))})", params)
+
+    n_sectors = n_blocks = n_bytes = 0
+    # One sector in memory at a time; rows arrive grouped by the ORDER BY
+    cursor = conn.execute(f"{select} ORDER BY sector, date", params)
+    for sector, group in groupby(cursor, key=lambda row: row[0]):
+        rows = list(group)
+        days = [day_number(row[1]) for row in rows]
+        blocks = []
+        for k, field in enumerate(value_fields):
+            values = [row[2 + k] for row in rows]
+            for b, lo in enumerate(range(0, len(rows), block_size)):
+                hi = lo + block_size
+                days_blob, vals_blob = encode_block(days[lo:hi], values[lo:hi], typecode)
+                blocks.append((
+                    sector, field, b, days[lo], days[min(hi, len(days)) - 1],
+                    len(days[lo:hi]), typecode, days_blob, vals_blob,
+                ))
+                n_bytes += len(days_blob) + len(vals_blob)
+        conn.executemany(f"INSERT INTO {target} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", blocks)
+        n_sectors += 1
+        n_blocks += len(blocks)
+    return n_sectors, n_blocks, n_bytes
+
+def build_blobs(db_path, table_name, out_path=None, sectors=None, value_type='float64', block_size=BLOCK_SIZE):
+    """
+    Encodes the row table's histories into <table>_blobs in out_path
+    (default: the same DB) in its own transaction. Only `sectors` are
+    re-encoded if given, else all. Returns a summary dict.
+    """
+    start_time = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    try:
+        schema = 'main'
+        if out_path and os.path.abspath(out_path) != os.path.abspath(db_path):
+            conn.execute("ATTACH DATABASE ? AS blob_out", (out_path,))
+            schema = 'blob_out'
+        with conn:
+            n_sectors, n_blocks, n_bytes = update_blobs(conn, table_name, sectors, value_type, block_size, schema)
+    finally:
+        conn.close()
+
+    return {
+        'sectors': n_sectors,
+        'blocks': n_blocks,
+        'payload_kb': round(n_bytes / 1024, 1),
+        'time_ms': round((time.perf_counter() - start_time) * 1000, 2),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the delta-encoded blob storage from the row table.")
+    parser.add_argument('--out', help="Write the blob table to this DB instead of the configured one.")
+    parser.add_argument('--float32', action='store_true', help="Store values as float32 (about 7 significant digits).")
+    args = parser.parse_args()
+
+    try:
+        config = get_config()
+        script_dir = os.path.dirname(__file__)
+        db_full_path = os.path.join(script_dir, config.get('db_path'))
+        table_name = config.get('table_name')
+
+        result = build_blobs(
+            db_full_path, table_name, args.out, value_type='float32' if args.float32 else 'float64'
+        )
+        print(
+            f"Encoded {result['sectors']} sectors into {result['blocks']} blocks "
+            f"({result['payload_kb']} KB) in {result['time_ms']} ms."
+        )
+    except Exception as e:
+        print(f"Failed to build blobs: {e}")
+        sys.exit(1)
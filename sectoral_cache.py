@@ -0,0 +1,166 @@
+import threading
+import time
+import functools
+from collections import OrderedDict
+
+# --- Shared Result Cache ---
+#
+# One LRU cache for every query function. When `version_fn()` reports a new
+# DB version the whole cache is dropped, so a refreshed DB never serves
+# stale values. A `refresh_fn(old, new)` hook may instead invalidate
+# selectively and return True. Every sync, invalidate and clear bumps a
+# generation counter; a value computed while the generation moved may come
+# from the old DB and is returned but not stored. Only successful results
+# are stored: anything that raises is recomputed on the next call.
+
+_MISSING = object()
+
+
+class ResultCache:
+    """Thread-safe LRU + TTL cache keyed on (function, args) and DB version."""
+
+    def __init__(self, maxsize=4096, ttl_seconds=0, version_fn=None, refresh_fn=None, on_hit=None):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.version_fn = version_fn
+        self.refresh_fn = refresh_fn
+        self.on_hit = on_hit
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version_lock = threading.Lock()
+
+    def sync(self):
+        """Checks the DB version and invalidates entries if it has moved."""
+        if self.version_fn is None:
+            return
+        current = self.version_fn()
+        if current == self.version:
+            return
+
+        with self._version_lock:
+            if current == self.version:
+                return
+            previous = self.version
+            handled = self.refresh_fn is not None and self.refresh_fn(previous, current)
+            with self._lock:
+                if previous is not None:
+                    self.invalidations += 1
+                if not handled:
+                    self._entries.clear()
+                self.version = current
+                self.generation += 1
+
+    def peek(self, key):
+        """Returns a live cached value without touching counters, or _MISSING."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        value, stored_at = entry
+        if self.ttl_seconds and time.monotonic() - stored_at > self.ttl_seconds:
+            return _MISSING
+        return value
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached value for key, computing and storing it on a miss."""
+        self.sync()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if not self.ttl_seconds or time.monotonic() - stored_at <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    hit = True
+                else:
+                    del self._entries[key]
+                    hit = False
+            else:
+                hit = False
+            if not hit:
+                self.misses += 1
+            generation = self.generation
+
+        if hit:
+            if self.on_hit is not None:
+                self.on_hit()
+            return value
+
+        # Computed outside the lock; an exception propagates and nothing is stored
+        value = compute()
+        self.put(key, value, generation)
+        return value
+
+    def put(self, key, value, generation=None):
+        """
+        Stores a value computed elsewhere, e.g. one of several fetched
+        together. Pass the `generation` read before computing it to skip the
+        store if the cache was synced or invalidated in the meantime.
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def cached(self, func):
+        """Decorator form of get_or_compute, keyed on the function name and args."""
+        name = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            return self.get_or_compute((name,) + args, lambda: func(*args))
+
+        wrapper.cache_key = lambda *args: (name,) + args
+        return wrapper
+
+    def invalidate(self, predicate):
+        """Drops every entry whose key matches predicate; returns the count."""
+        with self._lock:
+            stale = [key for key in self._entries if predicate(key)]
+            for key in stale:
+                del self._entries[key]
+            self.generation += 1
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def reset(self):
+        """Clears entries and forgets the DB version, e.g. after switching DBs."""
+        with self._version_lock, self._lock:
+            self._entries.clear()
+            self.version = None
+            self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'size': size,
+            'maxsize': self.maxsize,
+            'ttl_seconds': self.ttl_seconds,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+def is_missing(value):
+    """True if peek() found nothing usable."""
+    return value is _MISSING
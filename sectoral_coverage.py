@@ -0,0 +1,191 @@
+import sqlite3
+import argparse
+import json
+import os
+import sys
+import time
+from calendar import monthrange
+from itertools import groupby
+
+from apply_index import get_config
+from sectoral_analytics import quarter_number
+
+# --- Coverage Index ---
+#
+# Keeps <table>_coverage next to the base table, one row per sector:
+#
+#   first_date, last_date   the sector's date range
+#   n_dates                 dates with a row
+#   missing_quarters        comma-separated quarter-ends inside the range
+#                           with no row for the sector
+#   null_counts             JSON {field: rows with a blank value}
+#
+# sectoral_loader.py updates the loaded sectors' rows in the same
+# transaction as the data, so the index never lags the table. The UDFs
+# answer get_coverage from it and skip reading a sector's history when a
+# requested range lies wholly outside first_date..last_date.
+#
+#   python sectoral_coverage.py                 # build (or rebuild) and report gaps
+#   python sectoral_coverage.py --no-write      # report only
+#   python sectoral_coverage.py --sectors IT    # refresh some sectors
+
+KEY_COLUMNS = ('sector', 'date', 'date_key')
+
+
+def coverage_table(table_name):
+    return f"{table_name}_coverage"
+
+def ensure_coverage_schema(conn, table_name):
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {coverage_table(table_name)} (
+        sector TEXT PRIMARY KEY,
+        first_date TEXT NOT NULL,
+        last_date TEXT NOT NULL,
+        n_dates INTEGER NOT NULL,
+        missing_quarters TEXT NOT NULL,
+        null_counts TEXT NOT NULL
+    ) WITHOUT ROWID""")
+
+def has_coverage(conn, table_name):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (coverage_table(table_name),)
+    ).fetchone()
+    return row is not None
+
+# --- Summaries ---
+
+def _quarter_end(quarter):
+    year, month = divmod(quarter, 4)
+    month = month * 3 + 3
+    return f"{year:04d}-{month:02d}-{monthrange(year, month)[1]:02d}"
+
+def summarize(dates, columns):
+    """
+    Coverage record of one sector from its sorted dates and {field: values}
+    (None = blank), or None if it has no rows.
+    """
+    if not dates:
+        return None
+    present = {quarter_number(d) for d in dates}
+    first, last = quarter_number(dates[0]), quarter_number(dates[-1])
+    return {
+        'first_date': dates[0],
+        'last_date': dates[-1],
+        'n_dates': len(dates),
+        'missing': [_quarter_end(q) for q in range(first, last + 1) if q not in present],
+        'nulls': {field: sum(1 for v in values if v is None) for field, values in columns.items()},
+    }
+
+def compute_coverage(conn, table_name, sectors=None):
+    """{sector: record} from the base table, for `sectors` or every sector."""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+    fields = [c for c in columns if c not in KEY_COLUMNS]
+    select = f"SELECT sector, date(date), {', '.join(fields)} FROM {table_name}"
+    params = ()
+    if sectors is not None:
+        params = tuple(sorted(set(sectors)))
+        select += f" WHERE sector IN ({', '.join('?' * len(params))})"
+
+    records = {}
+    # One sector in memory at a time; rows arrive grouped by the ORDER BY
+    for sector, group in groupby(conn.execute(f"{select} ORDER BY sector, date", params), key=lambda row: row[0]):
+        rows = list(group)
+        records[sector] = summarize(
+            [row[1] for row in rows], {field: [row[2 + k] for row in rows] for k, field in enumerate(fields)}
+        )
+    return records
+
+# --- Build / Update ---
+
+def update_coverage(conn, table_name, sectors=None):
+    """
+    Recomputes the rows of `sectors` (every sector if None) inside the
+    caller's transaction. Returns the number of sectors written.
+    """
+    ensure_coverage_schema(conn, table_name)
+    records = compute_coverage(conn, table_name, sectors)
+    target = coverage_table(table_name)
+    if sectors is None:
+        conn.execute(f"DELETE FROM {target}")
+    else:
+        sectors = sorted(set(sectors))
+        conn.execute(f"DELETE FROM {target} WHERE sector IN ({', '.join('?' * len(sectors))})", tuple(sectors))
+    conn.executemany(
+        f"INSERT INTO {target} VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (
+                sector, r['first_date'], r['last_date'], r['n_dates'],
+                ','.join(r['missing']), json.dumps(r['nulls'], sort_keys=True),
+            )
+            for sector, r in records.items()
+        ],
+    )
+    return len(records)
+
+def refresh_coverage(db_path, table_name, sectors=None):
+    """Builds or updates the coverage table in its own transaction; returns a summary dict."""
+    start_time = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            n_sectors = update_coverage(conn, table_name, sectors)
+    finally:
+        conn.close()
+    return {
+        'mode': 'full' if sectors is None else 'incremental',
+        'sectors': n_sectors,
+        'time_ms': round((time.perf_counter() - start_time) * 1000, 2),
+    }
+
+# --- Reads ---
+
+def _record(row):
+    first_date, last_date, n_dates, missing, nulls = row
+    return {
+        'first_date': first_date,
+        'last_date': last_date,
+        'n_dates': n_dates,
+        'missing': missing.split(',') if missing else [],
+        'nulls': json.loads(nulls),
+    }
+
+def read_coverage(conn, table_name, sector=None):
+    """One sector's record (None if it has no rows), or {sector: record} for all if sector is None."""
+    select = (
+        f"SELECT sector, first_date, last_date, n_dates, missing_quarters, null_counts "
+        f"FROM {coverage_table(table_name)}"
+    )
+    if sector is None:
+        return {row[0]: _record(row[1:]) for row in conn.execute(f"{select} ORDER BY sector")}
+    row = conn.execute(f"{select} WHERE sector = ?", (sector,)).fetchone()
+    return _record(row[1:]) if row is not None else None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the coverage index and report each sector's gaps.")
+    parser.add_argument('--sectors', nargs='+', help="Only refresh these sectors (default: all).")
+    parser.add_argument('--no-write', action='store_true', help="Only report; don't write the coverage table.")
+    args = parser.parse_args()
+
+    try:
+        config = get_config()
+        script_dir = os.path.dirname(__file__)
+        db_full_path = os.path.join(script_dir, config.get('db_path'))
+        table_name = config.get('table_name')
+
+        if not args.no_write:
+            result = refresh_coverage(db_full_path, table_name, args.sectors)
+            print(f"Coverage refreshed ({result['mode']}): {result['sectors']} sector(s) in {result['time_ms']} ms.")
+
+        conn = sqlite3.connect(db_full_path)
+        try:
+            records = compute_coverage(conn, table_name, args.sectors)
+        finally:
+            conn.close()
+        for sector, r in records.items():
+            blanks = ', '.join(f"{field}: {n}" for field, n in r['nulls'].items() if n)
+            print(
+                f"{sector:32s} | {r['first_date']} .. {r['last_date']} | {r['n_dates']:4d} dates | "
+                f"missing: {', '.join(r['missing']) or '-'} | blank: {blanks or '-'}"
+            )
+    except Exception as e:
+        print(f"Failed to build coverage: {e}")
+        sys.exit(1)
@@ -1,14 +1,56 @@
-<<<<<<< HEAD
-import xlwings as xw
-import sqlite3
 import configparser
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+import atexit
+import queue
 import time
 import os
 import sys
 import functools
-from datetime import datetime
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, date
+
+import sectoral_analytics as analytics
+import sectoral_blobs as blobs
+import sectoral_coverage as coverage
+from sectoral_async import CoalescingExecutor
+from sectoral_cache import ResultCache, is_missing
+from sectoral_db import ReadOnlyConnectionPool
+from sectoral_export import configured_export_dir, is_fresh, open_export, publish_export
+from sectoral_loader import read_changes
+import sectoral_materialize as materialized
+from sectoral_names import SectorIndex
+import sectoral_plans as plans
+from sectoral_snapshot import SectoralSnapshot
+from sectoral_sources import SectoralSource, SourceFanOut, read_source_config
+from sectoral_telemetry import Telemetry, TELEMETRY_FILE
+
+# --- Lazy xlwings ---
+
+class _DeferredXlwings:
+    """No-op stand-in for the xlwings decorators outside the UDF server."""
+
+    @staticmethod
+    def func(f=None, **kwargs):
+        if f is None:
+            return lambda g: g
+        return f
+
+    @staticmethod
+    def arg(*args, **kwargs):
+        return lambda f: f
+
+    ret = arg
+
+# Importing xlwings pulls in pandas and costs about half a second. The UDF
+# server has always imported it before loading this module, so the real
+# decorators are used there; CLI scripts, tests and benchmarks skip it.
+# Set SECTORAL_UDF_XLWINGS=1 to force the real decorators.
+if 'xlwings' in sys.modules or os.environ.get('SECTORAL_UDF_XLWINGS') == '1':
+    import xlwings as xw
+else:
+    xw = _DeferredXlwings()
 
 # --- Configuration & Logging Setup ---
 
@@ -16,7 +58,7 @@ sys.path.append(os.path.dirname(__file__))
 
 # Setup logging
 def setup_logging():
-    """Configures a rotating file logger."""
+    """Configures a rotating file logger written from a background thread."""
     log_file = 'query_log.txt'
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.INFO)
@@ -33,7 +75,13 @@ def setup_logging():
         datefmt='%Y-%m-%d %H:%M:%S'
     )
     handler.setFormatter(formatter)
-    logger.addHandler(handler)
+
+    # Callers only enqueue records; the listener thread does the file I/O
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
     
     return logger
 
@@ -57,19 +105,62 @@ def get_config():
         
     return config['Database']
 
+SNAPSHOT_MODE = False
+CACHE_SIZE = 4096
+CACHE_TTL_SECONDS = 0
+ASYNC_WORKERS = 4
+TELEMETRY_HIT_SAMPLE_RATE = 0.1
+PREWARM = False
+SNAPSHOT_EXPORT_DIR = ''
+SHARE_SNAPSHOT = False
+CHECK_QUERY_PLANS = True
+STORAGE = 'rows'
+AUTO_INDEX = True
+SERVICE_URL = ''
+SOURCE_NAME = 'default'
+SOURCE_CONFIG = {}
+SERVICE_TIMEOUT_SECONDS = 30.0
+SERVICE_RETRY_SECONDS = 60.0
+SPILL_FORMAT = 'rows'
+SECTOR_ALIASES = {}
+
 try:
     config = get_config()
     # Build absolute path to DB from script location
     script_dir = os.path.dirname(__file__)
     DB_PATH = os.path.join(script_dir, config.get('db_path'))
     TABLE_NAME = config.get('table_name')
-    
-    # Field validation: Prevent SQL injection on column/table names
-    SAFE_FIELDS = ('curr_ttm_ebitda_margins', 'sector', 'date')
+    SNAPSHOT_MODE = config.getboolean('snapshot_mode', fallback=False)
+    CACHE_SIZE = config.getint('cache_size', fallback=CACHE_SIZE)
+    CACHE_TTL_SECONDS = config.getfloat('cache_ttl_seconds', fallback=CACHE_TTL_SECONDS)
+    ASYNC_WORKERS = config.getint('async_workers', fallback=ASYNC_WORKERS)
+    TELEMETRY_HIT_SAMPLE_RATE = config.getfloat('telemetry_hit_sample_rate', fallback=TELEMETRY_HIT_SAMPLE_RATE)
+    PREWARM = config.getboolean('prewarm', fallback=False)
+    CHECK_QUERY_PLANS = config.getboolean('check_query_plans', fallback=CHECK_QUERY_PLANS)
+    AUTO_INDEX = config.getboolean('auto_index', fallback=AUTO_INDEX)
+    SHARE_SNAPSHOT = config.getboolean('share_snapshot', fallback=False)
+    SNAPSHOT_EXPORT_DIR = configured_export_dir(config, script_dir, DB_PATH)
+    # Sharing is only useful if this process attaches to the snapshot too
+    SNAPSHOT_MODE = SNAPSHOT_MODE or SHARE_SNAPSHOT
+    SERVICE_URL = config.get('service_url', fallback=SERVICE_URL).strip()
+    SERVICE_TIMEOUT_SECONDS = config.getfloat('service_timeout_seconds', fallback=SERVICE_TIMEOUT_SECONDS)
+    SERVICE_RETRY_SECONDS = config.getfloat('service_retry_seconds', fallback=SERVICE_RETRY_SECONDS)
+    SPILL_FORMAT = config.get('spill_format', fallback=SPILL_FORMAT).strip().lower()
+    STORAGE = config.get('storage', fallback=STORAGE).strip().lower()
     
     # Basic validation for table name (allow alphanumeric and underscore)
     if not (TABLE_NAME and TABLE_NAME.replace('_', '').isalnum()):
         raise ValueError(f"Invalid table name in config: {TABLE_NAME}")
+    if SPILL_FORMAT not in ('rows', 'compact'):
+        raise ValueError(f"Invalid spill_format in config: {SPILL_FORMAT} (use rows or compact)")
+    if STORAGE not in ('rows', 'blobs'):
+        raise ValueError(f"Invalid storage in config: {STORAGE} (use rows or blobs)")
+
+    # [Database] is the default source; [Source:<name>] sections add more
+    SOURCE_NAME = config.get('source_name', fallback=SOURCE_NAME).strip()
+    SOURCE_CONFIG = read_source_config(config.parser, script_dir, TABLE_NAME)
+    if config.parser.has_section('Sector Aliases'):
+        SECTOR_ALIASES = dict(config.parser['Sector Aliases'])
 
     logger.info(f"Config loaded. DB_PATH: {DB_PATH}, TABLE_NAME: {TABLE_NAME}")
 
@@ -77,66 +168,295 @@ except Exception as e:
     logger.error(f"Failed to load configuration: {e}")
     # This will cause UDFs to fail, which is intended.
 
-# --- Database Connection ---
+# --- Snapshot Mode ---
 
-def get_db_connection():
-    """Establishes a connection to the SQLite database."""
+SNAPSHOT = None
+
+def load_snapshot():
+    """Loads the whole table into memory so UDFs skip SQL entirely."""
     if not os.path.exists(DB_PATH):
-        logger.error(f"Database file not found at {DB_PATH}")
         raise FileNotFoundError(f"Database file not found: {DB_PATH}")
-    
-    conn = sqlite3.connect(DB_PATH)
-    # Return rows as tuples, which is efficient
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Records the DB version the snapshot is built from, so the next load
+    # is seen as a change rather than as the cache's first sync
+    RESULT_CACHE.sync()
+    return _load_snapshot()
+
+def _load_snapshot():
+    """load_snapshot() without the cache sync; the cache's refresh hook calls this."""
+    global SNAPSHOT
+    # The first process to see the DB change republishes the shared export
+    if SHARE_SNAPSHOT and SNAPSHOT_EXPORT_DIR and not is_fresh(SNAPSHOT_EXPORT_DIR, DB_PATH, TABLE_NAME):
+        manifest = publish_export(DB_PATH, TABLE_NAME, SNAPSHOT_EXPORT_DIR, _value_fields())
+        if manifest is not None:
+            logger.info(f"Published shared snapshot {manifest['export_id']} in {manifest['time_ms']} ms")
+
+    # A current .npy export is memory-mapped instead of read row by row
+    if SNAPSHOT_EXPORT_DIR and is_fresh(SNAPSHOT_EXPORT_DIR, DB_PATH, TABLE_NAME):
+        SNAPSHOT = open_export(SNAPSHOT_EXPORT_DIR)
+    else:
+        if SNAPSHOT_EXPORT_DIR:
+            logger.info(f"Snapshot export {SNAPSHOT_EXPORT_DIR} missing or stale, loading from the DB")
+        SNAPSHOT = SectoralSnapshot.load(DB_PATH, TABLE_NAME, _value_fields())
+
+    # Results cached before the snapshot existed came from SQL; drop them
+    RESULT_CACHE.clear()
+
+    stats = SNAPSHOT.stats()
+    logger.info(
+        f"Snapshot loaded | Sectors: {stats['sectors']} | Dates: {stats['dates']} | "
+        f"Memory: {stats['memory_kb']} KB ({stats['backing']}) | Time: {stats['load_time_ms']:.2f} ms"
+    )
+    return SNAPSHOT
+
+def _snapshot_for(field):
+    """Returns the snapshot if it can serve this field, else None."""
+    if SNAPSHOT is not None and SNAPSHOT.has_field(field):
+        # Picks up loader changes before answering without SQL
+        RESULT_CACHE.sync()
+        TELEMETRY.mark_source('snapshot')
+        return SNAPSHOT
+    return None
+
+# --- Database Connection ---
+
+DB_POOL = None
+_pool_lock = threading.Lock()
+
+def _on_db_change():
+    """Drops state derived from the previous DB file."""
+    logger.info(f"Database file changed, reopening connections: {DB_PATH}")
+    _get_columns.cache_clear()
+    _blob_fields.cache_clear()
+
+def _get_pool():
+    """Creates the connection pool on first use."""
+    global DB_POOL
+    if DB_POOL is None:
+        with _pool_lock:
+            if DB_POOL is None:
+                pool = ReadOnlyConnectionPool(DB_PATH)
+                pool.on_change(_on_db_change)
+                DB_POOL = pool
+    return DB_POOL
+
+def get_db_connection():
+    """Returns this thread's pooled read-only connection to the SQLite database."""
+    TELEMETRY.mark_source('sql')
+    try:
+        return _get_pool().get()
+    except FileNotFoundError as e:
+        logger.error(str(e))
+        raise
+
+def use_database(db_path):
+    """
+    Points every query at another DB file (e.g. a benchmark copy). Closes
+    pooled connections and drops caches and the snapshot built from the old one.
+    """
+    global DB_PATH, DB_POOL, SNAPSHOT, _last_change_id
+    with _pool_lock:
+        if DB_POOL is not None:
+            DB_POOL.close_all()
+        DB_POOL = None
+        DB_PATH = db_path
+    SNAPSHOT = None
+    _last_change_id = None
+    _get_columns.cache_clear()
+    _blob_fields.cache_clear()
+    RESULT_CACHE.reset()
+    logger.info(f"Using database: {DB_PATH}")
+
+# --- Named Sources ---
+
+SOURCES = {
+    name: SectoralSource(name, db_path, table_name, cache_size=CACHE_SIZE)
+    for name, (db_path, table_name) in SOURCE_CONFIG.items()
+}
+SOURCE_FAN_OUT = SourceFanOut(max_workers=max(2, len(SOURCES) + 1))
+
+def _source_names():
+    return [SOURCE_NAME] + sorted(SOURCES)
+
+def _source(name):
+    """Resolves a UDF's optional `source` argument; None means the default DB."""
+    name = str(name).strip() if name is not None else ''
+    if not name or name == SOURCE_NAME:
+        return None
+    if name not in SOURCES:
+        raise ValueError(f"Unknown source: '{name}'. Use one of {', '.join(_source_names())}.")
+    return SOURCES[name]
+
+# --- Result Cache ---
+
+def _db_version():
+    """Identifies the DB file contents; changes whenever the file is rewritten."""
+    pool = _get_pool()
+    pool.get()
+    return pool.signature
+
+_last_change_id = None
+
+# Cached results that span every sector; any logged change drops them
+TABLE_WIDE_CACHE_KEYS = (
+    '_sector_list', '_sector_index', '_query_grid', '_field_matrix', '_analytic', '_materialized_fresh',
+    '_coverage_table',
+)
+
+def _apply_db_changes(previous, current):
+    """
+    Cache refresh hook: when the DB was updated in place by sectoral_loader,
+    invalidates only the sectors and dates its change log lists and patches
+    the snapshot. Returns False to request a full cache clear otherwise,
+    including when the file changed but the log has no new entries (a
+    manual UPDATE, a migration or an index build).
+    """
+    global _last_change_id
+    conn = get_db_connection()
+    since_id = _last_change_id
+    log = read_changes(conn, TABLE_NAME, since_id)
+    _last_change_id = log[0] if log is not None else None
+
+    # Same inode means the file was written in place rather than replaced
+    in_place = previous is not None and previous[0] == current[0]
+    if log is None or since_id is None or not in_place or log[0] <= since_id:
+        if previous is not None and SNAPSHOT is not None:
+            _load_snapshot()
+        return False
+
+    changes = log[1]
+    sectors = {sector for sector, _ in changes}
+    dates = {date_key for _, date_key in changes}
+
+    def affected(key):
+        if key[0] in TABLE_WIDE_CACHE_KEYS:
+            return True
+        return len(key) > 1 and (key[1] in sectors or key[1] in dates)
+
+    dropped = RESULT_CACHE.invalidate(affected)
+
+    if SNAPSHOT is not None and changes:
+        fields = list(SNAPSHOT.values)
+        rows = conn.execute(_sectors_sql(fields, len(sectors)), tuple(sorted(sectors))).fetchall()
+        wanted = [row for row in rows if row[1] in dates]
+        if not SNAPSHOT.apply_rows(fields, wanted):
+            _load_snapshot()
+
+    logger.info(
+        f"Applied {len(changes)} logged changes | Sectors: {len(sectors)} | "
+        f"Dates: {len(dates)} | Cache entries dropped: {dropped}"
+    )
+    return True
+
+RESULT_CACHE = ResultCache(
+    maxsize=CACHE_SIZE, ttl_seconds=CACHE_TTL_SECONDS,
+    version_fn=_db_version, refresh_fn=_apply_db_changes,
+    on_hit=lambda: TELEMETRY.mark_source('cache'),
+)
 
 # --- Performance & Logging Decorator ---
 
+# Per-call timings go to TELEMETRY_FILE as JSON lines via a background
+# writer; query_log.txt keeps config, snapshot and error messages.
+TELEMETRY = Telemetry(
+    log_file=os.path.join(os.path.dirname(os.path.abspath(__file__)), TELEMETRY_FILE),
+    hit_sample_rate=TELEMETRY_HIT_SAMPLE_RATE,
+)
+
 def log_and_time(func):
-    """Decorator to log function execution time and errors."""
+    """Decorator to record function execution time, data source and errors."""
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         func_name = func.__name__
-        # Format args for logging, handle potential datetime objects
-        log_args = []
-        for arg in args:
-            if isinstance(arg, datetime):
-                log_args.append(arg.strftime('%Y-%m-%d'))
-            else:
-                log_args.append(str(arg))
-        
-        start_time = time.perf_counter()
+        token = TELEMETRY.begin()
+        status = "SUCCESS"
+        error = None
         
         try:
-            result = func(*args, **kwargs)
-            status = "SUCCESS"
-            return result
+            return func(*args, **kwargs)
         
         except Exception as e:
-            status = f"FAILURE: {e}"
-            logger.error(f"Function: {func_name}, Args: {log_args}, Error: {e}")
+            status = "FAILURE"
+            error = str(e)
+            logger.error(f"Function: {func_name}, Args: {list(args)}, Error: {e}")
             # Propagate error to Excel UDF
             return f"Error: {e}"
         
         finally:
-            end_time = time.perf_counter()
-            exec_time_ms = (end_time - start_time) * 1000
-    
-            log_message = (
-                f"Function: {func_name} | "
-                f"Args: {log_args} | "
-                f"Status: {status} | "
-                f"Time: {exec_time_ms:.2f} ms"
-            )
-            logger.info(log_message)
+            TELEMETRY.end(token, func_name, args, status, error)
             
     return wrapper
 
+# --- Index-friendly Date Filtering ---
+
+# Stored dates look like 'YYYY-MM-DD 00:00:00'. Filtering on date(date) hides
+# the column from idx_sector_date, so filters compare the raw column against
+# a whole-day range instead, or use the date_key column added by
+# `python apply_index.py --migrate-dates` when it exists.
+DAY_END = ' 23:59:59'
+
+@functools.lru_cache(maxsize=1)
+def _get_columns():
+    """Returns the table's column names (cached until the DB file changes)."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"PRAGMA table_info({TABLE_NAME})")
+        return [row[1] for row in cursor.fetchall()]
+
+def _date_columns():
+    """Returns (select_expr, filter_column) for the date column in use."""
+    if 'date_key' in _get_columns():
+        return 'date_key', 'date_key'
+    return 'date(date)', 'date'
+
+def _date_range_filter(start_date_str, end_date_str):
+    """Builds a sargable 'BETWEEN' clause and its params for a date range."""
+    _, filter_column = _date_columns()
+    if filter_column == 'date_key':
+        return "date_key BETWEEN ? AND ?", (start_date_str, end_date_str)
+    return "date BETWEEN ? AND ?", (start_date_str, end_date_str + DAY_END)
+
+# Keyed reads, shared by the queries below and the startup plan check
+
+def _history_sql(fields):
+    """One sector's whole history for `fields`, in date order."""
+    date_select, date_column = _date_columns()
+    return (
+        f"SELECT {date_select} as formatted_date, {', '.join(fields)} FROM {TABLE_NAME} "
+        f"WHERE sector = ? ORDER BY {date_column}"
+    )
+
+def _cross_section_sql(field, date_filter):
+    """Every sector's value within `date_filter`, in sector order."""
+    date_select, _ = _date_columns()
+    return (
+        f"SELECT sector, {date_select} as formatted_date, {field} FROM {TABLE_NAME} "
+        f"WHERE {date_filter} ORDER BY sector"
+    )
+
+def _sectors_sql(fields, n_sectors, date_filter=None):
+    """Rows of `n_sectors` sectors, optionally within `date_filter`."""
+    date_select, _ = _date_columns()
+    where = f"sector IN ({', '.join('?' * n_sectors)})"
+    if date_filter:
+        where += f" AND {date_filter}"
+    return f"SELECT sector, {date_select}, {', '.join(fields)} FROM {TABLE_NAME} WHERE {where}"
+
 # --- Internal Core Query Functions (Cached) ---
 
-def _validate_field(field):
-    """Check field against a safelist to prevent SQL injection."""
-    if field not in SAFE_FIELDS:
+# Key and bookkeeping columns; every other table column is a metric field
+KEY_COLUMNS = ('sector', 'date', 'date_key')
+
+def _value_fields():
+    """Metric columns discovered from the table schema (or the blob table)."""
+    if STORAGE == 'blobs':
+        return _blob_fields()
+    return tuple(c for c in _get_columns() if c not in KEY_COLUMNS)
+
+def _validate_field(field, src=None):
+    """Check field against the table's metric columns to prevent SQL injection."""
+    if src is not None:
+        return src.validate_field(field)
+    if field not in _value_fields():
         raise ValueError(f"Invalid field: '{field}'.")
     return field
 
@@ -155,81 +475,805 @@ def _format_date(date_obj):
         return str(date_obj) 
     raise ValueError("Invalid date format. Expected YYYY-MM-DD or Excel date.")
 
-@functools.lru_cache(maxsize=256) 
-@log_and_time
-def _query_single_data(sector, field, date_str):
-    """Internal function to fetch a single data point."""
-    safe_field = _validate_field(field)
-    
-    query = f"SELECT {safe_field} FROM {TABLE_NAME} WHERE sector = ? AND date(date) = ?"
-    
+def _sector_list():
+    """Returns every sector name in the table, sorted (cached)."""
+    return RESULT_CACHE.get_or_compute(('_sector_list',), _fetch_sector_list)
+
+def _fetch_sector_list():
+    if SNAPSHOT is not None:
+        return list(SNAPSHOT.sectors)
     with get_db_connection() as conn:
+        if STORAGE == 'blobs':
+            return blobs.sectors(conn, TABLE_NAME)
         cursor = conn.cursor()
-        cursor.execute(query, (sector, date_str))
-        row = cursor.fetchone()
-        
-    if row:
-        return row[0]
+        cursor.execute(f"SELECT DISTINCT sector FROM {TABLE_NAME} ORDER BY sector")
+        return [row[0] for row in cursor.fetchall()]
+
+# Sector arguments go through a SectorIndex (sectoral_names.py), so case,
+# stray spaces and configured aliases don't cause misses
+
+def _sector_index(src=None):
+    """SectorIndex of the default DB's (or a named source's) sectors, built once per DB version."""
+    def build():
+        index = SectorIndex(_sector_list() if src is None else src.sectors(), SECTOR_ALIASES)
+        if index.unknown_aliases:
+            logger.warning(f"Ignoring sector aliases for unknown sectors: {', '.join(index.unknown_aliases)}")
+        return index
+    cache = RESULT_CACHE if src is None else src.cache
+    return cache.get_or_compute(('_sector_index',), build)
+
+def _resolve_sector(sector, src=None):
+    """The stored name of a sector argument; LookupError suggesting the closest names if unknown."""
+    return _sector_index(src).lookup(sector)
+
+@RESULT_CACHE.cached
+def _sector_history(sector, field):
+    """
+    Full (dates, rows) history for one sector and field, cached once and
+    sliced by the single, series and all-history queries.
+    """
+    snapshot = _snapshot_for(field)
+    if snapshot is not None:
+        rows = snapshot.series(sector, field)
+    elif STORAGE == 'blobs':
+        with get_db_connection() as conn:
+            return blobs.history(conn, TABLE_NAME, sector, field)
     else:
-        return "Error: No data found."
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_history_sql((field,)), (sector,))
+            # Convert from list of Row objects to list of tuples
+            rows = [tuple(row) for row in cursor.fetchall()]
+
+    dates = [row[0] for row in rows]
+    return dates, rows
+
+# --- Point-in-time Lookups ---
+#
+# 'exact' needs the quarter-end itself; 'as_of' takes the latest value on or
+# before the date (e.g. =TODAY()); 'nearest' takes the closest date either
+# side, the earlier one on a tie. Both skip blank values.
+
+MATCH_MODES = ('exact', 'as_of', 'nearest')
+
+def _match_mode(match):
+    mode = (match or 'exact').strip().lower().replace('-', '_')
+    if mode not in MATCH_MODES:
+        raise ValueError(f"Invalid match mode: '{match}'. Use one of {', '.join(MATCH_MODES)}.")
+    return mode
+
+@RESULT_CACHE.cached
+def _value_index(sector, field):
+    """Sorted dates and values of a sector's non-blank history."""
+    _, rows = _sector_history(sector, field)
+    rows = [row for row in rows if row[1] is not None]
+    return [row[0] for row in rows], [row[1] for row in rows]
+
+def _day_number(date_str):
+    return date.fromisoformat(date_str[:10]).toordinal()
+
+def _match_position(dates, date_str, mode):
+    """Index into sorted `dates` for an 'as_of' or 'nearest' lookup, or None."""
+    i = bisect_right(dates, date_str)
+    if mode == 'as_of' or i == len(dates) or (i and dates[i - 1] == date_str):
+        return i - 1 if i else None
+    if i == 0:
+        return 0
+    target = _day_number(date_str)
+    if target - _day_number(dates[i - 1]) <= _day_number(dates[i]) - target:
+        return i - 1
+    return i
+
+def _history(sector, field, src):
+    """(dates, rows) history from the default DB (src None) or a named source."""
+    if src is None:
+        return _sector_history(sector, field)
+    return src.history(sector, field)
+
+# --- Blob Storage (storage = blobs) ---
+
+# Not in RESULT_CACHE: _load_snapshot() needs the fields while the cache's
+# refresh hook is running, and the cache can't be re-entered from there
+@functools.lru_cache(maxsize=1)
+def _blob_fields():
+    """Fields in the blob table (cached until the DB file changes)."""
+    with get_db_connection() as conn:
+        return blobs.fields(conn, TABLE_NAME)
+
+def _blob_range_first(sector, field):
+    """True if a range read should decode only its blocks: blob storage, history not cached."""
+    if STORAGE != 'blobs' or SNAPSHOT is not None:
+        return False
+    return is_missing(RESULT_CACHE.peek(_sector_history.cache_key(sector, field)))
+
+@RESULT_CACHE.cached
+def _blob_series(sector, field, start_date_str, end_date_str):
+    """(date, value) rows between two dates, decoding only the overlapping blocks."""
+    with get_db_connection() as conn:
+        return blobs.read_range(conn, TABLE_NAME, sector, field, start_date_str, end_date_str)
 
-@functools.lru_cache(maxsize=128)
 @log_and_time
-def _query_series(sector, field, start_date_str, end_date_str):
+def _query_single_data(sector, field, date_str, match='exact', source=None):
+    """Internal function to fetch a single data point."""
+    src = _source(source)
+    safe_field = _validate_field(field, src)
+    sector = _resolve_sector(sector, src)
+    mode = _match_mode(match)
+
+    # Dates before the first row have no as_of value; exact needs a row on the date
+    if src is None and mode != 'nearest' and _outside_coverage(
+        sector, date_str if mode == 'exact' else '', date_str
+    ):
+        raise LookupError(f"No data on or before {date_str}." if mode == 'as_of' else "No data found.")
+
+    if mode != 'exact':
+        dates, values = _value_index(sector, safe_field) if src is None else src.value_index(sector, safe_field)
+        i = _match_position(dates, date_str, mode)
+        if i is None:
+            raise LookupError(f"No data on or before {date_str}." if dates else "No data found.")
+        return values[i]
+
+    dates, rows = _history(sector, safe_field, src)
+    i = bisect_left(dates, date_str)
+    if i < len(dates) and dates[i] == date_str:
+        return rows[i][1]
+    raise LookupError("No data found.")
+
+@log_and_time
+def _query_series(sector, field, start_date_str, end_date_str, source=None):
     """Internal function to fetch a time series."""
-    safe_field = _validate_field(field)
-    
-    query = f"SELECT date(date) as formatted_date, {safe_field} FROM {TABLE_NAME} WHERE sector = ? AND date(date) BETWEEN ? AND ? ORDER BY formatted_date"
-    
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(query, (sector, start_date_str, end_date_str))
-        # Convert from list of Row objects to list of tuples
-        rows = [tuple(row) for row in cursor.fetchall()]
+    src = _source(source)
+    safe_field = _validate_field(field, src)
+    sector = _resolve_sector(sector, src)
+
+    if src is None and _outside_coverage(sector, start_date_str, end_date_str):
+        return [('Date', field)]
+
+    if src is None and _blob_range_first(sector, safe_field):
+        return [('Date', field)] + _blob_series(sector, safe_field, start_date_str, end_date_str)
+
+    dates, rows = _history(sector, safe_field, src)
+    lo = bisect_left(dates, start_date_str)
+    hi = bisect_right(dates, end_date_str)
     
     # Add headers for the spilled array
-    return [('Date', field)] + rows
+    return [('Date', field)] + rows[lo:hi]
+
+def _sector_histories(sector, fields):
+    """
+    Returns {field: (dates, rows)} for several fields, fetching every field
+    that is not cached yet with one SELECT and caching each history.
+    """
+    RESULT_CACHE.sync()
+    generation = RESULT_CACHE.generation
+    histories = {}
+    missing = []
+    for field in fields:
+        history = RESULT_CACHE.peek(_sector_history.cache_key(sector, field))
+        if is_missing(history):
+            missing.append(field)
+        else:
+            histories[field] = history
+
+    per_field = STORAGE == 'blobs' or (SNAPSHOT is not None and all(SNAPSHOT.has_field(f) for f in missing))
+    if missing and per_field:
+        for field in missing:
+            histories[field] = _sector_history(sector, field)
+    elif missing:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_history_sql(missing), (sector,))
+            fetched = cursor.fetchall()
+
+        dates = [row[0] for row in fetched]
+        for k, field in enumerate(missing):
+            history = (dates, [(row[0], row[1 + k]) for row in fetched])
+            RESULT_CACHE.put(_sector_history.cache_key(sector, field), history, generation)
+            histories[field] = history
+
+    return histories
 
-@functools.lru_cache(maxsize=64)
 @log_and_time
-def _query_matrix(date_str, field):
-    """Internal function to fetch all sectors for a given date."""
-    safe_field = _validate_field(field)
-    
-    query = f"SELECT sector, date(date) as formatted_date, {safe_field} FROM {TABLE_NAME} WHERE date(date) = ? ORDER BY sector"
-    
+def _query_series_multi(sector, fields, start_date_str, end_date_str):
+    """Internal function to fetch several fields' time series side by side."""
+    safe_fields = tuple(dict.fromkeys(_validate_field(f) for f in fields))
+    histories = _sector_histories(_resolve_sector(sector), safe_fields)
+
+    by_field = {}
+    all_dates = set()
+    for field, (dates, rows) in histories.items():
+        lo = bisect_left(dates, start_date_str)
+        hi = bisect_right(dates, end_date_str)
+        by_field[field] = dict(rows[lo:hi])
+        all_dates.update(dates[lo:hi])
+
+    rows = [
+        (date_str,) + tuple(by_field[f].get(date_str) for f in fields)
+        for date_str in sorted(all_dates)
+    ]
+    return [('Date',) + tuple(fields)] + rows
+
+def _materialized_fresh():
+    """True if sectoral_materialize.py tables exist and are current (cached per DB version)."""
+    def check():
+        with get_db_connection() as conn:
+            return materialized.is_fresh(conn, TABLE_NAME)
+    return RESULT_CACHE.get_or_compute(('_materialized_fresh',), check)
+
+@RESULT_CACHE.cached
+def _matrix_rows(date_str, field):
+    """Cross-section for one date from the blob blocks, materialized wide table or SQL (cached)."""
+    if STORAGE == 'blobs':
+        with get_db_connection() as conn:
+            return blobs.read_matrix(conn, TABLE_NAME, field, date_str)
+
+    if _materialized_fresh():
+        with get_db_connection() as conn:
+            pairs = materialized.read_matrix(conn, TABLE_NAME, field, date_str)
+        return [(sector, date_str, value) for sector, value in pairs]
+
+    date_filter, date_params = _date_range_filter(date_str, date_str)
+
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        rows = [tuple(row) for row in cursor.fetchall()]
-        
-    return [('Sector', 'Date', field)] + rows
+        cursor.execute(_cross_section_sql(field, date_filter), date_params)
+        return [tuple(row) for row in cursor.fetchall()]
+
+def _matrix_from_cached_histories(date_str, field):
+    """Builds the cross-section from cached sector histories, or None if any is missing."""
+    rows = []
+    for sector in _sector_list():
+        history = RESULT_CACHE.peek(_sector_history.cache_key(sector, field))
+        if is_missing(history):
+            return None
+        dates, sector_rows = history
+        i = bisect_left(dates, date_str)
+        if i < len(dates) and dates[i] == date_str:
+            rows.append((sector, date_str, sector_rows[i][1]))
+    return rows
 
-@functools.lru_cache(maxsize=128)
 @log_and_time
-def _query_all_growth(sector, field):
+def _query_matrix(date_str, field, source=None):
+    """Internal function to fetch all sectors for a given date."""
+    src = _source(source)
+    safe_field = _validate_field(field, src)
+    return [('Sector', 'Date', field)] + _matrix(date_str, safe_field, src)
+
+def _matrix(date_str, field, src):
+    """(sector, date, value) rows for one date from the fastest available path."""
+    if src is not None:
+        return src.matrix(date_str, field)
+
+    snapshot = _snapshot_for(field)
+    if snapshot is not None:
+        return snapshot.matrix(date_str, field)
+
+    rows = _matrix_from_cached_histories(date_str, field)
+    if rows is None:
+        rows = _matrix_rows(date_str, field)
+    return rows
+
+@log_and_time
+def _query_all_growth(sector, field, source=None):
     """Internal function to fetch all data for a given sector."""
-    safe_field = _validate_field(field)
-    
-    query = f"SELECT date(date) as formatted_date, {safe_field} FROM {TABLE_NAME} WHERE sector = ? ORDER BY formatted_date"
-    
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        rows = [tuple(row) for row in cursor.fetchall()]
+    src = _source(source)
+    safe_field = _validate_field(field, src)
+    sector = _resolve_sector(sector, src)
+
+    _, rows = _history(sector, safe_field, src)
         
     return [('Date', field)] + rows
 
+SUMMARY_LABELS = ('First date', 'Latest date', 'Latest value', 'Min', 'Max', 'Count')
+
+@log_and_time
+def _query_sector_summary(sector, field):
+    """Internal function for a sector's first/latest date, latest value, min, max and count."""
+    safe_field = _validate_field(field)
+    sector = _resolve_sector(sector)
+
+    if _materialized_fresh():
+        with get_db_connection() as conn:
+            stats = materialized.read_summary(conn, TABLE_NAME, sector, safe_field)
+    else:
+        dates, values = _value_index(sector, safe_field)
+        stats = (dates[0], dates[-1], values[-1], min(values), max(values), len(values)) if values else None
+
+    if stats is None:
+        raise LookupError("No data found.")
+    return [('Stat', field)] + list(zip(SUMMARY_LABELS, stats))
+
+# --- Coverage ---
+#
+# Each sector's date range, missing quarters and blank counts, from the
+# table sectoral_coverage.py builds (and the loader keeps current) or else
+# computed on first use. Cached per sector, so a load only drops the
+# sectors it touched. The series and single-value queries use a known range
+# to answer requests wholly outside it without reading the history.
+
+COVERAGE_LABELS = ('First date', 'Last date', 'Dates', 'Missing quarters')
+
+def _has_coverage_table():
+    def check():
+        with get_db_connection() as conn:
+            return coverage.has_coverage(conn, TABLE_NAME)
+    return RESULT_CACHE.get_or_compute(('_coverage_table',), check)
+
+def _compute_coverage(sector):
+    if STORAGE == 'blobs':
+        histories = _sector_histories(sector, _value_fields())
+        dates = next(iter(histories.values()))[0] if histories else []
+        return coverage.summarize(dates, {field: [row[1] for row in rows] for field, (_, rows) in histories.items()})
+    with get_db_connection() as conn:
+        return coverage.compute_coverage(conn, TABLE_NAME, [sector]).get(sector)
+
+def _coverage(sector):
+    """Coverage record of one sector (None if it has no rows), cached until its rows change."""
+    def build():
+        if _has_coverage_table():
+            with get_db_connection() as conn:
+                return coverage.read_coverage(conn, TABLE_NAME, sector)
+        return _compute_coverage(sector)
+    return RESULT_CACHE.get_or_compute(('_coverage', sector), build)
+
+def _outside_coverage(sector, start_date_str, end_date_str):
+    """
+    True if the sector has no rows between the two dates. Only consults
+    coverage that is cheap to get: the coverage table, or a cached record.
+    """
+    if _has_coverage_table():
+        record = _coverage(sector)
+    else:
+        record = RESULT_CACHE.peek(('_coverage', sector))
+        if is_missing(record):
+            return False
+    return record is None or end_date_str < record['first_date'] or start_date_str > record['last_date']
+
+def _all_coverage():
+    """{sector: record} for every sector, reading or computing them in one pass where possible."""
+    records = None
+    RESULT_CACHE.sync()
+    generation = RESULT_CACHE.generation
+    if _has_coverage_table():
+        with get_db_connection() as conn:
+            records = coverage.read_coverage(conn, TABLE_NAME)
+    elif STORAGE != 'blobs':
+        with get_db_connection() as conn:
+            records = coverage.compute_coverage(conn, TABLE_NAME)
+    if records is not None:
+        for sector, record in records.items():
+            RESULT_CACHE.put(('_coverage', sector), record, generation)
+    return {sector: _coverage(sector) for sector in _sector_list()}
+
+@log_and_time
+def _query_coverage(sector=None):
+    """Internal function for one sector's coverage, or one row per sector if sector is blank."""
+    fields = _value_fields()
+    blank_labels = tuple(f"Blank {field}" for field in fields)
+
+    if sector is None or not str(sector).strip():
+        rows = [
+            (name, r['first_date'], r['last_date'], r['n_dates'], len(r['missing']))
+            + tuple(r['nulls'].get(field, 0) for field in fields)
+            for name, r in _all_coverage().items() if r is not None
+        ]
+        return [('Sector',) + COVERAGE_LABELS + blank_labels] + rows
+
+    sector = _resolve_sector(sector)
+    r = _coverage(sector)
+    if r is None:
+        raise LookupError("No data found.")
+    stats = (r['first_date'], r['last_date'], r['n_dates'], ', '.join(r['missing']))
+    return (
+        [('Coverage', sector)] + list(zip(COVERAGE_LABELS, stats))
+        + list(zip(blank_labels, (r['nulls'].get(field, 0) for field in fields)))
+    )
+
+# --- Cross-source Comparisons ---
+
+def _source_args(sources):
+    """A UDF's sources range (or a single name) as a hashable tuple."""
+    if isinstance(sources, str):
+        return (sources,)
+    return tuple(sources or ())
+
+def _comparison_sources(sources):
+    """Source names to compare, in the caller's order; blank means every source."""
+    names = []
+    for name in sources or ():
+        name = str(name).strip() if name is not None else ''
+        if name and name not in names:
+            _source(name)
+            names.append(name)
+    return names or _source_names()
+
+def _with_revision(header, names, rows):
+    """Adds a '<last> - <first>' column when exactly two sources are compared."""
+    if len(names) != 2:
+        return [header] + rows
+    revised = []
+    for row in rows:
+        a, b = row[-2], row[-1]
+        revised.append(row + ((b - a) if a is not None and b is not None else None,))
+    return [header + (f"{names[1]} - {names[0]}",)] + revised
+
+@log_and_time
+def _query_source_comparison(sector, field, sources, start_date_str=None, end_date_str=None):
+    """Internal function to line up one sector's history from several sources by date."""
+    names = _comparison_sources(sources)
+
+    def fetch(name):
+        src = _source(name)
+        # A sector missing from some sources just leaves their column blank
+        stored = _sector_index(src).resolve(sector) or sector
+        _, rows = _history(stored, _validate_field(field, src), src)
+        return dict(rows)
+
+    # One call per source on the fan-out pool, each with its own connection
+    by_source = SOURCE_FAN_OUT.map(fetch, names)
+    dates = sorted(set().union(*by_source))
+    if start_date_str is not None:
+        dates = dates[bisect_left(dates, start_date_str):]
+    if end_date_str is not None:
+        dates = dates[:bisect_right(dates, end_date_str)]
+
+    rows = [(d,) + tuple(values.get(d) for values in by_source) for d in dates]
+    return _with_revision(('Date',) + tuple(names), names, rows)
+
+@log_and_time
+def _query_source_matrix(date_str, field, sources):
+    """Internal function to compare every sector on one date across sources."""
+    names = _comparison_sources(sources)
+
+    def fetch(name):
+        src = _source(name)
+        return {sector: value for sector, _, value in _matrix(date_str, _validate_field(field, src), src)}
+
+    by_source = SOURCE_FAN_OUT.map(fetch, names)
+    sectors = sorted(set().union(*by_source))
+    rows = [(sector,) + tuple(values.get(sector) for values in by_source) for sector in sectors]
+    return _with_revision(('Sector',) + tuple(names), names, rows)
+
+# Keeps each batched grid query under SQLite's bound-parameter limit
+GRID_SECTOR_CHUNK = 500
+
+@log_and_time
+@RESULT_CACHE.cached
+def _query_grid(sectors, field, date_strs, match='exact'):
+    """
+    Internal function to fetch a sectors x dates block in one pass.
+    `sectors` and `date_strs` are tuples; blank entries yield blank rows/columns.
+    """
+    safe_field = _validate_field(field)
+    mode = _match_mode(match)
+    # Unknown sectors stay as given and come back as blank rows
+    index = _sector_index()
+    sectors = tuple((index.resolve(s) or s) if s else s for s in sectors)
+
+    if mode != 'exact':
+        block = []
+        for sector in sectors:
+            dates, values = _value_index(sector, safe_field) if sector else ([], [])
+            positions = [_match_position(dates, d, mode) if d else None for d in date_strs]
+            block.append([None if i is None else values[i] for i in positions])
+        return block
+
+    snapshot = _snapshot_for(safe_field)
+    if snapshot is not None:
+        return snapshot.grid(sectors, date_strs, safe_field)
+
+    wanted_sectors = sorted({s for s in sectors if s})
+    wanted_dates = sorted({d for d in date_strs if d})
+    found = {}
+
+    if wanted_sectors and wanted_dates and STORAGE == 'blobs':
+        for sector in wanted_sectors:
+            for date_str, value in _blob_series(sector, safe_field, wanted_dates[0], wanted_dates[-1]):
+                found[(sector, date_str)] = value
+    elif wanted_sectors and wanted_dates:
+        date_filter, date_params = _date_range_filter(wanted_dates[0], wanted_dates[-1])
+
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(wanted_sectors), GRID_SECTOR_CHUNK):
+                chunk = wanted_sectors[start:start + GRID_SECTOR_CHUNK]
+                query = _sectors_sql((safe_field,), len(chunk), date_filter)
+                cursor.execute(query, tuple(chunk) + date_params)
+                for sector, date_str, value in cursor.fetchall():
+                    found[(sector, date_str)] = value
+
+    # Pivot into the caller's row/column order; misses stay blank
+    return [[found.get((sector, date_str)) for date_str in date_strs] for sector in sectors]
+
+# --- Derived Analytics (NumPy) ---
+
+@RESULT_CACHE.cached
+def _field_matrix(field):
+    """
+    Dense (sectors, dates) float matrix for one field, NaN where missing.
+    With a snapshot this is a zero-copy view of its value array.
+    """
+    np = analytics.require_numpy()
+
+    snapshot = _snapshot_for(field)
+    if snapshot is not None:
+        return list(snapshot.sectors), list(snapshot.dates), snapshot.array(field)
+
+    if STORAGE == 'blobs':
+        rows = [(sector,) + row for sector in _sector_list() for row in _sector_history(sector, field)[1]]
+    else:
+        date_select, _ = _date_columns()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT sector, {date_select}, {field} FROM {TABLE_NAME}")
+            rows = cursor.fetchall()
+
+    sectors = sorted({row[0] for row in rows})
+    dates = sorted({row[1] for row in rows})
+    sector_index = {s: i for i, s in enumerate(sectors)}
+    date_index = {d: j for j, d in enumerate(dates)}
+
+    values = np.full((len(sectors), len(dates)), np.nan)
+    for sector, date_str, value in rows:
+        if value is not None:
+            values[sector_index[sector], date_index[date_str]] = value
+    return sectors, dates, values
+
+# Each takes (values, quarters, param); quarters are the columns' calendar quarters
+ANALYTICS = {
+    'qoq': lambda values, quarters, param: analytics.change(values, quarters, 1),
+    'yoy': lambda values, quarters, param: analytics.change(values, quarters, analytics.QUARTERS_PER_YEAR),
+    'rolling_mean': lambda values, quarters, param: analytics.rolling_mean(values, quarters, param),
+    'zscore': lambda values, quarters, param: analytics.zscore(values),
+    'rank': lambda values, quarters, param: analytics.cross_sector_percentile(values),
+}
+
+@RESULT_CACHE.cached
+def _analytic(name, field, param):
+    """Runs one analytic over every sector at once and caches the whole result."""
+    sectors, dates, values = _field_matrix(field)
+    quarters = [analytics.quarter_number(d) for d in dates]
+    return sectors, dates, values, ANALYTICS[name](values, quarters, param)
+
+def _as_cell(value):
+    """NaN becomes a blank cell in Excel."""
+    return None if value != value else float(value)
+
+@log_and_time
+def _query_sector_analytic(sector, field, name, param, label):
+    """Date | field | <label> rows for one sector from a cached analytic."""
+    safe_field = _validate_field(field)
+    sector = _resolve_sector(sector)
+    sectors, dates, values, result = _analytic(name, safe_field, param)
+    if sector not in sectors:
+        raise LookupError("No data found.")
+
+    i = sectors.index(sector)
+    rows = [
+        (dates[j], float(values[i, j]), _as_cell(result[i, j]))
+        for j in range(len(dates))
+        if values[i, j] == values[i, j]
+    ]
+    return [('Date', field, label)] + rows
+
+@log_and_time
+def _query_cross_sector_rank(date_str, field):
+    """Sector | field | percentile rows for one date."""
+    safe_field = _validate_field(field)
+    sectors, dates, values, result = _analytic('rank', safe_field, None)
+    if date_str not in dates:
+        raise LookupError("No data found.")
+
+    j = dates.index(date_str)
+    rows = [
+        (sectors[i], float(values[i, j]), _as_cell(result[i, j]))
+        for i in range(len(sectors))
+        if values[i, j] == values[i, j]
+    ]
+    return [('Sector', field, 'Percentile')] + rows
+
+# --- Compact Spill Encoding ---
+#
+# With spill_format = compact, the history and cross-section UDFs return one
+# preallocated 2-D object array: a header row, then whole columns copied in
+# by slice assignment from cached float arrays. xlwings converts it with a
+# single tolist() instead of walking a list of per-row tuples. Dates are
+# Excel serial numbers (format the column as a date in the sheet), computed
+# once per distinct date; blank values are NaN, which Excel shows as empty.
+
+EXCEL_EPOCH = date(1899, 12, 30)
+
+@functools.lru_cache(maxsize=None)
+def _excel_serial(date_str):
+    """Excel serial number of a 'YYYY-MM-DD' date (cached per date)."""
+    return float((date.fromisoformat(date_str[:10]) - EXCEL_EPOCH).days)
+
+def _spill_array(header, columns, n_rows):
+    """Header row plus `columns` (arrays, lists or scalars) in one object array."""
+    np = analytics.require_numpy()
+    out = np.empty((n_rows + 1, len(header)), dtype=object)
+    out[0] = header
+    for k, column in enumerate(columns):
+        out[1:, k] = column
+    return out
+
+def _history_spill(sector, field, src):
+    """
+    (dates, spill array) of one sector's whole history, built once and cached.
+    The array is shared by every caller and must not be modified.
+    """
+    def build():
+        np = analytics.require_numpy()
+        dates, rows = _history(sector, field, src)
+        serials = np.fromiter((_excel_serial(d) for d in dates), dtype=float, count=len(dates))
+        values = np.array([row[1] for row in rows], dtype=float)
+        return dates, _spill_array(('Date', field), (serials, values), len(dates))
+    cache = RESULT_CACHE if src is None else src.cache
+    return cache.get_or_compute(('_history_spill', sector, field), build)
+
+@log_and_time
+def _query_series_compact(sector, field, start_date_str, end_date_str, source=None):
+    """_query_series as a compact spill array."""
+    src = _source(source)
+    safe_field = _validate_field(field, src)
+    sector = _resolve_sector(sector, src)
+    if src is None and _outside_coverage(sector, start_date_str, end_date_str):
+        return _spill_array(('Date', field), (), 0)
+
+    dates, history = _history_spill(sector, safe_field, src)
+    lo = bisect_left(dates, start_date_str)
+    hi = max(lo, bisect_right(dates, end_date_str))
+    # Copies cell references only; the floats were boxed when the history was cached
+    out = history[lo:hi + 1].copy()
+    out[0] = history[0]
+    return out
+
+@log_and_time
+def _query_all_growth_compact(sector, field, source=None):
+    """_query_all_growth as a compact spill array."""
+    src = _source(source)
+    safe_field = _validate_field(field, src)
+    sector = _resolve_sector(sector, src)
+
+    _, history = _history_spill(sector, safe_field, src)
+    return history
+
+@log_and_time
+def _query_matrix_compact(date_str, field, source=None):
+    """_query_matrix as a compact spill array (cached; must not be modified)."""
+    src = _source(source)
+    safe_field = _validate_field(field, src)
+
+    def build():
+        rows = _matrix(date_str, safe_field, src)
+        columns = ([row[0] for row in rows], _excel_serial(date_str), [row[2] for row in rows])
+        return _spill_array(('Sector', 'Date', field), columns, len(rows))
+    cache = RESULT_CACHE if src is None else src.cache
+    return cache.get_or_compute(('_matrix_spill', date_str, safe_field), build)
+
+def _compact_rows(result):
+    """Compact-encodes a rows result, e.g. one returned by the query service."""
+    if isinstance(result, str):
+        return [[result]]
+    np = analytics.require_numpy()
+    out = np.empty((len(result), len(result[0])), dtype=object)
+    out[:] = [tuple(row) for row in result]
+    if 'Date' in result[0]:
+        k = list(result[0]).index('Date')
+        out[1:, k] = [_excel_serial(d) for d in out[1:, k]]
+    return out
+
+COMPACT_QUERIES = {
+    '_query_series': _query_series_compact,
+    '_query_all_growth': _query_all_growth_compact,
+    '_query_matrix': _query_matrix_compact,
+}
+
+def _run_spill_query(func, *args):
+    """_run_query for the history and cross-section UDFs, honouring spill_format."""
+    if SPILL_FORMAT != 'compact':
+        return _run_query(func, *args)
+    if SERVICE is None:
+        result = COMPACT_QUERIES[func.__name__](*args)
+        return [[result]] if isinstance(result, str) else result
+    # Arrays don't travel as JSON; the service sends rows and they're encoded here
+    return _compact_rows(_run_query(func, *args))
+
+# --- Paged Spills ---
+#
+# get_series, get_quarterly_matrix and get_all_revenue_growth take optional
+# offset/limit arguments, so a sheet can show a huge history a page at a
+# time. Pages are cut from the cached result, so paging through it costs one
+# query. Scripts should use the generators in sectoral_api.py instead.
+
+def _page(result, offset=None, limit=None):
+    """The header row plus `limit` rows starting at row `offset` (0 = first after the header)."""
+    if isinstance(result, str) or (offset is None and limit is None):
+        return result
+    offset = int(offset or 0)
+    if offset < 0 or (limit is not None and int(limit) < 0):
+        raise ValueError("offset and limit must be >= 0.")
+    start = 1 + offset
+    stop = None if limit is None else start + int(limit)
+    if isinstance(result, list):
+        return [result[0]] + list(result[start:stop])
+    # Compact arrays: copies cell references only
+    np = analytics.require_numpy()
+    return np.concatenate((result[:1], result[start:stop]))
+
+# --- Query Service (thin-client mode) ---
+#
+# With service_url set, the UDFs forward their query calls to a shared
+# sectoral_service.py process instead of querying locally. If the service
+# cannot be reached the call falls back to a local query.
+
+SERVICE_FUNCTIONS = {
+    func.__name__: func for func in (
+        _query_single_data, _query_series, _query_matrix, _query_all_growth,
+        _query_series_multi, _query_grid, _query_sector_analytic, _query_cross_sector_rank,
+        _query_sector_summary, _query_source_comparison, _query_source_matrix, _query_coverage,
+    )
+}
+
+SERVICE = None
+_service_reachable = True
+# time.monotonic() before which queries skip a service that just failed
+_service_retry_at = 0.0
+
+if SERVICE_URL:
+    from sectoral_service import ServiceClient
+    SERVICE = ServiceClient(SERVICE_URL, timeout=SERVICE_TIMEOUT_SECONDS)
+    logger.info(f"Thin-client mode: queries go to {SERVICE_URL}")
+
+def _run_query(func, *args):
+    """Runs a query function here, or in the shared service when configured."""
+    global _service_reachable, _service_retry_at
+    # A down or hung service costs one timeout per retry period, not one per call
+    if SERVICE is None or time.monotonic() < _service_retry_at:
+        return func(*args)
+    try:
+        result = SERVICE.call(func.__name__, *args)
+    except OSError as e:
+        _service_retry_at = time.monotonic() + SERVICE_RETRY_SECONDS
+        if _service_reachable:
+            logger.error(
+                f"Query service {SERVICE_URL} unreachable, querying locally for {SERVICE_RETRY_SECONDS:g} s: {e}"
+            )
+            _service_reachable = False
+        return func(*args)
+    except Exception as e:
+        logger.error(f"Function: {func.__name__}, Args: {list(args)}, Service error: {e}")
+        return f"Error: {e}"
+
+    if not _service_reachable:
+        logger.info(f"Query service {SERVICE_URL} reachable again.")
+        _service_reachable = True
+    return result
+
+def service_stats():
+    """Cache, snapshot and telemetry figures reported by the service's /stats."""
+    return {
+        'db_path': DB_PATH,
+        'cache': RESULT_CACHE.stats(),
+        'snapshot': SNAPSHOT.stats() if SNAPSHOT is not None else None,
+        'telemetry': TELEMETRY.summary(),
+    }
+
 # --- Excel UDF Definitions ---
 
 @xw.func
 @xw.arg('date', datetime, doc="Date as YYYY-MM-DD or Excel date.")
-def get_sectoral_quarterly_data(sector, field, date):
+@xw.arg('match', doc="Optional: exact (default), as_of or nearest.")
+@xw.arg('source', doc="Optional: named source from config.ini (default DB if blank).")
+def get_sectoral_quarterly_data(sector, field, date, match='exact', source=None):
     """
     Retrieves a single data point for a given sector, field, and date.
     Example: =get_sectoral_quarterly_data("IT", "curr_ttm_ebitda_margins", "2025-06-30")
+    Example: =get_sectoral_quarterly_data("IT", "curr_ttm_ebitda_margins", TODAY(), "as_of")
     """
     try:
         date_str = _format_date(date)
-        return _query_single_data(sector, field, date_str)
+        return _run_query(_query_single_data, sector, field, date_str, match, source)
     except Exception as e:
         logger.error(f"UDF get_sectoral_quarterly_data Error: {e}")
         return f"Error: {e}"
@@ -237,309 +1281,430 @@ def get_sectoral_quarterly_data(sector, field, date):
 @xw.func
 @xw.arg('start_date', datetime, doc="Start date (YYYY-MM-DD or Excel date).")
 @xw.arg('end_date', datetime, doc="End date (YYYY-MM-DD or Excel date).")
+@xw.arg('source', doc="Optional: named source from config.ini (default DB if blank).")
+@xw.arg('offset', doc="Optional: rows to skip after the header (default 0).")
+@xw.arg('limit', doc="Optional: maximum rows to return (default all).")
 @xw.ret(expand='table')
-def get_series(sector, field, start_date, end_date):
+def get_series(sector, field, start_date, end_date, source=None, offset=None, limit=None):
     """
     Retrieves a time series for a sector between two dates.
     Example: =get_series("Capital Goods", "curr_ttm_ebitda_margins", "2022-03-31", "2025-09-30")
+    Example: =get_series("IT", "curr_ttm_ebitda_margins", "2000-01-01", TODAY(), , 0, 20)
     """
     try:
         start_date_str = _format_date(start_date)
         end_date_str = _format_date(end_date)
-        return _query_series(sector, field, start_date_str, end_date_str)
+        result = _run_spill_query(_query_series, sector, field, start_date_str, end_date_str, source)
+        return _page(result, offset, limit)
     except Exception as e:
         logger.error(f"UDF get_series Error: {e}")
         return [[f"Error: {e}"]] # Return as 2D array for spilling
 
 @xw.func
 @xw.arg('date', datetime, doc="Date as YYYY-MM-DD or Excel date.")
+@xw.arg('source', doc="Optional: named source from config.ini (default DB if blank).")
+@xw.arg('offset', doc="Optional: rows to skip after the header (default 0).")
+@xw.arg('limit', doc="Optional: maximum rows to return (default all).")
 @xw.ret(expand='table')
-def get_quarterly_matrix(date, field):
+def get_quarterly_matrix(date, field, source=None, offset=None, limit=None):
     """
     Retrieves data for all sectors on a specific date.
     Example: =get_quarterly_matrix("2025-06-30", "curr_ttm_ebitda_margins")
     """
     try:
         date_str = _format_date(date)
-        return _query_matrix(date_str, field)
+        return _page(_run_spill_query(_query_matrix, date_str, field, source), offset, limit)
     except Exception as e:
         logger.error(f"UDF get_quarterly_matrix Error: {e}")
         return [[f"Error: {e}"]]
 
 @xw.func
+@xw.arg('fields', ndim=1, doc="Range (or list) of field names.")
+@xw.arg('start_date', datetime, doc="Start date (YYYY-MM-DD or Excel date).")
+@xw.arg('end_date', datetime, doc="End date (YYYY-MM-DD or Excel date).")
 @xw.ret(expand='table')
-def get_all_revenue_growth(sector, field):
+def get_series_multi(sector, fields, start_date, end_date):
+    """
+    Retrieves several fields' time series for a sector with a single query.
+    Example: =get_series_multi("IT", B1:D1, "2022-03-31", "2025-09-30")
+    """
+    try:
+        field_names = tuple(str(f).strip() for f in fields if f)
+        if not field_names:
+            raise ValueError("No fields given.")
+        start_date_str = _format_date(start_date)
+        end_date_str = _format_date(end_date)
+        result = _run_query(_query_series_multi, sector, field_names, start_date_str, end_date_str)
+        if isinstance(result, str):
+            return [[result]]
+        return result
+    except Exception as e:
+        logger.error(f"UDF get_series_multi Error: {e}")
+        return [[f"Error: {e}"]]
+
+@xw.func
+@xw.ret(expand='down')
+def get_available_fields():
+    """
+    Lists the metric fields available in the table.
+    Example: =get_available_fields()
+    """
+    try:
+        return [[field] for field in _value_fields()]
+    except Exception as e:
+        logger.error(f"UDF get_available_fields Error: {e}")
+        return [[f"Error: {e}"]]
+
+@xw.func
+@xw.arg('source', doc="Optional: named source from config.ini (default DB if blank).")
+@xw.arg('offset', doc="Optional: rows to skip after the header (default 0).")
+@xw.arg('limit', doc="Optional: maximum rows to return (default all).")
+@xw.ret(expand='table')
+def get_all_revenue_growth(sector, field, source=None, offset=None, limit=None):
     """
     Retrieves the entire history for a single sector.
     Example: =get_all_revenue_growth("Healthcare", "curr_ttm_ebitda_margins")
     """
     try:
-        return _query_all_growth(sector, field)
+        return _page(_run_spill_query(_query_all_growth, sector, field, source), offset, limit)
     except Exception as e:
         logger.error(f"UDF get_all_revenue_growth Error: {e}")
         return [[f"Error: {e}"]]
 
-# --- Main entry point for xlwings UDT run ---
-if __name__ == "__main__":
-    # This part is for running with 'xlwings udt run'
-    # It tells xlwings which functions to expose.
-    xw.serve()
-=======
-# sectoral_data_udf.py
-import os
-import sqlite3
-import time
-import logging
-from logging.handlers import RotatingFileHandler
-from functools import lru_cache
-import configparser
-from datetime import datetime
-import xlwings as xw  # used only for Excel UDF exposure; functions callable from CLI too
-
-# ---------------------------
-# Config loader
-# ---------------------------
-def load_config():
-    cfg = configparser.ConfigParser()
-    # search locations: script dir, cwd
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    candidates = [os.path.join(script_dir, 'config.ini'), os.path.join(os.getcwd(), 'config.ini')]
-    found = False
-    for c in candidates:
-        if os.path.exists(c):
-            cfg.read(c)
-            found = True
-            break
-    if not found:
-        raise FileNotFoundError("config.ini not found in script directory or current working directory.")
-    db_path = cfg.get('database', 'sqlite_path', fallback='sectoral_ebitda_margins.db')
-    table_name = cfg.get('database', 'table_name', fallback='sectoral_ebitda_margins')
-    date_format = cfg.get('database', 'date_format', fallback='%Y-%m-%d')
-    return db_path, table_name, date_format
-
-DB_PATH, TABLE_NAME, DATE_FORMAT = load_config()
-
-# ---------------------------
-# Logging
-# ---------------------------
-LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_log.txt')
-logger = logging.getLogger('sectoral_udf')
-logger.setLevel(logging.INFO)
-handler = RotatingFileHandler(LOG_FILE, maxBytes=1_000_000, backupCount=3)
-formatter = logging.Formatter('%(asctime)s | %(levelname)s | %(message)s')
-handler.setFormatter(formatter)
-if not logger.handlers:
-    logger.addHandler(handler)
-
-def log_call(func_name, params, start_time, status='SUCCESS', error_msg=None):
-    duration_ms = (time.perf_counter() - start_time) * 1000
-    msg = f"{func_name} | params={params} | duration_ms={duration_ms:.2f} | status={status}"
-    if error_msg:
-        msg += f" | error={error_msg}"
-    logger.info(msg)
-
-# ---------------------------
-# Database helper
-# ---------------------------
-def get_connection():
-    # ensure path is absolute if relative in config
-    db_abs = DB_PATH if os.path.isabs(DB_PATH) else os.path.abspath(DB_PATH)
-    if not os.path.exists(db_abs):
-        raise FileNotFoundError(f"SQLite DB not found at {db_abs}")
-    conn = sqlite3.connect(db_abs, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def _validate_date(date_str):
+@xw.func
+@xw.arg('sources', ndim=1, doc="Optional: range of source names (all sources if blank).")
+@xw.arg('start_date', datetime, doc="Optional start date.")
+@xw.arg('end_date', datetime, doc="Optional end date.")
+@xw.ret(expand='table')
+def get_source_comparison(sector, field, sources=None, start_date=None, end_date=None):
+    """
+    One sector's history from several sources side by side, by date. With
+    two sources a revision column (second - first) is added.
+    Example: =get_source_comparison("IT", "curr_ttm_ebitda_margins", {"2024Q4","default"})
+    """
     try:
-        # allow date strings like '2025-06-30'
-        datetime.strptime(date_str, DATE_FORMAT)
-        return True
-    except Exception:
-        return False
+        start_date_str = _format_date(start_date) if start_date is not None else None
+        end_date_str = _format_date(end_date) if end_date is not None else None
+        return _spill(_run_query(
+            _query_source_comparison, sector, field, _source_args(sources), start_date_str, end_date_str
+        ))
+    except Exception as e:
+        logger.error(f"UDF get_source_comparison Error: {e}")
+        return [[f"Error: {e}"]]
 
-# ---------------------------
-# CACHES
-# ---------------------------
-# small LRU caches for lookups
-@lru_cache(maxsize=1024)
-def _cached_get_value(sector, field, date_str):
-    conn = get_connection()
-    cur = conn.cursor()
-    q = f"SELECT {field} FROM {TABLE_NAME} WHERE sector = ? AND date = ? LIMIT 1"
-    cur.execute(q, (sector, date_str))
-    row = cur.fetchone()
-    conn.close()
-    if row is None:
-        return None
-    return row[0]
-
-# ---------------------------
-# Utility to format spill outputs for Excel
-# ---------------------------
-def format_two_column_series(rows):
-    # rows: list of (date, value)
-    data = [["date", "value"]]
-    for d, v in rows:
-        data.append([d, v])
-    return data
-
-def format_three_column_matrix(rows):
-    data = [["sector", "date", "value"]]
-    for sector, date, value in rows:
-        data.append([sector, date, value])
-    return data
-
-# ---------------------------
-# UDF implementations
-# ---------------------------
-
-# 1. get_sectoral_quarterly_data(sector, field, date)
 @xw.func
-def get_sectoral_quarterly_data(sector: str, field: str, date: str):
-    start = time.perf_counter()
-    func_name = 'get_sectoral_quarterly_data'
-    params = {'sector': sector, 'field': field, 'date': date}
+@xw.arg('date', datetime, doc="Date as YYYY-MM-DD or Excel date.")
+@xw.arg('sources', ndim=1, doc="Optional: range of source names (all sources if blank).")
+@xw.ret(expand='table')
+def get_source_matrix(date, field, sources=None):
+    """
+    Every sector on one date from several sources side by side.
+    Example: =get_source_matrix("2025-06-30", "curr_ttm_ebitda_margins", {"2024Q4","default"})
+    """
     try:
-        if not (sector and field and date):
-            raise ValueError("One or more inputs are empty.")
-        if not _validate_date(date):
-            raise ValueError(f"date must be in {DATE_FORMAT} format.")
-        # protect against injection: we parameterize values; field is a column name so validate allowed columns
-        allowed_columns = _get_columns()
-        if field not in allowed_columns:
-            raise ValueError(f"Field '{field}' not in table columns: {allowed_columns}")
-        value = _cached_get_value(sector, field, date)
-        if value is None:
-            raise ValueError("No data found for given (sector, date).")
-        log_call(func_name, params, start)
-        return value
+        date_str = _format_date(date)
+        return _spill(_run_query(_query_source_matrix, date_str, field, _source_args(sources)))
     except Exception as e:
-        log_call(func_name, params, start, status='FAILURE', error_msg=str(e))
-        return f"#ERROR: {e}"
+        logger.error(f"UDF get_source_matrix Error: {e}")
+        return [[f"Error: {e}"]]
+
+@xw.func
+@xw.ret(expand='table')
+def get_sources():
+    """
+    Lists the configured data sources.
+    Example: =get_sources()
+    """
+    rows = [(SOURCE_NAME, DB_PATH, TABLE_NAME)]
+    rows += [(name, SOURCES[name].db_path, SOURCES[name].table_name) for name in sorted(SOURCES)]
+    return [('Source', 'DB path', 'Table')] + rows
 
-# 2. get_series(sector, field, start_date, end_date) -> two columns (date, value) spilled
 @xw.func
-@xw.arg('start_date', pd=None)  # ensures Excel range mapping works
-def get_series(sector: str, field: str, start_date: str, end_date: str):
-    start_t = time.perf_counter()
-    func_name = 'get_series'
-    params = {'sector': sector, 'field': field, 'start_date': start_date, 'end_date': end_date}
+@xw.ret(expand='table')
+def get_sector_summary(sector, field):
+    """
+    First and latest date, latest value, min, max and count for one sector.
+    Example: =get_sector_summary("Healthcare", "curr_ttm_ebitda_margins")
+    """
+    return _spill(_run_query(_query_sector_summary, sector, field))
+
+@xw.func
+@xw.arg('sector', doc="Optional: sector name (one row per sector if blank).")
+@xw.ret(expand='table')
+def get_coverage(sector=None):
+    """
+    Reports a sector's date range, missing quarters and blank values per field.
+    Example: =get_coverage("IT")
+    Example: =get_coverage()
+    """
     try:
-        if not (sector and field and start_date and end_date):
-            raise ValueError("Missing parameter.")
-        if not (_validate_date(start_date) and _validate_date(end_date)):
-            raise ValueError(f"Dates must be in {DATE_FORMAT} format.")
-        allowed_columns = _get_columns()
-        if field not in allowed_columns:
-            raise ValueError(f"Field '{field}' not in table columns.")
-        conn = get_connection()
-        cur = conn.cursor()
-        q = f"SELECT date, {field} FROM {TABLE_NAME} WHERE sector = ? AND date BETWEEN ? AND ? ORDER BY date"
-        cur.execute(q, (sector, start_date, end_date))
-        rows = cur.fetchall()
-        conn.close()
-        if not rows:
-            raise ValueError("No rows found for given range.")
-        series = [(r['date'], r[field]) for r in rows]
-        out = format_two_column_series(series)
-        log_call(func_name, params, start_t)
-        return out
+        return _spill(_run_query(_query_coverage, sector))
     except Exception as e:
-        log_call(func_name, params, start_t, status='FAILURE', error_msg=str(e))
-        return [[f"#ERROR: {e}"]]
+        logger.error(f"UDF get_coverage Error: {e}")
+        return [[f"Error: {e}"]]
 
-# 3. get_quarterly_matrix(date, field) -> all sectors for that date (sector, date, value)
 @xw.func
-def get_quarterly_matrix(date: str, field: str):
-    start_t = time.perf_counter()
-    func_name = 'get_quarterly_matrix'
-    params = {'date': date, 'field': field}
+@xw.arg('sectors', ndim=1, doc="Column or row range of sector names.")
+@xw.arg('dates', ndim=1, doc="Row or column range of dates.")
+@xw.arg('match', doc="Optional: exact (default), as_of or nearest.")
+def get_sectoral_grid(sectors, dates, field, match='exact'):
+    """
+    Retrieves a whole sectors x dates block with a single query.
+    Rows follow `sectors`, columns follow `dates`; missing cells are blank.
+    Example: =get_sectoral_grid(A2:A30, B1:BO1, "curr_ttm_ebitda_margins")
+    """
     try:
-        if not (date and field):
-            raise ValueError("Missing parameter.")
-        if not _validate_date(date):
-            raise ValueError(f"Date must be in {DATE_FORMAT} format.")
-        allowed_columns = _get_columns()
-        if field not in allowed_columns:
-            raise ValueError(f"Field '{field}' not a column.")
-        conn = get_connection()
-        cur = conn.cursor()
-        q = f"SELECT sector, date, {field} FROM {TABLE_NAME} WHERE date = ? ORDER BY sector"
-        cur.execute(q, (date,))
-        rows = cur.fetchall()
-        conn.close()
-        if not rows:
-            raise ValueError("No rows found for that date.")
-        out = format_three_column_matrix([(r['sector'], r['date'], r[field]) for r in rows])
-        log_call(func_name, params, start_t)
-        return out
+        sector_keys = tuple(s.strip() if isinstance(s, str) else None for s in sectors)
+        date_strs = tuple(_format_date(d) if d is not None else None for d in dates)
+        result = _run_query(_query_grid, sector_keys, field, date_strs, match)
+        if isinstance(result, str):
+            return [[result]]
+        return result
     except Exception as e:
-        log_call(func_name, params, start_t, status='FAILURE', error_msg=str(e))
-        return [[f"#ERROR: {e}"]]
+        logger.error(f"UDF get_sectoral_grid Error: {e}")
+        return [[f"Error: {e}"]]
+
+@xw.func
+@xw.ret(expand='table')
+def get_cache_stats():
+    """
+    Reports hit/miss counters and size of the shared result cache.
+    Example: =get_cache_stats()
+    """
+    return [('Stat', 'Value')] + list(RESULT_CACHE.stats().items())
+
+@xw.func
+@xw.ret(expand='table')
+def get_telemetry_stats():
+    """
+    Per-function call counts, cache share and p50/p95/p99 latency (ms).
+    Example: =get_telemetry_stats()
+    """
+    header = ('Function', 'Calls', 'Cache %', 'p50 ms', 'p95 ms', 'p99 ms', 'Errors')
+    return [header] + TELEMETRY.summary()
+
+@xw.func
+@xw.ret(expand='table')
+def get_snapshot_stats():
+    """
+    Reports the size and load time of the in-memory snapshot.
+    Example: =get_snapshot_stats()
+    """
+    if SNAPSHOT is None:
+        return [["Snapshot mode is off."]]
+    return [('Stat', 'Value')] + list(SNAPSHOT.stats().items())
+
+# --- Analytics UDFs ---
+
+def _spill(result):
+    """Wraps an error string from log_and_time so it still spills as 2-D."""
+    return [[result]] if isinstance(result, str) else result
 
-# 4. get_all_revenue_growth(sector, field) -> all dates for a sector (date, value)
 @xw.func
-def get_all_revenue_growth(sector: str, field: str):
-    start_t = time.perf_counter()
-    func_name = 'get_all_revenue_growth'
-    params = {'sector': sector, 'field': field}
+@xw.ret(expand='table')
+def get_sector_qoq(sector, field):
+    """
+    Quarter-on-quarter change for every date of a sector.
+    Example: =get_sector_qoq("IT", "curr_ttm_ebitda_margins")
+    """
+    return _spill(_run_query(_query_sector_analytic, sector, field, 'qoq', None, 'QoQ change'))
+
+@xw.func
+@xw.ret(expand='table')
+def get_sector_yoy(sector, field):
+    """
+    Year-on-year change (vs. 4 quarters earlier) for every date of a sector.
+    Example: =get_sector_yoy("IT", "curr_ttm_ebitda_margins")
+    """
+    return _spill(_run_query(_query_sector_analytic, sector, field, 'yoy', None, 'YoY change'))
+
+@xw.func
+@xw.ret(expand='table')
+def get_rolling_mean(sector, field, window):
+    """
+    Trailing mean over `window` quarters for every date of a sector.
+    Example: =get_rolling_mean("IT", "curr_ttm_ebitda_margins", 4)
+    """
     try:
-        if not (sector and field):
-            raise ValueError("Missing parameter.")
-        allowed_columns = _get_columns()
-        if field not in allowed_columns:
-            raise ValueError(f"Field '{field}' not a column.")
-        conn = get_connection()
-        cur = conn.cursor()
-        q = f"SELECT date, {field} FROM {TABLE_NAME} WHERE sector = ? ORDER BY date"
-        cur.execute(q, (sector,))
-        rows = cur.fetchall()
-        conn.close()
-        if not rows:
-            raise ValueError("No rows found for that sector.")
-        out = format_two_column_series([(r['date'], r[field]) for r in rows])
-        log_call(func_name, params, start_t)
-        return out
+        window = int(window)
+    except (TypeError, ValueError):
+        return [["Error: window must be a whole number."]]
+    return _spill(_run_query(_query_sector_analytic, sector, field, 'rolling_mean', window, f'Rolling mean ({window})'))
+
+@xw.func
+@xw.ret(expand='table')
+def get_sector_zscore(sector, field):
+    """
+    Z-score of each value against the sector's own history.
+    Example: =get_sector_zscore("IT", "curr_ttm_ebitda_margins")
+    """
+    return _spill(_run_query(_query_sector_analytic, sector, field, 'zscore', None, 'Z-score'))
+
+@xw.func
+@xw.arg('date', datetime, doc="Date as YYYY-MM-DD or Excel date.")
+@xw.ret(expand='table')
+def get_cross_sector_rank(date, field):
+    """
+    Percentile rank (0-1) of every sector on a date.
+    Example: =get_cross_sector_rank("2025-06-30", "curr_ttm_ebitda_margins")
+    """
+    try:
+        date_str = _format_date(date)
     except Exception as e:
-        log_call(func_name, params, start_t, status='FAILURE', error_msg=str(e))
-        return [[f"#ERROR: {e}"]]
+        logger.error(f"UDF get_cross_sector_rank Error: {e}")
+        return [[f"Error: {e}"]]
+    return _spill(_run_query(_query_cross_sector_rank, date_str, field))
 
-# ---------------------------
-# Helper to get columns from table (caches)
-# ---------------------------
-@lru_cache(maxsize=1)
-def _get_columns():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"PRAGMA table_info({TABLE_NAME})")
-    cols = [r[1] for r in cur.fetchall()]  # r[1] is column name
-    conn.close()
-    return cols
-
-# ---------------------------
-# CLI test runner 
-# ---------------------------
-if __name__ == "__main__":
-    print("Running quick CLI tests against DB:", DB_PATH)
-    sample_sector = "Capital Goods"
-    sample_date = "2025-06-30"
-    field = "curr_ttm_ebitda_margins"
+# --- Async UDF Variants ---
+#
+# Same results as the functions above, but Excel keeps recalculating while
+# they run (xlwings shows "#N/A waiting..." until the value arrives). Work
+# runs on a bounded pool and identical in-flight calls share one query.
 
-    print("Columns in table:", _get_columns())
+ASYNC_POOL = CoalescingExecutor(max_workers=ASYNC_WORKERS)
 
-    # Test single lookup
-    print("Single lookup:", get_sectoral_quarterly_data(sample_sector, field, sample_date))
+@xw.func(async_mode='threading')
+@xw.arg('start_date', datetime, doc="Start date (YYYY-MM-DD or Excel date).")
+@xw.arg('end_date', datetime, doc="End date (YYYY-MM-DD or Excel date).")
+@xw.arg('source', doc="Optional: named source from config.ini (default DB if blank).")
+@xw.arg('offset', doc="Optional: rows to skip after the header (default 0).")
+@xw.arg('limit', doc="Optional: maximum rows to return (default all).")
+@xw.ret(expand='table')
+def get_series_async(sector, field, start_date, end_date, source=None, offset=None, limit=None):
+    """
+    Async version of get_series.
+    Example: =get_series_async("Capital Goods", "curr_ttm_ebitda_margins", "2022-03-31", "2025-09-30")
+    """
+    return ASYNC_POOL.run(get_series, sector, field, start_date, end_date, source, offset, limit)
 
-    # Test matrix
-    matrix = get_quarterly_matrix(sample_date, field)
-    print("Matrix rows:", matrix[:5])
+@xw.func(async_mode='threading')
+@xw.arg('date', datetime, doc="Date as YYYY-MM-DD or Excel date.")
+@xw.arg('source', doc="Optional: named source from config.ini (default DB if blank).")
+@xw.arg('offset', doc="Optional: rows to skip after the header (default 0).")
+@xw.arg('limit', doc="Optional: maximum rows to return (default all).")
+@xw.ret(expand='table')
+def get_quarterly_matrix_async(date, field, source=None, offset=None, limit=None):
+    """
+    Async version of get_quarterly_matrix.
+    Example: =get_quarterly_matrix_async("2025-06-30", "curr_ttm_ebitda_margins")
+    """
+    return ASYNC_POOL.run(get_quarterly_matrix, date, field, source, offset, limit)
+
+@xw.func(async_mode='threading')
+@xw.arg('source', doc="Optional: named source from config.ini (default DB if blank).")
+@xw.arg('offset', doc="Optional: rows to skip after the header (default 0).")
+@xw.arg('limit', doc="Optional: maximum rows to return (default all).")
+@xw.ret(expand='table')
+def get_all_revenue_growth_async(sector, field, source=None, offset=None, limit=None):
+    """
+    Async version of get_all_revenue_growth.
+    Example: =get_all_revenue_growth_async("Healthcare", "curr_ttm_ebitda_margins")
+    """
+    return ASYNC_POOL.run(get_all_revenue_growth, sector, field, source, offset, limit)
 
-    # Test series
-    series = get_series(sample_sector, field, "2022-03-31", "2025-09-30")
-    print("Series sample:", series[:6])
+@xw.func(async_mode='threading')
+@xw.arg('sectors', ndim=1, doc="Column or row range of sector names.")
+@xw.arg('dates', ndim=1, doc="Row or column range of dates.")
+@xw.arg('match', doc="Optional: exact (default), as_of or nearest.")
+def get_sectoral_grid_async(sectors, dates, field, match='exact'):
+    """
+    Async version of get_sectoral_grid.
+    Example: =get_sectoral_grid_async(A2:A30, B1:BO1, "curr_ttm_ebitda_margins")
+    """
+    return ASYNC_POOL.run(get_sectoral_grid, sectors, dates, field, match)
 
-    # Test all dates for a sector
-    all_rg = get_all_revenue_growth(sample_sector, field)
-    print("All RG sample:", all_rg[:6])
->>>>>>> 40ec65d0811ae239e4578cacc8ca1fc0b06dc8ba
+@xw.func
+@xw.ret(expand='table')
+def get_async_stats():
+    """
+    Reports worker pool size and how many async calls were coalesced.
+    Example: =get_async_stats()
+    """
+    return [('Stat', 'Value')] + list(ASYNC_POOL.stats().items())
+
+# --- Startup ---
+
+def _plan_statements():
+    """{name: (sql, params, whole_table)} for every SQL read of the default DB."""
+    fields = _value_fields()
+    if STORAGE == 'blobs':
+        return blobs.plan_statements(TABLE_NAME, fields[0])
+    day_filter, day_params = _date_range_filter('2000-03-31', '2000-03-31')
+    range_filter, range_params = _date_range_filter('2000-03-31', '2010-03-31')
+    # _field_matrix and the snapshot load read the whole table by design
+    return {
+        'sector list': (f"SELECT DISTINCT sector FROM {TABLE_NAME} ORDER BY sector", (), True),
+        'sector history': (_history_sql(fields), ('IT',), False),
+        'cross-section': (_cross_section_sql(fields[0], day_filter), day_params, False),
+        'grid': (_sectors_sql(fields[:1], 2, range_filter), ('IT', 'Banks') + range_params, False),
+        'change refresh': (_sectors_sql(fields, 2), ('IT', 'Banks'), False),
+    }
+
+def check_query_plans(fix=None):
+    """
+    EXPLAINs every UDF statement, creating covering indexes and running
+    ANALYZE if any would scan and `fix` (default: auto_index) allows it.
+    Logs a warning for each statement still scanning; returns the report.
+    """
+    fix = AUTO_INDEX if fix is None else fix
+    # The covering indexes are for the row table
+    fix = fix and STORAGE != 'blobs'
+    _, date_column = _date_columns()
+    report = plans.verify_query_plans(
+        DB_PATH, TABLE_NAME, _value_fields(), date_column, _plan_statements(), fix
+    )
+    if report['created']:
+        logger.info(f"Created covering indexes: {', '.join(report['created'])} (ANALYZE done)")
+    for name, steps in report['scans'].items():
+        logger.warning(f"Query plan: '{name}' query scans without an index ({' / '.join(steps)})")
+    return report
+
+def prewarm():
+    """Loads the snapshot (if enabled) and caches every sector's history."""
+    start_time = time.perf_counter()
+    if SNAPSHOT_MODE and SNAPSHOT is None:
+        load_snapshot()
+    fields = _value_fields()
+    sectors = _sector_list()
+    _sector_index()
+    for sector in sectors:
+        _sector_histories(sector, fields)
+    _all_coverage()
+    exec_time_ms = (time.perf_counter() - start_time) * 1000
+    logger.info(f"Prewarm complete | Sectors: {len(sectors)} | Fields: {len(fields)} | Time: {exec_time_ms:.2f} ms")
+
+def _prewarm_in_background():
+    try:
+        prewarm()
+    except Exception as e:
+        logger.error(f"Prewarm failed, queries will load lazily: {e}")
+
+def _startup_in_background():
+    if CHECK_QUERY_PLANS and not isinstance(xw, _DeferredXlwings):
+        try:
+            check_query_plans()
+        except Exception as e:
+            logger.error(f"Query plan check failed: {e}")
+    if PREWARM:
+        _prewarm_in_background()
+
+# Nothing touches the DB at import: connections, schema introspection and
+# caches are all created on the first call, or by the startup thread (query
+# plan check, then prewarm). Without prewarm, snapshot mode still loads once
+# when the UDF server imports this.
+# The plan check may write indexes, so only the UDF server runs it here;
+# scripts call check_query_plans() themselves.
+if PREWARM or (CHECK_QUERY_PLANS and not isinstance(xw, _DeferredXlwings)):
+    threading.Thread(target=_startup_in_background, name='sectoral-startup', daemon=True).start()
+if SNAPSHOT_MODE and not PREWARM:
+    try:
+        load_snapshot()
+    except Exception as e:
+        logger.error(f"Failed to load snapshot, falling back to SQL: {e}")
+
+# --- Main entry point for xlwings UDT run ---
+if __name__ == "__main__":
+    # This part is for running with 'xlwings udt run'
+    # It tells xlwings which functions to expose.
+    import xlwings as xw
+    xw.serve()
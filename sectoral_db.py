@@ -0,0 +1,119 @@
+import sqlite3
+import threading
+import time
+import os
+import pathlib
+import weakref
+
+# --- Pooled Read-only Connections ---
+#
+# Excel evaluates every formula through a fresh Python call, so opening a
+# connection per query costs more than the query itself. The pool keeps one
+# read-only connection per thread and only stats the DB file every
+# `check_interval` seconds to notice when it has been replaced or rewritten.
+# A thread's connection is closed when the thread exits (the service runs a
+# thread per client), so connections never outlive their threads.
+
+READ_ONLY_PRAGMAS = (
+    "PRAGMA query_only = ON",
+    "PRAGMA mmap_size = 268435456",   # 256 MB
+    "PRAGMA cache_size = -16384",     # 16 MB
+    "PRAGMA temp_store = MEMORY",
+)
+
+# sqlite3 reuses compiled statements whose SQL text matches exactly, so the
+# f-string queries (one per field/date-column combination) stay prepared.
+STATEMENT_CACHE_SIZE = 256
+
+
+class _ThreadConnection:
+    """
+    One thread's connection. Only that thread's threading.local holds it, so
+    it is collected when the thread exits and the finalizer closes the
+    connection; close() does the same early.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.close = weakref.finalize(self, conn.close)
+
+
+class ReadOnlyConnectionPool:
+    """One read-only SQLite connection per thread, reopened when the DB file changes."""
+
+    def __init__(self, db_path, check_interval=1.0):
+        self.db_path = db_path
+        self.check_interval = check_interval
+        self.signature = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Weak, so the pool alone doesn't keep a dead thread's connection alive
+        self._connections = weakref.WeakSet()
+        self._listeners = []
+
+    def on_change(self, callback):
+        """Registers a callback run once whenever the DB file is seen to change."""
+        self._listeners.append(callback)
+        return callback
+
+    def _file_signature(self):
+        try:
+            st = os.stat(self.db_path)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Database file not found: {self.db_path}")
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _open(self, local):
+        uri = pathlib.Path(self.db_path).resolve().as_uri() + '?mode=ro'
+        # check_same_thread is off only so close_all() and the finalizers can
+        # close other threads' connections; each is otherwise used by its own thread.
+        conn = sqlite3.connect(
+            uri, uri=True, check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in READ_ONLY_PRAGMAS:
+            conn.execute(pragma)
+        local.slot = _ThreadConnection(conn)
+        local.conn = conn
+        with self._lock:
+            self._connections.add(local.slot)
+        return conn
+
+    def _record_signature(self, signature):
+        with self._lock:
+            changed = self.signature is not None and signature != self.signature
+            self.signature = signature
+        if changed:
+            for callback in self._listeners:
+                callback()
+
+    def get(self):
+        """Returns this thread's connection, reopening it if the file changed."""
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        now = time.monotonic()
+
+        if conn is not None and now - local.checked_at < self.check_interval:
+            return conn
+
+        signature = self._file_signature()
+        local.checked_at = now
+        if conn is not None and signature == local.signature:
+            return conn
+
+        if conn is not None:
+            local.slot.close()
+        self._record_signature(signature)
+        self._open(local)
+        local.signature = signature
+        return local.conn
+
+    def close_all(self):
+        """Closes every pooled connection; threads reopen lazily on next use."""
+        with self._lock:
+            slots = list(self._connections)
+            self._connections.clear()
+        for slot in slots:
+            slot.close()
+        self._local = threading.local()
@@ -0,0 +1,276 @@
+import sqlite3
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from apply_index import get_config
+from sectoral_snapshot import SectoralSnapshot
+
+# --- Columnar Export ---
+#
+# Writes the sectoral table as one float64 .npy file per field, shaped
+# (sectors, dates) and sector-major, so every sector's history is one
+# contiguous partition of the file, plus a uint8 mask of which (sector, date)
+# rows exist. manifest.json lists the sectors, dates and files, plus the
+# size/mtime of the DB they came from. open_export()
+# memory-maps the files read-only: notebooks and the UDF snapshot slice
+# them without copying or building per-row Python objects.
+#
+# Data files carry an export stamp in their name and manifest.json is
+# replaced last, so readers never see a half-written export.
+#
+#   python sectoral_export.py exports/sectoral
+#   python sectoral_export.py exports/sectoral --parquet   # needs pyarrow
+#
+# With share_snapshot = true in config.ini the UDF servers and the loader
+# keep the export current themselves (see publish_export), so every UDF
+# server process attaches to the same pages instead of reading SQLite.
+
+MANIFEST_FILE = 'manifest.json'
+PUBLISH_LOCK = 'publish.lock'
+# A lock older than this was left by a publisher that died mid-export
+PUBLISH_LOCK_TIMEOUT_SECONDS = 120
+SHARED_DIR_SUFFIX = '.snapshot'
+ROWS_FILE_PREFIX = '_rows'
+KEY_COLUMNS = ('sector', 'date', 'date_key')
+
+
+def value_fields(db_path, table_name):
+    conn = sqlite3.connect(db_path)
+    try:
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+    finally:
+        conn.close()
+    return [c for c in columns if c not in KEY_COLUMNS]
+
+def source_stamp(db_path):
+    """Identifies the DB contents an export was taken from."""
+    st = os.stat(db_path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+def _write_json_atomic(path, payload):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=1)
+    os.replace(tmp_path, path)
+
+def _remove_stale_files(out_dir, keep):
+    """Best effort: files still mapped by a reader on Windows stay until next export."""
+    for name in os.listdir(out_dir):
+        if name.endswith('.npy') and name not in keep:
+            try:
+                os.remove(os.path.join(out_dir, name))
+            except OSError:
+                pass
+
+def export_npy(db_path, table_name, out_dir, fields=None):
+    """Exports the table to out_dir as .npy files plus manifest.json; returns the manifest."""
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError("The .npy export requires numpy (pip install numpy).")
+
+    start_time = time.perf_counter()
+    # Taken before reading: if the DB changes mid-export the stamp won't match
+    stamp = source_stamp(db_path)
+    fields = list(fields or value_fields(db_path, table_name))
+    snapshot = SectoralSnapshot.load(db_path, table_name, fields)
+
+    os.makedirs(out_dir, exist_ok=True)
+    export_id = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    files = {}
+    for field in fields:
+        name = f"{field}.{export_id}.npy"
+        tmp_path = os.path.join(out_dir, name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, snapshot.array(field))
+        os.replace(tmp_path, os.path.join(out_dir, name))
+        files[field] = name
+
+    rows_name = f"{ROWS_FILE_PREFIX}.{export_id}.npy"
+    tmp_path = os.path.join(out_dir, rows_name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.save(f, snapshot.row_mask())
+    os.replace(tmp_path, os.path.join(out_dir, rows_name))
+
+    manifest = {
+        'format': 'npy',
+        'table': table_name,
+        'export_id': export_id,
+        'source': stamp,
+        'sectors': snapshot.sectors,
+        'dates': snapshot.dates,
+        'files': files,
+        'rows': rows_name,
+        'time_ms': round((time.perf_counter() - start_time) * 1000, 2),
+    }
+    _write_json_atomic(os.path.join(out_dir, MANIFEST_FILE), manifest)
+    _remove_stale_files(out_dir, set(files.values()) | {rows_name})
+    return manifest
+
+def read_manifest(export_dir):
+    with open(os.path.join(export_dir, MANIFEST_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+def is_fresh(export_dir, db_path, table_name):
+    """True if export_dir holds an export of table_name from the DB as it is now."""
+    try:
+        manifest = read_manifest(export_dir)
+    except (OSError, ValueError):
+        return False
+    # Exports without a row mask predate it and would drop NULL rows
+    return (
+        manifest.get('table') == table_name and manifest.get('source') == source_stamp(db_path)
+        and 'rows' in manifest
+    )
+
+def configured_export_dir(config, script_dir, db_path):
+    """
+    Export directory from the [Database] section: snapshot_export_dir, else
+    <db file>.snapshot next to the DB when share_snapshot is on, else ''.
+    """
+    export_dir = config.get('snapshot_export_dir', fallback='').strip()
+    if export_dir:
+        return os.path.join(script_dir, export_dir)
+    if config.getboolean('share_snapshot', fallback=False):
+        return db_path + SHARED_DIR_SUFFIX
+    return ''
+
+def open_export(export_dir, fields=None):
+    """Memory-maps an export as a read-only SectoralSnapshot (no values are copied)."""
+    import numpy as np
+
+    start_time = time.perf_counter()
+    manifest = read_manifest(export_dir)
+    sectors = [sys.intern(s) for s in manifest['sectors']]
+    dates = [sys.intern(d) for d in manifest['dates']]
+
+    values = {}
+    for field, name in manifest['files'].items():
+        if fields is not None and field not in fields:
+            continue
+        grid = np.load(os.path.join(export_dir, name), mmap_mode='r')
+        if grid.shape != (len(sectors), len(dates)):
+            raise ValueError(f"{name}: shape {grid.shape} does not match the manifest.")
+        values[field] = grid.reshape(-1)
+
+    rows = None
+    if 'rows' in manifest:
+        rows = np.load(os.path.join(export_dir, manifest['rows']), mmap_mode='r').reshape(-1)
+
+    load_time_ms = (time.perf_counter() - start_time) * 1000
+    return SectoralSnapshot(
+        sectors, dates, values, load_time_ms, read_only=True, version=manifest['export_id'], rows=rows
+    )
+
+def read_frame(export_dir, field):
+    """One field as a pandas DataFrame (index: sectors, columns: dates) over the memmap."""
+    try:
+        import pandas as pd
+    except ImportError:
+        raise ImportError("read_frame requires pandas (pip install pandas).")
+    snapshot = open_export(export_dir, [field])
+    return pd.DataFrame(snapshot.array(field), index=snapshot.sectors, columns=snapshot.dates, copy=False)
+
+# --- Shared Publishing ---
+#
+# Any process may find the export stale (a new UDF server, or one that saw
+# the loader change the DB) and republish it. The lock file keeps two
+# publishers from deleting each other's data files; readers never take it,
+# they just follow manifest.json to the newest complete export.
+
+def _acquire_publish_lock(lock_path):
+    """True if this process may publish; False while another one is publishing."""
+    for _ in range(2):
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(lock_path).st_mtime < PUBLISH_LOCK_TIMEOUT_SECONDS:
+                    return False
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+    return False
+
+def publish_export(db_path, table_name, out_dir, fields=None):
+    """
+    Re-exports out_dir unless it is already current for the DB. Returns the
+    new manifest, or None if nothing was written (already current, or
+    another process is publishing right now).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    lock_path = os.path.join(out_dir, PUBLISH_LOCK)
+    if not _acquire_publish_lock(lock_path):
+        return None
+    try:
+        # Checked under the lock: another process may have just published
+        if is_fresh(out_dir, db_path, table_name):
+            return None
+        return export_npy(db_path, table_name, out_dir, fields)
+    finally:
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+# --- Parquet Export (optional) ---
+
+def export_parquet(db_path, table_name, out_dir, fields=None):
+    """Writes a Parquet dataset partitioned by sector (sector=<name>/...) for other tools."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("The Parquet export requires pyarrow (pip install pyarrow).")
+
+    fields = list(fields or value_fields(db_path, table_name))
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.execute(
+            f"SELECT sector, date(date), {', '.join(fields)} FROM {table_name} ORDER BY sector, date"
+        )
+        columns = list(zip(*cursor.fetchall())) or [()] * (len(fields) + 2)
+    finally:
+        conn.close()
+
+    table = pa.table(
+        [
+            pa.array(columns[0], pa.string()),
+            pa.array([datetime.strptime(d, '%Y-%m-%d').date() for d in columns[1]], pa.date32()),
+        ]
+        + [pa.array(c, pa.float64()) for c in columns[2:]],
+        names=['sector', 'date'] + fields,
+    )
+    pq.write_to_dataset(table, out_dir, partition_cols=['sector'], existing_data_behavior='delete_matching')
+    return {'format': 'parquet', 'table': table_name, 'rows': table.num_rows, 'fields': fields}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the sectoral table to a columnar snapshot.")
+    parser.add_argument('out_dir', help="Directory to write (created if missing).")
+    parser.add_argument('--fields', nargs='+', help="Fields to export (default: all).")
+    parser.add_argument('--parquet', action='store_true', help="Write a Parquet dataset instead (needs pyarrow).")
+    args = parser.parse_args()
+
+    try:
+        config = get_config()
+        script_dir = os.path.dirname(__file__)
+        db_full_path = os.path.join(script_dir, config.get('db_path'))
+        table_name = config.get('table_name')
+
+        if args.parquet:
+            result = export_parquet(db_full_path, table_name, args.out_dir, args.fields)
+            print(f"Wrote {result['rows']} rows as Parquet to {args.out_dir}")
+        else:
+            result = export_npy(db_full_path, table_name, args.out_dir, args.fields)
+            print(
+                f"Exported {len(result['sectors'])} sectors x {len(result['dates'])} dates, "
+                f"{len(result['files'])} field(s) to {args.out_dir} in {result['time_ms']} ms."
+            )
+    except Exception as e:
+        print(f"Failed to export: {e}")
+        sys.exit(1)
@@ -0,0 +1,264 @@
+import sqlite3
+import argparse
+import csv
+import os
+import sys
+import time
+from datetime import datetime, date
+
+from apply_index import get_config
+import sectoral_blobs
+import sectoral_coverage
+import sectoral_materialize
+from sectoral_export import MANIFEST_FILE, configured_export_dir, publish_export
+
+# --- Incremental Quarterly Loader ---
+#
+# Upserts new quarter rows from CSV/XLSX files into the sectoral table in one
+# transaction, instead of replacing the .db file by hand. Every touched
+# (sector, date) is appended to a change log so running UDF servers can
+# refresh only what changed.
+#
+# Input files need a header row with 'sector', 'date' and one column per
+# metric, e.g.:
+#
+#   sector,date,curr_ttm_ebitda_margins
+#   IT,2025-09-30,0.2391
+
+STORED_DATE_FORMAT = '%Y-%m-%d 00:00:00'
+UNIQUE_INDEX = 'ux_sector_date'
+
+def change_log_table(table_name):
+    return f"{table_name}_change_log"
+
+def ensure_loader_schema(conn, table_name):
+    """Creates the unique (sector, date) index and the change log table if missing."""
+    log_table = change_log_table(table_name)
+    conn.executescript(f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS {UNIQUE_INDEX}
+        ON {table_name} (sector, date);
+
+        CREATE TABLE IF NOT EXISTS {log_table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            loaded_at TEXT NOT NULL,
+            sector TEXT NOT NULL,
+            date_key TEXT NOT NULL,
+            op TEXT NOT NULL
+        );
+    """)
+
+def read_changes(conn, table_name, since_id=None):
+    """
+    Returns (max_id, [(sector, date_key), ...]) for log entries after since_id,
+    or None if the DB has no change log. With since_id=None only max_id is read.
+    """
+    log_table = change_log_table(table_name)
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (log_table,))
+    if cursor.fetchone() is None:
+        return None
+
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {log_table}")
+    max_id = cursor.fetchone()[0]
+    if since_id is None:
+        return max_id, []
+
+    cursor.execute(
+        f"SELECT DISTINCT sector, date_key FROM {log_table} WHERE id > ? AND id <= ?",
+        (since_id, max_id),
+    )
+    return max_id, cursor.fetchall()
+
+# --- File Readers ---
+
+def _normalize_date(value):
+    """Accepts Excel datetimes or 'YYYY-MM-DD[ HH:MM:SS]' text; returns stored format."""
+    if isinstance(value, datetime):
+        return value.strftime(STORED_DATE_FORMAT)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day).strftime(STORED_DATE_FORMAT)
+    if isinstance(value, str):
+        text = value.strip().split(' ')[0]
+        return datetime.strptime(text, '%Y-%m-%d').strftime(STORED_DATE_FORMAT)
+    raise ValueError(f"Invalid date value: {value!r}")
+
+def _normalize_value(value):
+    if value is None or value == '':
+        return None
+    return float(value)
+
+def _rows_from_records(header, records, source):
+    header = [str(h).strip() if h is not None else '' for h in header]
+    if 'sector' not in header or 'date' not in header:
+        raise ValueError(f"{source}: header must contain 'sector' and 'date' columns.")
+
+    fields = [h for h in header if h and h not in ('sector', 'date')]
+    sector_pos = header.index('sector')
+    date_pos = header.index('date')
+    field_pos = [header.index(f) for f in fields]
+
+    rows = []
+    for line_no, record in enumerate(records, start=2):
+        if not record or all(v in (None, '') for v in record):
+            continue
+        try:
+            sector = str(record[sector_pos]).strip()
+            date_str = _normalize_date(record[date_pos])
+            values = [_normalize_value(record[p]) for p in field_pos]
+        except (ValueError, IndexError) as e:
+            raise ValueError(f"{source}, row {line_no}: {e}")
+        rows.append((sector, date_str, *values))
+    return fields, rows
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return [], []
+        return _rows_from_records(header, list(reader), path)
+
+def read_xlsx(path, sheet=None):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportError("Reading .xlsx files requires openpyxl (pip install openpyxl).")
+
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet] if sheet else wb.worksheets[0]
+        records = ws.iter_rows(values_only=True)
+        header = next(records, None)
+        if header is None:
+            return [], []
+        return _rows_from_records(header, list(records), path)
+    finally:
+        wb.close()
+
+def read_rows(path, sheet=None):
+    """Returns (fields, rows) where rows are (sector, stored_date, *values)."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return read_csv(path)
+    if ext in ('.xlsx', '.xlsm'):
+        return read_xlsx(path, sheet)
+    raise ValueError(f"Unsupported file type: {path}")
+
+# --- Upsert ---
+
+def upsert_rows(db_path, table_name, fields, rows):
+    """
+    Writes rows in one transaction and logs every touched (sector, date).
+    The touched sectors' coverage rows and blob blocks are updated in the
+    same transaction, so readers never see the data without them.
+    Uses plain INSERTs when every row is newer than the table's latest date
+    (the usual new-quarter load), and INSERT ... ON CONFLICT otherwise.
+    Returns a summary dict.
+    """
+    if not rows:
+        return {'rows': 0, 'mode': 'none', 'time_ms': 0.0}
+
+    start_time = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.cursor()
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table_name})")]
+        unknown = [f for f in fields if f not in columns]
+        if unknown:
+            raise ValueError(f"Columns not in table '{table_name}': {unknown}")
+
+        ensure_loader_schema(conn, table_name)
+
+        cursor.execute(f"SELECT MAX(date) FROM {table_name}")
+        latest = cursor.fetchone()[0]
+        keys = {(row[0], row[1]) for row in rows}
+        append_only = len(keys) == len(rows) and (latest is None or min(row[1] for row in rows) > latest)
+
+        column_list = ', '.join(['sector', 'date'] + fields)
+        placeholders = ', '.join('?' * (len(fields) + 2))
+        if append_only:
+            mode = 'append'
+            query = f"INSERT INTO {table_name} ({column_list}) VALUES ({placeholders})"
+        else:
+            mode = 'upsert'
+            updates = ', '.join(f"{f} = excluded.{f}" for f in fields) or 'sector = excluded.sector'
+            query = (
+                f"INSERT INTO {table_name} ({column_list}) VALUES ({placeholders}) "
+                f"ON CONFLICT(sector, date) DO UPDATE SET {updates}"
+            )
+
+        loaded_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        log_rows = [(loaded_at, sector, date_str[:10], mode) for sector, date_str in sorted(keys)]
+
+        with conn:
+            cursor.executemany(query, rows)
+            cursor.executemany(
+                f"INSERT INTO {change_log_table(table_name)} (loaded_at, sector, date_key, op) VALUES (?, ?, ?, ?)",
+                log_rows,
+            )
+            if sectoral_coverage.has_coverage(conn, table_name):
+                sectoral_coverage.update_coverage(conn, table_name, {k[0] for k in keys})
+            if sectoral_blobs.has_blobs(conn, table_name):
+                sectoral_blobs.update_blobs(conn, table_name, {k[0] for k in keys})
+    finally:
+        conn.close()
+
+    return {
+        'rows': len(rows),
+        'sectors': len({k[0] for k in keys}),
+        'dates': len({k[1] for k in keys}),
+        'mode': mode,
+        'time_ms': round((time.perf_counter() - start_time) * 1000, 2),
+    }
+
+def load_files(db_path, table_name, paths, sheet=None, export_dir=''):
+    """
+    Reads every file and upserts them together in one transaction (which
+    also re-encodes the loaded sectors' blobs), then refreshes the loaded
+    quarters in the materialized tables if they exist, and republishes the
+    snapshot export in export_dir if there is one.
+    """
+    all_fields = None
+    all_rows = []
+    for path in paths:
+        fields, rows = read_rows(path, sheet)
+        if all_fields is None:
+            all_fields = fields
+        elif fields != all_fields:
+            raise ValueError(f"{path}: columns {fields} differ from {all_fields}")
+        all_rows.extend(rows)
+    summary = upsert_rows(db_path, table_name, all_fields or [], all_rows)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        present = sectoral_materialize.has_materialized(conn, table_name)
+    finally:
+        conn.close()
+    if present:
+        summary['materialized'] = sectoral_materialize.refresh_materialized(db_path, table_name)
+    if export_dir and os.path.exists(os.path.join(export_dir, MANIFEST_FILE)):
+        manifest = publish_export(db_path, table_name, export_dir)
+        summary['export'] = manifest['export_id'] if manifest is not None else None
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upsert quarterly rows from CSV/XLSX into the sectoral DB.")
+    parser.add_argument('files', nargs='+', help="CSV or XLSX files with sector, date and metric columns.")
+    parser.add_argument('--sheet', help="Worksheet name for XLSX input (default: first sheet).")
+    args = parser.parse_args()
+
+    try:
+        config = get_config()
+        script_dir = os.path.dirname(__file__)
+        db_full_path = os.path.join(script_dir, config.get('db_path'))
+        table_name = config.get('table_name')
+
+        export_dir = configured_export_dir(config, script_dir, db_full_path)
+        summary = load_files(db_full_path, table_name, args.files, args.sheet, export_dir)
+        print(
+            f"Loaded {summary['rows']} rows ({summary['mode']}) into '{table_name}' "
+            f"in {summary['time_ms']} ms."
+        )
+    except Exception as e:
+        print(f"Failed to load: {e}")
+        sys.exit(1)
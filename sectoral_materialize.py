@@ -0,0 +1,273 @@
+import sqlite3
+import argparse
+import os
+import sys
+import time
+
+from apply_index import get_config
+
+# --- Materialized Pivot Tables ---
+#
+# Keeps two derived tables next to the base table:
+#
+#   <table>_wide     one row per (field, date_key), one REAL column per sector
+#                    ("s:<sector name>"), so a cross-sector matrix is one row
+#   <table>_summary  one row per (sector, field): first/latest date, latest
+#                    value, min, max and count of non-blank values
+#
+# Triggers on the base table record every touched (sector, date_key) in
+# <table>_mv_queue. A refresh rebuilds only the queued quarters (wide rows)
+# and sectors (summary rows) and empties the queue in the same transaction;
+# the tables are fresh exactly when the queue is empty.
+#
+#   python sectoral_materialize.py            # incremental refresh
+#   python sectoral_materialize.py --full     # rebuild from scratch
+
+KEY_COLUMNS = ('sector', 'date', 'date_key')
+SECTOR_PREFIX = 's:'
+DAY_END = ' 23:59:59'
+
+
+def wide_table(table_name):
+    return f"{table_name}_wide"
+
+def summary_table(table_name):
+    return f"{table_name}_summary"
+
+def queue_table(table_name):
+    return f"{table_name}_mv_queue"
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _table_exists(conn, name):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+    return row is not None
+
+def _columns(conn, name):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({_quote(name)})")]
+
+def ensure_materialized_schema(conn, table_name):
+    """Creates the derived tables, the refresh queue and its triggers if missing."""
+    queue = queue_table(table_name)
+
+    # Not INSERT OR IGNORE: an outer ON CONFLICT (the loader's upsert)
+    # overrides a trigger's conflict clause
+    def enqueue(row):
+        return (
+            f"INSERT INTO {queue} SELECT {row}.sector, date({row}.date) WHERE NOT EXISTS "
+            f"(SELECT 1 FROM {queue} WHERE sector = {row}.sector AND date_key = date({row}.date));"
+        )
+
+    # Separate execute() calls: executescript() would commit the caller's transaction
+    statements = [
+        f"""CREATE TABLE IF NOT EXISTS {wide_table(table_name)} (
+            field TEXT NOT NULL,
+            date_key TEXT NOT NULL,
+            PRIMARY KEY (field, date_key)
+        ) WITHOUT ROWID""",
+        f"""CREATE TABLE IF NOT EXISTS {summary_table(table_name)} (
+            sector TEXT NOT NULL,
+            field TEXT NOT NULL,
+            first_date TEXT,
+            latest_date TEXT,
+            latest_value REAL,
+            min_value REAL,
+            max_value REAL,
+            n_values INTEGER NOT NULL,
+            PRIMARY KEY (sector, field)
+        ) WITHOUT ROWID""",
+        f"""CREATE TABLE IF NOT EXISTS {queue} (
+            sector TEXT NOT NULL,
+            date_key TEXT NOT NULL,
+            PRIMARY KEY (sector, date_key)
+        ) WITHOUT ROWID""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table_name}_mv_insert
+        AFTER INSERT ON {table_name}
+        BEGIN
+            {enqueue('NEW')}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table_name}_mv_update
+        AFTER UPDATE ON {table_name}
+        BEGIN
+            {enqueue('OLD')}
+            {enqueue('NEW')}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_{table_name}_mv_delete
+        AFTER DELETE ON {table_name}
+        BEGIN
+            {enqueue('OLD')}
+        END""",
+    ]
+    for statement in statements:
+        conn.execute(statement)
+
+def has_materialized(conn, table_name):
+    return _table_exists(conn, queue_table(table_name))
+
+def is_fresh(conn, table_name):
+    """True if the derived tables exist and no base-table change is pending."""
+    if not (has_materialized(conn, table_name) and _table_exists(conn, wide_table(table_name))):
+        return False
+    return conn.execute(f"SELECT 1 FROM {queue_table(table_name)} LIMIT 1").fetchone() is None
+
+# --- Refresh ---
+
+def _date_filter(base_columns):
+    if 'date_key' in base_columns:
+        return "date_key = ?", lambda d: (d,)
+    # Whole-day range on the stored timestamp text keeps idx_date usable
+    return "date BETWEEN ? AND ?", lambda d: (d, d + DAY_END)
+
+def _refresh_wide(conn, table_name, fields, date_keys, full):
+    wide = wide_table(table_name)
+    base_columns = _columns(conn, table_name)
+    select = f"SELECT sector, date(date), {', '.join(fields)} FROM {table_name}"
+
+    if full:
+        conn.execute(f"DELETE FROM {wide}")
+        rows = conn.execute(select).fetchall()
+    else:
+        where, params = _date_filter(base_columns)
+        rows = []
+        for date_key in date_keys:
+            conn.execute(f"DELETE FROM {wide} WHERE date_key = ?", (date_key,))
+            rows.extend(conn.execute(f"{select} WHERE {where}", params(date_key)).fetchall())
+
+    # New sectors get a column; columns are never dropped, only left blank
+    sector_columns = [c for c in _columns(conn, wide) if c.startswith(SECTOR_PREFIX)]
+    known = set(sector_columns)
+    for sector in sorted({row[0] for row in rows}):
+        column = SECTOR_PREFIX + sector
+        if column not in known:
+            conn.execute(f"ALTER TABLE {wide} ADD COLUMN {_quote(column)} REAL")
+            sector_columns.append(column)
+            known.add(column)
+
+    position = {column[len(SECTOR_PREFIX):]: k for k, column in enumerate(sector_columns)}
+    pivot = {}
+    for sector, date_key, *values in rows:
+        for field, value in zip(fields, values):
+            cells = pivot.get((field, date_key))
+            if cells is None:
+                cells = pivot[(field, date_key)] = [None] * len(sector_columns)
+            cells[position[sector]] = value
+
+    column_list = ', '.join(['field', 'date_key'] + [_quote(c) for c in sector_columns])
+    placeholders = ', '.join('?' * (len(sector_columns) + 2))
+    conn.executemany(
+        f"INSERT INTO {wide} ({column_list}) VALUES ({placeholders})",
+        [(field, date_key, *cells) for (field, date_key), cells in pivot.items()],
+    )
+    return len({date_key for _, date_key in pivot})
+
+def _refresh_summary(conn, table_name, fields, sectors, full):
+    summary = summary_table(table_name)
+    if full:
+        conn.execute(f"DELETE FROM {summary}")
+        sector_filter, params = "", ()
+    else:
+        placeholders = ', '.join('?' * len(sectors))
+        conn.execute(f"DELETE FROM {summary} WHERE sector IN ({placeholders})", tuple(sectors))
+        sector_filter, params = f"AND sector IN ({placeholders})", tuple(sectors)
+
+    for field in fields:
+        conn.execute(f"""
+            INSERT INTO {summary}
+            SELECT sector, ?, date(MIN(date)), date(MAX(date)),
+                   (SELECT {field} FROM {table_name} AS latest
+                    WHERE latest.sector = base.sector AND latest.{field} IS NOT NULL
+                    ORDER BY latest.date DESC LIMIT 1),
+                   MIN({field}), MAX({field}), COUNT({field})
+            FROM {table_name} AS base
+            WHERE {field} IS NOT NULL {sector_filter}
+            GROUP BY sector
+        """, (field,) + params)
+
+def refresh_materialized(db_path, table_name, full=False):
+    """
+    Brings the wide and summary tables up to date with the base table.
+    Incremental unless `full` or the tables are missing or out of step with
+    the base table's fields. Returns a summary dict.
+    """
+    start_time = time.perf_counter()
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        # Holding the write lock keeps the queue and base table consistent
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            created = not has_materialized(conn, table_name)
+            ensure_materialized_schema(conn, table_name)
+
+            fields = [c for c in _columns(conn, table_name) if c not in KEY_COLUMNS]
+            stored_fields = {row[0] for row in conn.execute(f"SELECT DISTINCT field FROM {wide_table(table_name)}")}
+            full = bool(full or created or (stored_fields and stored_fields != set(fields)))
+
+            queue = queue_table(table_name)
+            pending = conn.execute(f"SELECT sector, date_key FROM {queue}").fetchall()
+            date_keys = sorted({date_key for _, date_key in pending})
+            sectors = sorted({sector for sector, _ in pending})
+
+            n_dates = 0
+            if full or pending:
+                n_dates = _refresh_wide(conn, table_name, fields, date_keys, full)
+                _refresh_summary(conn, table_name, fields, sectors, full)
+            conn.execute(f"DELETE FROM {queue}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+    return {
+        'mode': 'full' if full else 'incremental',
+        'dates': n_dates if full else len(date_keys),
+        'sectors': None if full else len(sectors),
+        'time_ms': round((time.perf_counter() - start_time) * 1000, 2),
+    }
+
+# --- Reads (used by the UDFs when is_fresh) ---
+
+def read_matrix(conn, table_name, field, date_key):
+    """(sector, value) pairs for every sector with a value on date_key, sorted by sector."""
+    cursor = conn.execute(
+        f"SELECT * FROM {wide_table(table_name)} WHERE field = ? AND date_key = ?", (field, date_key)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return []
+    names = [d[0] for d in cursor.description]
+    return sorted(
+        (name[len(SECTOR_PREFIX):], value)
+        for name, value in zip(names[2:], row[2:])
+        if value is not None
+    )
+
+def read_summary(conn, table_name, sector, field):
+    """(first_date, latest_date, latest_value, min, max, count) or None."""
+    return conn.execute(
+        f"SELECT first_date, latest_date, latest_value, min_value, max_value, n_values "
+        f"FROM {summary_table(table_name)} WHERE sector = ? AND field = ?",
+        (sector, field),
+    ).fetchone()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or refresh the materialized pivot tables.")
+    parser.add_argument('--full', action='store_true', help="Rebuild everything instead of only queued quarters.")
+    args = parser.parse_args()
+
+    try:
+        config = get_config()
+        script_dir = os.path.dirname(__file__)
+        db_full_path = os.path.join(script_dir, config.get('db_path'))
+        table_name = config.get('table_name')
+
+        result = refresh_materialized(db_full_path, table_name, args.full)
+        print(
+            f"Materialized tables refreshed ({result['mode']}): {result['dates']} quarter(s) "
+            f"in {result['time_ms']} ms."
+        )
+    except Exception as e:
+        print(f"Failed to refresh: {e}")
+        sys.exit(1)
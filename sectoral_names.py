@@ -0,0 +1,105 @@
+from bisect import bisect_left
+from collections import defaultdict
+
+# --- Sector Name Index ---
+#
+# Resolves what users type in a sheet to the exact `sector` values in the DB:
+# "auto & auto components", " Auto &  Auto Components" and an alias from
+# config.ini all map to "Auto & Auto Components" with one dict lookup.
+# Names are compared casefolded with runs of whitespace (including the
+# non-breaking spaces Excel pastes) collapsed to one space:
+#
+#   [Sector Aliases]
+#   autos = Auto & Auto Components
+#   tech = IT
+#
+# Unknown names are never guessed: the error suggests the closest sectors,
+# found through a prefix index (sorted keys) and a trigram index.
+
+SUGGEST_LIMIT = 3
+# Minimum trigram Jaccard similarity for a suggestion
+SUGGEST_MIN_SIMILARITY = 0.3
+
+
+def normalize(name):
+    """Casefolded name with whitespace collapsed; the index key."""
+    return ' '.join(str(name).split()).casefold()
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SectorIndex:
+    """Normalized names and aliases of a sector list, with suggestions for misses."""
+
+    def __init__(self, sectors, aliases=None):
+        self.sectors = list(sectors)
+        self.names = {}
+        for sector in self.sectors:
+            self.names.setdefault(normalize(sector), sector)
+
+        # Aliases never shadow a real sector name
+        self.unknown_aliases = []
+        for alias, target in (aliases or {}).items():
+            canonical = self.names.get(normalize(target))
+            if canonical is None:
+                self.unknown_aliases.append(alias)
+            else:
+                self.names.setdefault(normalize(alias), canonical)
+
+        self._prefixes = sorted(self.names)
+        self._grams = {key: _trigrams(key) for key in self.names}
+        self._by_gram = defaultdict(set)
+        for key, grams in self._grams.items():
+            for gram in grams:
+                self._by_gram[gram].add(key)
+
+    def __len__(self):
+        return len(self.sectors)
+
+    def resolve(self, name):
+        """The DB's sector name for `name`, or None."""
+        if name is None:
+            return None
+        return self.names.get(normalize(name))
+
+    def suggest(self, name, limit=SUGGEST_LIMIT):
+        """Up to `limit` sector names close to `name`: prefix matches first, then by trigram similarity."""
+        key = normalize(name)
+        found = []
+        if key:
+            i = bisect_left(self._prefixes, key)
+            while i < len(self._prefixes) and self._prefixes[i].startswith(key):
+                found.append(self._prefixes[i])
+                i += 1
+            found.sort(key=len)
+
+        grams = _trigrams(key)
+        shared = defaultdict(int)
+        for gram in grams:
+            for candidate in self._by_gram.get(gram, ()):
+                shared[candidate] += 1
+        scored = sorted(
+            (-n / (len(grams) + len(self._grams[candidate]) - n), candidate)
+            for candidate, n in shared.items()
+        )
+        found += [candidate for score, candidate in scored if -score >= SUGGEST_MIN_SIMILARITY]
+
+        suggestions = []
+        for candidate in found:
+            sector = self.names[candidate]
+            if sector not in suggestions:
+                suggestions.append(sector)
+        return suggestions[:limit]
+
+    def lookup(self, name):
+        """Like resolve(), but raises LookupError naming the closest sectors on a miss."""
+        sector = self.resolve(name)
+        if sector is not None:
+            return sector
+        message = f"Unknown sector: '{name}'."
+        suggestions = self.suggest(name) if name is not None else []
+        if suggestions:
+            message += f" Did you mean {' or '.join(repr(s) for s in suggestions)}?"
+        raise LookupError(message)
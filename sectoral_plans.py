@@ -0,0 +1,121 @@
+import sqlite3
+import argparse
+import os
+import pathlib
+import sys
+
+# --- Query Plan Guardrails ---
+#
+# Runs EXPLAIN QUERY PLAN on every keyed read the UDFs issue and flags the
+# ones SQLite would answer by walking a whole table or index (e.g. the
+# cross-section query on a DB with only idx_sector_date). When the DB file is
+# writable, the missing covering indexes are created and ANALYZE refreshes
+# the planner statistics, then the plans are checked again:
+#
+#   idx_<table>_sector_cover   (sector, <date column>, <fields>)  histories, grids
+#   idx_<table>_date_cover     (<date column>, sector, <fields>)  cross-sections
+#
+# The UDF server runs this once in the background at startup
+# (check_query_plans in config.ini); by hand:
+#
+#   python sectoral_plans.py              # check and fix
+#   python sectoral_plans.py --no-fix     # only report
+
+SECTOR_COVER = 'idx_{table}_sector_cover'
+DATE_COVER = 'idx_{table}_date_cover'
+
+
+def covering_indexes(table_name, fields, date_column):
+    """{index name: column list} of the covering indexes for these fields."""
+    columns = ', '.join(fields)
+    return {
+        SECTOR_COVER.format(table=table_name): f"sector, {date_column}, {columns}",
+        DATE_COVER.format(table=table_name): f"{date_column}, sector, {columns}",
+    }
+
+def explain(conn, sql, params):
+    """The plan steps SQLite reports for one statement."""
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+def scan_steps(plan, whole_table=False):
+    """
+    Steps that read a whole table or index. Statements that read every
+    sector anyway (whole_table) may scan a covering index.
+    """
+    return [
+        step for step in plan
+        if step.startswith('SCAN') and not (whole_table and 'COVERING INDEX' in step)
+    ]
+
+def check_plans(db_path, statements):
+    """{name: (plan, scan steps)} for statements given as {name: (sql, params, whole_table)}."""
+    conn = sqlite3.connect(pathlib.Path(db_path).resolve().as_uri() + '?mode=ro', uri=True)
+    try:
+        results = {}
+        for name, (sql, params, whole_table) in statements.items():
+            plan = explain(conn, sql, params)
+            results[name] = (plan, scan_steps(plan, whole_table))
+        return results
+    finally:
+        conn.close()
+
+def create_covering_indexes(db_path, table_name, fields, date_column):
+    """Creates whichever covering indexes are missing, then runs ANALYZE. Returns the names created."""
+    conn = sqlite3.connect(db_path, timeout=5)
+    try:
+        existing = {
+            row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (table_name,)
+            )
+        }
+        created = []
+        for name, columns in covering_indexes(table_name, fields, date_column).items():
+            if name not in existing:
+                conn.execute(f"CREATE INDEX {name} ON {table_name} ({columns})")
+                created.append(name)
+        conn.execute("ANALYZE")
+        conn.commit()
+        return created
+    finally:
+        conn.close()
+
+def verify_query_plans(db_path, table_name, fields, date_column, statements, fix=True):
+    """
+    Checks every statement's plan; with `fix` and a writable DB, creates the
+    covering indexes for any that scan and checks again. Returns
+    {'plans': {name: plan}, 'scans': {name: scan steps}, 'created': [...], 'fixed': bool}.
+    """
+    results = check_plans(db_path, statements)
+    created = []
+    fixed = False
+    if fix and any(steps for _, steps in results.values()) and os.access(db_path, os.W_OK):
+        created = create_covering_indexes(db_path, table_name, fields, date_column)
+        results = check_plans(db_path, statements)
+        fixed = True
+
+    return {
+        'plans': {name: plan for name, (plan, _) in results.items()},
+        'scans': {name: steps for name, (_, steps) in results.items() if steps},
+        'created': created,
+        'fixed': fixed,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that every UDF query uses an index.")
+    parser.add_argument('--no-fix', action='store_true', help="Only report; don't create indexes or ANALYZE.")
+    args = parser.parse_args()
+
+    try:
+        import sectoral_data_udf
+
+        report = sectoral_data_udf.check_query_plans(fix=not args.no_fix)
+        for name, plan in report['plans'].items():
+            flag = 'SCAN' if name in report['scans'] else 'ok'
+            print(f"{name:16s} | {flag:4s} | {' / '.join(plan)}")
+        if report['created']:
+            print(f"Created: {', '.join(report['created'])}")
+        if report['scans']:
+            sys.exit(1)
+    except Exception as e:
+        print(f"Failed to check query plans: {e}")
+        sys.exit(1)
@@ -0,0 +1,415 @@
+import argparse
+import math
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import sectoral_data_udf as udf
+
+# --- Headless Report Generator ---
+#
+# Fills an Excel template without Excel: finds every cell whose formula is a
+# call to one of the UDFs below (=get_series(A1, B1, "2020-03-31", C1), also
+# as an array formula or with Excel's _xludf. prefix), resolves the
+# arguments from the template's cells, runs the calls in-process against the
+# snapshot or DB, and saves a copy with the formulas replaced by their values.
+# Table results spill down and right from the formula cell as in Excel.
+#
+# Calls are resolved in one batched pass per workbook: identical calls run
+# once, and every single-value lookup of a field is answered by one
+# get_sectoral_grid-style query. Cells that reference another UDF cell wait
+# for it. Other formulas are left as they are.
+#
+# Several output workbooks (several templates, or one per --each value) are
+# rendered in parallel on a process pool. Needs openpyxl.
+#
+#   python sectoral_report.py example.xlsx --out-dir reports
+#   python sectoral_report.py pack.xlsx --set C1=2025-06-30 --each A1 IT Healthcare "Capital Goods"
+#   python sectoral_report.py q1.xlsx q2.xlsx q3.xlsx --workers 3 --snapshot
+
+REPORT_FUNCTIONS = (
+    'get_sectoral_quarterly_data', 'get_series', 'get_quarterly_matrix', 'get_series_multi',
+    'get_available_fields', 'get_all_revenue_growth', 'get_source_comparison', 'get_source_matrix',
+    'get_sources', 'get_sector_summary', 'get_sectoral_grid', 'get_sector_qoq', 'get_sector_yoy',
+    'get_rolling_mean', 'get_sector_zscore', 'get_cross_sector_rank', 'get_coverage',
+)
+ASYNC_SUFFIX = '_async'
+# Positions of the parameters the UDFs declare with @xw.arg(..., ndim=1):
+# xlwings passes those as a list even for a single cell or a literal
+LIST_ARGS = {
+    'get_series_multi': (1,),
+    'get_source_comparison': (2,),
+    'get_source_matrix': (2,),
+    'get_sectoral_grid': (0, 1),
+}
+SPILL_ERROR = "Error: #SPILL! (the result would overwrite other cells)"
+
+FORMULA_RE = re.compile(r'^=\s*(?:_xludf\.|_xlfn\.)?([A-Za-z_]\w*)\s*\((.*)\)\s*$', re.DOTALL)
+REFERENCE_RE = re.compile(
+    r"^(?:(?:'((?:[^']|'')+)'|([A-Za-z_][\w.]*))!)?(\$?[A-Za-z]{1,3}\$?\d+)(?::(\$?[A-Za-z]{1,3}\$?\d+))?$"
+)
+NUMBER_RE = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+
+
+def _require_openpyxl():
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportError("The report generator requires openpyxl (pip install openpyxl).")
+    return openpyxl
+
+# --- Formula Parsing ---
+
+def _split_args(text):
+    """Splits an argument list at top-level commas, respecting quotes and parentheses."""
+    args, depth, quoted, current = [], 0, False, []
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch in '({':
+            depth += 1
+        elif not quoted and ch in ')}':
+            depth -= 1
+        elif not quoted and depth == 0 and ch == ',':
+            args.append(''.join(current).strip())
+            current = []
+            continue
+        current.append(ch)
+    args.append(''.join(current).strip())
+    return [] if args == [''] else args
+
+def _parse_arg(text, sheet):
+    """('value', x) for a literal, ('ref', (sheet, range)) for a reference; ValueError otherwise."""
+    if text == '':
+        return 'value', None
+    if len(text) >= 2 and text[0] == text[-1] == '"':
+        return 'value', text[1:-1].replace('""', '"')
+    if NUMBER_RE.match(text):
+        return 'value', float(text)
+    if text.upper() in ('TRUE', 'FALSE'):
+        return 'value', text.upper() == 'TRUE'
+    if text.replace(' ', '').upper() == 'TODAY()':
+        return 'value', datetime.combine(datetime.today(), datetime.min.time())
+    m = REFERENCE_RE.match(text)
+    if m:
+        quoted_sheet, plain_sheet, first, last = m.groups()
+        ref_sheet = quoted_sheet.replace("''", "'") if quoted_sheet else (plain_sheet or sheet)
+        cells = first.replace('$', '').upper()
+        if last:
+            cells += ':' + last.replace('$', '').upper()
+        return 'ref', (ref_sheet, cells)
+    raise ValueError(f"Unsupported argument: {text}")
+
+def parse_udf_formula(formula, sheet):
+    """(function name, parsed args) if formula is a single UDF call, else None."""
+    m = FORMULA_RE.match(formula)
+    if not m:
+        return None
+    name = m.group(1).lower()
+    if name.endswith(ASYNC_SUFFIX):
+        name = name[:-len(ASYNC_SUFFIX)]
+    if name not in REPORT_FUNCTIONS:
+        return None
+    try:
+        return name, tuple(_parse_arg(arg, sheet) for arg in _split_args(m.group(2)))
+    except ValueError:
+        return None
+
+def _formula_text(value):
+    """The formula of a cell value (plain or array formula), else None."""
+    text = getattr(value, 'text', value)
+    if isinstance(text, str) and text.startswith('='):
+        return text
+    return None
+
+def find_udf_cells(wb):
+    """{(sheet, coordinate): (function name, parsed args)} for every UDF formula cell."""
+    found = {}
+    for ws in wb.worksheets:
+        for row in ws.iter_rows():
+            for cell in row:
+                formula = _formula_text(cell.value)
+                call = parse_udf_formula(formula, ws.title) if formula else None
+                if call is not None:
+                    found[(ws.title, cell.coordinate)] = call
+    return found
+
+# --- Resolution ---
+
+def _as_grid(result):
+    """A UDF result as rows of cells (a scalar is a 1 x 1 grid)."""
+    if hasattr(result, 'tolist'):
+        result = result.tolist()
+    if isinstance(result, (list, tuple)):
+        return [list(row) if isinstance(row, (list, tuple)) else [row] for row in result]
+    return [[result]]
+
+def _cell_value(value):
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+class _Workbook:
+    """A template plus the values known so far, for resolving references."""
+
+    def __init__(self, wb, cached_wb, udf_cells):
+        self.wb = wb
+        self.cached_wb = cached_wb
+        self.udf_cells = udf_cells
+        self.results = {}
+
+    def value(self, sheet, coordinate):
+        if (sheet, coordinate) in self.results:
+            return self.results[(sheet, coordinate)]
+        value = self.wb[sheet][coordinate].value
+        if _formula_text(value) is None:
+            return value
+        # Formulas that aren't UDF calls: the value Excel last saved with the file
+        return self.cached_wb[sheet][coordinate].value
+
+    def waits_on(self, args):
+        """True if an argument references a UDF cell that isn't resolved yet."""
+        for kind, arg in args:
+            if kind == 'ref' and arg[0] in self.wb.sheetnames:
+                sheet, cells = arg
+                for row in self.wb[sheet][cells] if ':' in cells else ((self.wb[sheet][cells],),):
+                    for cell in row:
+                        key = (sheet, cell.coordinate)
+                        if key in self.udf_cells and key not in self.results:
+                            return True
+        return False
+
+    def resolve_args(self, args, list_args=()):
+        """Argument values as the UDF receives them; positions in list_args always become lists."""
+        values = []
+        for i, (kind, arg) in enumerate(args):
+            if kind == 'value':
+                value = arg
+            else:
+                sheet, cells = arg
+                if sheet not in self.wb.sheetnames:
+                    raise ValueError(f"Unknown sheet: '{sheet}'.")
+                if ':' not in cells:
+                    value = self.value(sheet, cells)
+                else:
+                    # Ranges arrive flattened, like xlwings' ndim=1
+                    value = [self.value(sheet, cell.coordinate) for row in self.wb[sheet][cells] for cell in row]
+            # An omitted argument keeps the UDF's default, as in Excel
+            if i in list_args and not isinstance(value, list) and (kind == 'ref' or value is not None):
+                value = [value]
+            values.append(value)
+        return tuple(values)
+
+def _hashable(args):
+    return tuple(tuple(a) if isinstance(a, list) else a for a in args)
+
+def _prefetch_single_values(calls):
+    """
+    Answers get_sectoral_quarterly_data calls of the default source with one
+    grid query per (field, match). Returns {args: value}; lookups that come
+    back blank are left to the UDF itself, so misses keep its error text.
+    """
+    groups = {}
+    for args in calls:
+        sector, field, date = (args + (None,) * 3)[:3]
+        match = args[3] if len(args) > 3 and args[3] else 'exact'
+        source = args[4] if len(args) > 4 else None
+        if udf._source(source) is not None or not isinstance(sector, str) or not isinstance(field, str):
+            continue
+        try:
+            date_str = udf._format_date(date)
+        except ValueError:
+            continue
+        groups.setdefault((field, match), []).append((args, sector, date_str))
+
+    found = {}
+    for (field, match), members in groups.items():
+        sectors = tuple(sorted({sector for _, sector, _ in members}))
+        date_strs = tuple(sorted({date_str for _, _, date_str in members}))
+        block = udf._query_grid(sectors, field, date_strs, match)
+        if isinstance(block, str):
+            continue
+        row_of = {sector: k for k, sector in enumerate(sectors)}
+        col_of = {date_str: k for k, date_str in enumerate(date_strs)}
+        for args, sector, date_str in members:
+            value = block[row_of[sector]][col_of[date_str]]
+            if value is not None:
+                found[args] = value
+    return found
+
+def resolve_calls(book):
+    """Runs every UDF call of the workbook; returns {(sheet, coordinate): result grid}."""
+    grids = {}
+    pending = dict(book.udf_cells)
+    while pending:
+        ready = {key: call for key, call in pending.items() if not book.waits_on(call[1])}
+        if not ready:
+            # Circular references between UDF cells
+            for key in pending:
+                grids[key] = [["Error: circular reference between UDF cells."]]
+            break
+
+        resolved = {}
+        for key, (name, args) in ready.items():
+            try:
+                resolved[key] = (name, _hashable(book.resolve_args(args, LIST_ARGS.get(name, ()))))
+            except Exception as e:
+                resolved[key] = (name, e)
+        singles = _prefetch_single_values(
+            {args for name, args in resolved.values() if name == 'get_sectoral_quarterly_data'}
+        )
+        results = {}
+        for key, call in resolved.items():
+            if isinstance(call[1], Exception):
+                results[call] = f"Error: {call[1]}"
+            elif call not in results:
+                name, args = call
+                if name == 'get_sectoral_quarterly_data' and args in singles:
+                    results[call] = singles[args]
+                else:
+                    results[call] = getattr(udf, name)(*[list(a) if isinstance(a, tuple) else a for a in args])
+            grid = _as_grid(results[call])
+            grids[key] = grid
+            book.results[key] = _cell_value(grid[0][0]) if grid and grid[0] else None
+            del pending[key]
+    return grids
+
+# --- Writing ---
+
+def _spill_collides(ws, anchor, grid, udf_keys):
+    """True if the spill range holds anything but empty cells (Excel's #SPILL!)."""
+    for r, row in enumerate(grid):
+        for c in range(len(row)):
+            if r == 0 and c == 0:
+                continue
+            cell = ws.cell(row=anchor.row + r, column=anchor.column + c)
+            if cell.value is not None or (ws.title, cell.coordinate) in udf_keys:
+                return True
+    return False
+
+def write_results(wb, grids):
+    """
+    Replaces each UDF formula with its value, spilling tables from the
+    formula cell. Returns the number of error cells written.
+    """
+    udf_keys = set(grids)
+    n_errors = 0
+    for (sheet, coordinate), grid in grids.items():
+        ws = wb[sheet]
+        anchor = ws[coordinate]
+        if _spill_collides(ws, anchor, grid, udf_keys):
+            anchor.value = SPILL_ERROR
+            n_errors += 1
+            continue
+        if grid and grid[0] and isinstance(grid[0][0], str) and grid[0][0].startswith('Error:'):
+            n_errors += 1
+        for r, row in enumerate(grid):
+            for c, value in enumerate(row):
+                ws.cell(row=anchor.row + r, column=anchor.column + c, value=_cell_value(value))
+    return n_errors
+
+def _apply_overrides(wb, overrides, default_sheet):
+    for target, value in (overrides or {}).items():
+        sheet, _, coordinate = target.rpartition('!')
+        wb[sheet.strip("'") or default_sheet][coordinate.replace('$', '').upper()].value = value
+
+def render_workbook(template_path, out_path, overrides=None):
+    """
+    Renders one output workbook from a template. `overrides` maps cells
+    ('A1' on the first sheet, or 'Sheet!A1') to input values set before
+    resolving. Returns a summary dict.
+    """
+    openpyxl = _require_openpyxl()
+    start_time = time.perf_counter()
+    wb = openpyxl.load_workbook(template_path)
+    cached_wb = openpyxl.load_workbook(template_path, data_only=True)
+    _apply_overrides(wb, overrides, wb.worksheets[0].title)
+    _apply_overrides(cached_wb, overrides, wb.worksheets[0].title)
+
+    udf_cells = find_udf_cells(wb)
+    grids = resolve_calls(_Workbook(wb, cached_wb, udf_cells))
+    n_errors = write_results(wb, grids)
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    wb.save(out_path)
+    return {
+        'template': template_path,
+        'out_path': out_path,
+        'formulas': len(udf_cells),
+        'errors': n_errors,
+        'time_ms': round((time.perf_counter() - start_time) * 1000, 2),
+    }
+
+# --- Batch (process pool) ---
+
+def _init_worker(snapshot):
+    if snapshot and udf.SNAPSHOT is None:
+        udf.load_snapshot()
+
+def _render_job(job):
+    return render_workbook(*job)
+
+def render_reports(jobs, workers=None, snapshot=False):
+    """
+    Renders (template_path, out_path, overrides) jobs, on a process pool when
+    there are several. Each worker keeps its result cache (and snapshot)
+    across the workbooks it renders. Returns their summaries in job order.
+    """
+    jobs = list(jobs)
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        _init_worker(snapshot)
+        return [_render_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(snapshot,)) as pool:
+        return list(pool.map(_render_job, jobs))
+
+def plan_jobs(templates, out_dir, overrides=None, each_cell=None, each_values=()):
+    """One job per template, or per template and --each value."""
+    jobs = []
+    for template in templates:
+        stem, ext = os.path.splitext(os.path.basename(template))
+        if not each_cell:
+            jobs.append((template, os.path.join(out_dir, stem + ext), dict(overrides or {})))
+            continue
+        for value in each_values:
+            suffix = re.sub(r'[^\w.-]+', '_', str(value)).strip('_')
+            jobs.append((template, os.path.join(out_dir, f"{stem}_{suffix}{ext}"), {**(overrides or {}), each_cell: value}))
+    return jobs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill Excel templates' UDF formulas with values, without Excel.")
+    parser.add_argument('templates', nargs='+', help="Template workbooks (.xlsx).")
+    parser.add_argument('--out-dir', default='reports', help="Directory for the rendered workbooks.")
+    parser.add_argument('--set', action='append', default=[], metavar='CELL=VALUE',
+                        help="Set an input cell before resolving, e.g. C1=2025-06-30 or 'Inputs!B2=IT'.")
+    parser.add_argument('--each', nargs='+', metavar=('CELL', 'VALUE'),
+                        help="One workbook per value of this input cell, e.g. --each A1 IT Healthcare.")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: one per CPU, at most one per workbook).")
+    parser.add_argument('--snapshot', action='store_true', help="Load the snapshot in each worker even if snapshot_mode is off.")
+    args = parser.parse_args()
+
+    try:
+        overrides = {}
+        for item in args.set:
+            cell, sep, value = item.partition('=')
+            if not sep:
+                raise ValueError(f"--set expects CELL=VALUE, got: {item}")
+            overrides[cell.strip()] = value
+        if args.each and len(args.each) < 2:
+            raise ValueError("--each expects a cell and at least one value.")
+        each_cell, each_values = (args.each[0], args.each[1:]) if args.each else (None, ())
+
+        start_time = time.perf_counter()
+        jobs = plan_jobs(args.templates, args.out_dir, overrides, each_cell, each_values)
+        for summary in render_reports(jobs, args.workers, args.snapshot):
+            print(
+                f"{summary['out_path']}: {summary['formulas']} formula(s), "
+                f"{summary['errors']} error(s), {summary['time_ms']} ms"
+            )
+        print(f"Rendered {len(jobs)} workbook(s) in {(time.perf_counter() - start_time) * 1000:.0f} ms.")
+    except Exception as e:
+        print(f"Failed to render reports: {e}")
+        sys.exit(1)
@@ -0,0 +1,209 @@
+import argparse
+import http.client
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+# --- Local Query Service ---
+#
+# One long-running process owns the DB connections, snapshot and result
+# cache; every workbook's UDF server (service_url in config.ini) and any
+# script talks to it over HTTP/JSON on localhost. Connections are kept alive
+# (HTTP/1.1), and /batch answers many calls in one round trip.
+#
+#   POST /query  {"fn": "_query_series", "args": ["IT", "field", "2020-03-31", "2025-09-30"]}
+#             -> {"result": [["Date", "field"], ...]}
+#   POST /batch  {"calls": [{"fn": ..., "args": [...]}, ...]}
+#             -> {"results": [{"result": ...} or {"error": ...}, ...]}
+#   GET  /health, GET /stats
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+
+class ServiceError(Exception):
+    """The service rejected a call (unknown function, bad arguments...)."""
+
+
+def _freeze(value):
+    """JSON arrays back to tuples, so cached functions get hashable args."""
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class _QueryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes; don't let Nagle delay the body
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # Per-call timings are already in query telemetry
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, default=str, separators=(',', ':')).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _call(self, call):
+        try:
+            func = self.server.functions[call['fn']]
+        except (KeyError, TypeError):
+            return {'error': f"Unknown function: {call.get('fn') if isinstance(call, dict) else call!r}"}
+        try:
+            return {'result': func(*[_freeze(a) for a in call.get('args', [])])}
+        except Exception as e:
+            return {'error': str(e)}
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok', 'functions': sorted(self.server.functions)})
+        elif self.path == '/stats' and self.server.stats_fn is not None:
+            self._send_json(200, self.server.stats_fn())
+        else:
+            self._send_json(404, {'error': f"Not found: {self.path}"})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self._send_json(413, {'error': "Request too large."})
+            return
+        try:
+            request = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            self._send_json(400, {'error': f"Invalid JSON: {e}"})
+            return
+
+        if self.path == '/query':
+            response = self._call(request)
+            self._send_json(400 if 'error' in response else 200, response)
+        elif self.path == '/batch':
+            calls = request.get('calls') if isinstance(request, dict) else None
+            if not isinstance(calls, list):
+                self._send_json(400, {'error': "Expected {\"calls\": [...]}."})
+                return
+            self._send_json(200, {'results': [self._call(call) for call in calls]})
+        else:
+            self._send_json(404, {'error': f"Not found: {self.path}"})
+
+
+class QueryServer(ThreadingHTTPServer):
+    """Threaded HTTP server exposing `functions` (name -> callable) as JSON calls."""
+
+    daemon_threads = True
+
+    def __init__(self, functions, host=DEFAULT_HOST, port=DEFAULT_PORT, stats_fn=None):
+        self.functions = dict(functions)
+        self.stats_fn = stats_fn
+        super().__init__((host, port), _QueryHandler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start_background(self):
+        """Serves from a daemon thread (tests, embedding); returns the thread."""
+        thread = threading.Thread(target=self.serve_forever, name='sectoral-service', daemon=True)
+        thread.start()
+        return thread
+
+
+class ServiceClient:
+    """Keep-alive JSON client; one persistent connection per calling thread."""
+
+    def __init__(self, url, timeout=30.0):
+        parts = urlsplit(url)
+        self.url = url
+        self.host = parts.hostname or DEFAULT_HOST
+        self.port = parts.port or DEFAULT_PORT
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def _request(self, method, path, payload=None):
+        body = None if payload is None else json.dumps(payload, default=str).encode('utf-8')
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        # A kept-alive connection may have been closed by the server; retry once
+        for attempt in (1, 2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = json.loads(response.read())
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.close()
+                if attempt == 2:
+                    raise
+            except Exception:
+                self.close()
+                raise
+        if response.status >= 400 and 'results' not in data:
+            raise ServiceError(data.get('error', f"HTTP {response.status}"))
+        return data
+
+    def call(self, fn, *args):
+        """Runs one named query function in the service and returns its result."""
+        return self._request('POST', '/query', {'fn': fn, 'args': list(args)})['result']
+
+    def batch(self, calls):
+        """
+        Runs [(fn, args), ...] in one round trip. Returns results in order;
+        a call the service rejected comes back as a ServiceError instance.
+        """
+        payload = {'calls': [{'fn': fn, 'args': list(args)} for fn, args in calls]}
+        return [
+            r['result'] if 'result' in r else ServiceError(r.get('error'))
+            for r in self._request('POST', '/batch', payload)['results']
+        ]
+
+    def health(self):
+        return self._request('GET', '/health')
+
+    def stats(self):
+        return self._request('GET', '/stats')
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve sectoral queries over HTTP/JSON on localhost.")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--prewarm', action='store_true', help="Warm the cache before accepting calls.")
+    args = parser.parse_args()
+
+    import sectoral_data_udf
+
+    if sectoral_data_udf.CHECK_QUERY_PLANS:
+        sectoral_data_udf.check_query_plans()
+    if args.prewarm:
+        sectoral_data_udf.prewarm()
+    server = QueryServer(
+        sectoral_data_udf.SERVICE_FUNCTIONS, args.host, args.port,
+        stats_fn=sectoral_data_udf.service_stats,
+    )
+    print(f"Serving sectoral queries on {server.url} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,209 @@
+import sqlite3
+import time
+import sys
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+
+# --- In-memory Columnar Snapshot ---
+#
+# Holds the whole sectoral table as one flat array per value field, laid out
+# sector-major: the value for (sector i, date j) lives at i * n_dates + j.
+# Sector names and dates are interned once into sorted lists with dict
+# indexes, so single lookups are O(1) and series/matrix reads are slices.
+# A parallel byte per cell marks which (sector, date) rows exist, so a row
+# whose value is NULL comes back as (date, None) just as it does from SQL.
+# The value arrays may also be read-only memory maps of a .npy export (see
+# sectoral_export.py), in which case nothing is copied into the process.
+
+MISSING = float('nan')
+
+
+class SectoralSnapshot:
+    """Sector x date value grid loaded once from SQLite."""
+
+    def __init__(self, sectors, dates, values, load_time_ms=0.0, read_only=False, version=None, rows=None):
+        self.sectors = sectors
+        self.dates = dates
+        self.sector_index = {s: i for i, s in enumerate(sectors)}
+        self.date_index = {d: j for j, d in enumerate(dates)}
+        self.values = values
+        # Nonzero where the table has a row; without it, cells with any value
+        if rows is None:
+            rows = bytearray(len(sectors) * len(dates))
+            for column in values.values():
+                for pos, value in enumerate(column):
+                    if not math.isnan(value):
+                        rows[pos] = 1
+        self.rows = rows
+        self.load_time_ms = load_time_ms
+        self.read_only = read_only
+        self.version = version
+
+    @classmethod
+    def load(cls, db_path, table_name, fields):
+        """Reads every row of the table in a single SELECT and pivots it."""
+        start_time = time.perf_counter()
+
+        conn = sqlite3.connect(db_path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT DISTINCT sector FROM {table_name} ORDER BY sector"
+            )
+            sectors = [sys.intern(row[0]) for row in cursor.fetchall()]
+            cursor.execute(
+                f"SELECT DISTINCT date(date) AS d FROM {table_name} ORDER BY d"
+            )
+            dates = [sys.intern(row[0]) for row in cursor.fetchall()]
+
+            n_cells = len(sectors) * len(dates)
+            values = {f: array('d', [MISSING]) * n_cells for f in fields}
+            rows = bytearray(n_cells)
+            sector_index = {s: i for i, s in enumerate(sectors)}
+            date_index = {d: j for j, d in enumerate(dates)}
+            n_dates = len(dates)
+
+            columns = ', '.join(fields)
+            cursor.execute(
+                f"SELECT sector, date(date), {columns} FROM {table_name}"
+            )
+            for row in cursor:
+                pos = sector_index[row[0]] * n_dates + date_index[row[1]]
+                rows[pos] = 1
+                for k, field in enumerate(fields):
+                    value = row[2 + k]
+                    if value is not None:
+                        values[field][pos] = value
+        finally:
+            conn.close()
+
+        load_time_ms = (time.perf_counter() - start_time) * 1000
+        return cls(sectors, dates, values, load_time_ms, rows=rows)
+
+    # --- Lookups ---
+
+    def has_field(self, field):
+        return field in self.values
+
+    def array(self, field):
+        """Zero-copy (sectors, dates) NumPy view of one field, NaN where missing."""
+        import numpy as np
+        values = np.frombuffer(self.values[field], dtype=np.float64)
+        return values.reshape(len(self.sectors), len(self.dates))
+
+    def row_mask(self):
+        """(sectors, dates) NumPy uint8 view, 1 where the table has a row."""
+        import numpy as np
+        rows = np.frombuffer(self.rows, dtype=np.uint8)
+        return rows.reshape(len(self.sectors), len(self.dates))
+
+    def single(self, sector, field, date_str):
+        """Returns the value for one cell, or None when it is missing."""
+        i = self.sector_index.get(sector)
+        j = self.date_index.get(date_str)
+        if i is None or j is None:
+            return None
+        value = self.values[field][i * len(self.dates) + j]
+        return None if math.isnan(value) else value
+
+    def series(self, sector, field, start_date_str=None, end_date_str=None):
+        """Returns (date, value) tuples for a sector's rows, optionally date-bounded; None for NULLs."""
+        i = self.sector_index.get(sector)
+        if i is None:
+            return []
+        lo = 0 if start_date_str is None else bisect_left(self.dates, start_date_str)
+        hi = len(self.dates) if end_date_str is None else bisect_right(self.dates, end_date_str)
+        base = i * len(self.dates)
+        column = self.values[field][base + lo:base + hi]
+        present = self.rows[base + lo:base + hi]
+        return [
+            (self.dates[lo + k], None if math.isnan(v) else v)
+            for k, (v, has_row) in enumerate(zip(column, present))
+            if has_row
+        ]
+
+    def matrix(self, date_str, field):
+        """Returns (sector, date, value) tuples for every sector with a row on a date; None for NULLs."""
+        j = self.date_index.get(date_str)
+        if j is None:
+            return []
+        n_dates = len(self.dates)
+        column = self.values[field][j::n_dates]
+        present = self.rows[j::n_dates]
+        return [
+            (self.sectors[i], date_str, None if math.isnan(v) else v)
+            for i, (v, has_row) in enumerate(zip(column, present))
+            if has_row
+        ]
+
+    def grid(self, sectors, date_strs, field):
+        """Returns a len(sectors) x len(date_strs) block, None where missing."""
+        n_dates = len(self.dates)
+        column = self.values[field]
+        date_positions = [self.date_index.get(d) for d in date_strs]
+        block = []
+        for sector in sectors:
+            i = self.sector_index.get(sector)
+            if i is None:
+                block.append([None] * len(date_strs))
+                continue
+            base = i * n_dates
+            row = []
+            for j in date_positions:
+                value = MISSING if j is None else column[base + j]
+                row.append(None if math.isnan(value) else value)
+            block.append(row)
+        return block
+
+    # --- Incremental Updates ---
+
+    def apply_rows(self, fields, rows):
+        """
+        Writes (sector, date, *values) rows into existing cells in place.
+        Returns False without changing anything if a row needs a new sector
+        or date, or the snapshot is a read-only export, in which case the
+        caller should reload the snapshot.
+        """
+        if self.read_only:
+            return False
+        positions = []
+        n_dates = len(self.dates)
+        for row in rows:
+            i = self.sector_index.get(row[0])
+            j = self.date_index.get(row[1])
+            if i is None or j is None:
+                return False
+            positions.append(i * n_dates + j)
+
+        for pos, row in zip(positions, rows):
+            self.rows[pos] = 1
+            for k, field in enumerate(fields):
+                if field in self.values:
+                    value = row[2 + k]
+                    self.values[field][pos] = MISSING if value is None else value
+        return True
+
+    # --- Reporting ---
+
+    def memory_bytes(self):
+        """Approximate bytes held by the value arrays and the interned indexes."""
+        total = sum(a.itemsize * len(a) for a in self.values.values())
+        total += len(self.rows)
+        total += sys.getsizeof(self.sectors) + sys.getsizeof(self.dates)
+        total += sys.getsizeof(self.sector_index) + sys.getsizeof(self.date_index)
+        total += sum(sys.getsizeof(s) for s in self.sectors)
+        total += sum(sys.getsizeof(d) for d in self.dates)
+        return total
+
+    def stats(self):
+        """Summary used for logging and the get_snapshot_stats UDF."""
+        return {
+            'sectors': len(self.sectors),
+            'dates': len(self.dates),
+            'fields': len(self.values),
+            'memory_kb': round(self.memory_bytes() / 1024, 1),
+            'load_time_ms': round(self.load_time_ms, 2),
+            'backing': 'mmap' if self.read_only else 'memory',
+            'version': self.version,
+        }
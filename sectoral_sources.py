@@ -0,0 +1,148 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sectoral_cache import ResultCache
+from sectoral_db import ReadOnlyConnectionPool
+
+# --- Named Data Sources ---
+#
+# Extra sectoral DBs (regions, data vintages) declared in config.ini as
+#
+#   [Source:2024Q4]
+#   db_path = vintages/sectoral_2024Q4.db
+#   table_name = sectoral_ebitda_margins      ; optional, defaults to [Database]
+#
+# Each source has its own read-only connection pool and result cache. The
+# [Database] section stays the default source with the snapshot, change-log
+# refresh and materialized tables; named sources answer the per-sector
+# history and cross-section queries straight from their indexes.
+
+SECTION_PREFIX = 'Source:'
+KEY_COLUMNS = ('sector', 'date', 'date_key')
+DAY_END = ' 23:59:59'
+
+
+def read_source_config(parser, script_dir, default_table):
+    """Returns {name: (db_path, table_name)} for every [Source:<name>] section."""
+    sources = {}
+    for section in parser.sections():
+        if not section.startswith(SECTION_PREFIX):
+            continue
+        name = section[len(SECTION_PREFIX):].strip()
+        options = parser[section]
+        table_name = options.get('table_name', default_table)
+        if not (name and table_name and table_name.replace('_', '').isalnum()):
+            raise ValueError(f"Invalid source section [{section}] or table name: {table_name}")
+        sources[name] = (os.path.join(script_dir, options.get('db_path')), table_name)
+    return sources
+
+
+class SectoralSource:
+    """One named read-only sectoral DB with its own connections and cache."""
+
+    def __init__(self, name, db_path, table_name, cache_size=1024):
+        self.name = name
+        self.db_path = db_path
+        self.table_name = table_name
+        self.pool = ReadOnlyConnectionPool(db_path)
+        self.cache = ResultCache(maxsize=cache_size, version_fn=self._version)
+        self._columns = None
+        self.pool.on_change(self._forget_columns)
+
+    def _version(self):
+        self.pool.get()
+        return self.pool.signature
+
+    def _forget_columns(self):
+        self._columns = None
+
+    def columns(self):
+        if self._columns is None:
+            conn = self.pool.get()
+            self._columns = [row[1] for row in conn.execute(f"PRAGMA table_info({self.table_name})")]
+        return self._columns
+
+    def value_fields(self):
+        return tuple(c for c in self.columns() if c not in KEY_COLUMNS)
+
+    def validate_field(self, field):
+        if field not in self.value_fields():
+            raise ValueError(f"Invalid field for source '{self.name}': '{field}'.")
+        return field
+
+    def _date_columns(self):
+        if 'date_key' in self.columns():
+            return 'date_key', 'date_key'
+        return 'date(date)', 'date'
+
+    # --- Queries (cached per source) ---
+
+    def sectors(self):
+        """Every sector name in the source, sorted."""
+        def fetch():
+            rows = self.pool.get().execute(f"SELECT DISTINCT sector FROM {self.table_name} ORDER BY sector")
+            return [row[0] for row in rows]
+        return self.cache.get_or_compute(('sectors',), fetch)
+
+    def history(self, sector, field):
+        """(dates, rows) for one sector's whole history, like _sector_history."""
+        def fetch():
+            date_select, date_column = self._date_columns()
+            rows = self.pool.get().execute(
+                f"SELECT {date_select}, {field} FROM {self.table_name} WHERE sector = ? ORDER BY {date_column}",
+                (sector,),
+            ).fetchall()
+            rows = [tuple(row) for row in rows]
+            return [row[0] for row in rows], rows
+        return self.cache.get_or_compute(('history', sector, field), fetch)
+
+    def value_index(self, sector, field):
+        """Dates and values of the non-blank history, for as-of lookups."""
+        def build():
+            _, rows = self.history(sector, field)
+            rows = [row for row in rows if row[1] is not None]
+            return [row[0] for row in rows], [row[1] for row in rows]
+        return self.cache.get_or_compute(('value_index', sector, field), build)
+
+    def matrix(self, date_str, field):
+        """(sector, date, value) rows for every sector on one date."""
+        def fetch():
+            date_select, date_column = self._date_columns()
+            if date_column == 'date_key':
+                where, params = "date_key = ?", (date_str,)
+            else:
+                where, params = "date BETWEEN ? AND ?", (date_str, date_str + DAY_END)
+            rows = self.pool.get().execute(
+                f"SELECT sector, {date_select}, {field} FROM {self.table_name} WHERE {where} ORDER BY sector",
+                params,
+            ).fetchall()
+            return [tuple(row) for row in rows]
+        return self.cache.get_or_compute(('matrix', date_str, field), fetch)
+
+    def stats(self):
+        return {'name': self.name, 'db_path': self.db_path, 'table': self.table_name, **self.cache.stats()}
+
+    def close(self):
+        self.pool.close_all()
+
+
+class SourceFanOut:
+    """Runs one call per source on a small thread pool and returns results in order."""
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def map(self, func, items):
+        items = list(items)
+        if len(items) < 2:
+            return [func(item) for item in items]
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix='sectoral-source'
+                    )
+        return list(self._executor.map(func, items))
@@ -0,0 +1,263 @@
+import argparse
+import atexit
+import json
+import logging
+import math
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# --- Query Telemetry ---
+#
+# Per-call events are handed to a background QueueListener and written as
+# JSON lines, so the UDF hot path never formats or writes anything itself.
+# Latency histograms are kept in memory for every call; cache-hit events are
+# only written to disk at `hit_sample_rate` (each line carries its weight so
+# the summary CLI can scale them back up).
+
+TELEMETRY_FILE = 'query_telemetry.jsonl'
+
+# Priority when one call touches several sources: any SQL makes it a SQL call
+SOURCE_PRIORITY = {'cache': 1, 'snapshot': 2, 'sql': 3}
+
+
+class LatencyHistogram:
+    """Log-spaced latency buckets (1 us to ~8 min) with percentile estimates."""
+
+    BASE_MS = 0.001
+    GROWTH = 1.2
+    N_BUCKETS = 110
+
+    def __init__(self):
+        self.counts = [0] * (self.N_BUCKETS + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def _bucket(self, ms):
+        if ms <= self.BASE_MS:
+            return 0
+        i = math.ceil(math.log(ms / self.BASE_MS) / math.log(self.GROWTH))
+        return min(i, self.N_BUCKETS)
+
+    def add(self, ms):
+        self.counts[self._bucket(ms)] += 1
+        self.total += 1
+        self.sum_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile, in ms."""
+        if not self.total:
+            return 0.0
+        rank = p / 100 * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.BASE_MS * self.GROWTH ** i, self.max_ms)
+        return self.max_ms
+
+
+class _PassthroughQueueHandler(QueueHandler):
+    """Enqueues the record untouched; formatting happens on the listener thread."""
+
+    def prepare(self, record):
+        return record
+
+
+class _JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, default=str, separators=(',', ':'))
+
+
+def _loggable(arg):
+    """Keeps event args small: dates as text, long ranges as their length."""
+    if isinstance(arg, datetime):
+        return arg.strftime('%Y-%m-%d')
+    if isinstance(arg, (list, tuple)):
+        if len(arg) > 10:
+            return f"<{len(arg)} items>"
+        return [_loggable(a) for a in arg]
+    if isinstance(arg, (str, int, float)) or arg is None:
+        return arg
+    return str(arg)
+
+
+class Telemetry:
+    """Collects per-call latency, source and status for the query functions."""
+
+    def __init__(self, log_file=TELEMETRY_FILE, hit_sample_rate=0.1):
+        self.hit_sample_rate = hit_sample_rate
+        self.histograms = {}
+        self.sources = {}
+        self.errors = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        self._queue = queue.SimpleQueue()
+        self._logger = logging.getLogger(f"{__name__}.{id(self)}")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+
+        self._listener = None
+        if log_file:
+            self._logger.addHandler(_PassthroughQueueHandler(self._queue))
+            file_handler = RotatingFileHandler(log_file, maxBytes=5_242_880, backupCount=2)
+            file_handler.setFormatter(_JsonLineFormatter())
+            self._listener = QueueListener(self._queue, file_handler)
+            self._listener.start()
+            atexit.register(self.close)
+
+    # --- Call context ---
+
+    def begin(self):
+        """Starts timing a call; returns a token for end(). Calls may nest."""
+        token = (getattr(self._local, 'source', None), time.perf_counter())
+        self._local.source = None
+        return token
+
+    def mark_source(self, source):
+        """Records where the current call's data came from (cache/snapshot/sql)."""
+        current = getattr(self._local, 'source', None)
+        if current is None or SOURCE_PRIORITY[source] > SOURCE_PRIORITY[current]:
+            self._local.source = source
+
+    def end(self, token, func_name, args, status, error=None):
+        outer_source, start_time = token
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        source = self._local.source or 'none'
+        # Restore the enclosing call's source, folding this call's into it
+        self._local.source = outer_source
+        if source != 'none':
+            self.mark_source(source)
+
+        with self._lock:
+            histogram = self.histograms.get(func_name)
+            if histogram is None:
+                histogram = self.histograms[func_name] = LatencyHistogram()
+            histogram.add(elapsed_ms)
+            per_source = self.sources.setdefault(func_name, {})
+            per_source[source] = per_source.get(source, 0) + 1
+            if status != 'SUCCESS':
+                self.errors[func_name] = self.errors.get(func_name, 0) + 1
+
+        if self._listener is None:
+            return
+        weight = 1
+        if source == 'cache' and status == 'SUCCESS':
+            if self.hit_sample_rate <= 0 or random.random() >= self.hit_sample_rate:
+                return
+            weight = round(1 / self.hit_sample_rate, 3)
+
+        event = {
+            'ts': round(time.time(), 3),
+            'fn': func_name,
+            'ms': round(elapsed_ms, 3),
+            'src': source,
+            'status': status,
+            'w': weight,
+            'args': [_loggable(a) for a in args],
+        }
+        if error:
+            event['error'] = error
+        self._logger.info(event)
+
+    # --- Reporting ---
+
+    def summary(self):
+        """Rows of (function, calls, cache %, p50, p95, p99, errors)."""
+        rows = []
+        with self._lock:
+            for func_name, histogram in sorted(self.histograms.items()):
+                per_source = self.sources.get(func_name, {})
+                cached = per_source.get('cache', 0)
+                rows.append((
+                    func_name,
+                    histogram.total,
+                    round(100 * cached / histogram.total, 1),
+                    round(histogram.percentile(50), 3),
+                    round(histogram.percentile(95), 3),
+                    round(histogram.percentile(99), 3),
+                    self.errors.get(func_name, 0),
+                ))
+        return rows
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+
+# --- Log Summary CLI ---
+
+def _weighted_percentile(samples, p):
+    """samples: list of (ms, weight), sorted by ms."""
+    total = sum(w for _, w in samples)
+    target = p / 100 * total
+    seen = 0.0
+    for ms, w in samples:
+        seen += w
+        if seen >= target:
+            return ms
+    return samples[-1][0] if samples else 0.0
+
+def summarize_file(path):
+    """Aggregates a telemetry JSONL file into per-function latency rows."""
+    by_func = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            by_func.setdefault(event['fn'], []).append(event)
+
+    rows = []
+    for func_name, events in sorted(by_func.items()):
+        samples = sorted((e['ms'], e.get('w', 1)) for e in events)
+        calls = sum(w for _, w in samples)
+        total_ms = sum(ms * w for ms, w in samples)
+        by_source = {}
+        for e in events:
+            by_source[e['src']] = by_source.get(e['src'], 0) + e.get('w', 1)
+        rows.append({
+            'function': func_name,
+            'calls': round(calls),
+            'total_ms': round(total_ms, 1),
+            'p50_ms': _weighted_percentile(samples, 50),
+            'p95_ms': _weighted_percentile(samples, 95),
+            'p99_ms': _weighted_percentile(samples, 99),
+            'errors': sum(1 for e in events if e['status'] != 'SUCCESS'),
+            'sources': {k: round(v) for k, v in sorted(by_source.items())},
+        })
+    rows.sort(key=lambda r: r['total_ms'], reverse=True)
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize UDF query telemetry.")
+    parser.add_argument('log_file', nargs='?',
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), TELEMETRY_FILE))
+    parser.add_argument('--json', action='store_true', help="Print machine-readable JSON.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.log_file):
+        print(f"Telemetry file not found: {args.log_file}")
+        sys.exit(1)
+
+    rows = summarize_file(args.log_file)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f"{'Function':32s} {'Calls':>8s} {'Total ms':>10s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'Errors':>6s}  Sources")
+        for r in rows:
+            sources = ', '.join(f"{k}={v}" for k, v in r['sources'].items())
+            print(
+                f"{r['function']:32s} {r['calls']:8d} {r['total_ms']:10.1f} "
+                f"{r['p50_ms']:8.3f} {r['p95_ms']:8.3f} {r['p99_ms']:8.3f} {r['errors']:6d}  {sources}"
+            )
@@ -40,8 +40,1033 @@ except Exception as e:
     print("---------------------------------")
 
 
-# --- Test 3: Check Log File ---
-print("\n--- TEST 3: CHECK LOG FILE ---")
+# --- Test 3: Snapshot Mode ---
+print("\n--- TEST 3: SNAPSHOT MODE ---")
+try:
+    sql_series = sectoral_data_udf._query_series(sector, field, start_str, end_str)
+    snapshot = sectoral_data_udf.load_snapshot()
+    print(f"Snapshot stats: {snapshot.stats()}")
+    snap_value = sectoral_data_udf._query_single_data(sector, field, date_str)
+    snap_series = sectoral_data_udf._query_series(sector, field, start_str, end_str)
+    if snap_value == data and snap_series == sql_series:
+        print("SUCCESS: Snapshot results match SQL results.")
+    else:
+        print("FAILURE: Snapshot results differ from SQL results.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 3 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    sectoral_data_udf.SNAPSHOT = None
+
+
+# --- Test 4: Query Service ---
+print("\n--- TEST 4: QUERY SERVICE ---")
+import socket
+import time
+from sectoral_service import QueryServer, ServiceClient
+server = QueryServer(sectoral_data_udf.SERVICE_FUNCTIONS, port=0)
+try:
+    server.start_background()
+    client = ServiceClient(server.url)
+    remote_value = client.call('_query_single_data', sector, field, date_str)
+    remote_series = client.call('_query_series', sector, field, start_str, end_str)
+    batch = client.batch([
+        ('_query_single_data', (sector, field, date_str)),
+        ('_query_matrix', (date_str, field)),
+    ])
+    local_matrix = sectoral_data_udf._query_matrix(date_str, field)
+    if (remote_value == data and remote_series == [list(r) for r in series_data]
+            and batch[0] == data and batch[1] == [list(r) for r in local_matrix]):
+        print(f"SUCCESS: Service results match local results ({server.url}).")
+    else:
+        print("FAILURE: Service results differ from local results.")
+    client.close()
+
+    # A service that accepts connections but never answers: one timeout, then local queries
+    hung = socket.create_server(('127.0.0.1', 0))
+    sectoral_data_udf.SERVICE = ServiceClient(f"http://127.0.0.1:{hung.getsockname()[1]}", timeout=0.5)
+    timings = []
+    for _ in range(3):
+        t0 = time.perf_counter()
+        fallback_value = sectoral_data_udf._run_query(sectoral_data_udf._query_single_data, sector, field, date_str)
+        timings.append(time.perf_counter() - t0)
+    hung.close()
+    print(f"Hung service call times: {[round(t, 2) for t in timings]} s")
+    if fallback_value == data and timings[0] >= 0.4 and max(timings[1:]) < 0.25:
+        print("SUCCESS: A hung service is skipped after one timeout.")
+    else:
+        print("FAILURE: Every call waited for the hung service.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 4 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    server.shutdown()
+    server.server_close()
+    sectoral_data_udf.SERVICE = None
+    sectoral_data_udf._service_reachable = True
+    sectoral_data_udf._service_retry_at = 0.0
+
+
+# --- Test 5: Memory-mapped Export ---
+print("\n--- TEST 5: MEMORY-MAPPED EXPORT ---")
+import tempfile
+import sectoral_export
+try:
+    with tempfile.TemporaryDirectory() as export_dir:
+        sectoral_export.export_npy(sectoral_data_udf.DB_PATH, sectoral_data_udf.TABLE_NAME, export_dir)
+        mapped = sectoral_export.open_export(export_dir)
+        print(f"Export stats: {mapped.stats()}")
+        if mapped.single(sector, field, date_str) == data and mapped.series(sector, field, start_str, end_str) == series_data[1:]:
+            print("SUCCESS: Memory-mapped export matches SQL results.")
+        else:
+            print("FAILURE: Memory-mapped export differs from SQL results.")
+        del mapped
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 5 FAILED: {e}")
+    print("---------------------------------")
+
+
+# --- Test 6: As-of Lookups ---
+print("\n--- TEST 6: AS-OF LOOKUPS ---")
+mid_quarter = "2009-04-15"
+try:
+    exact = sectoral_data_udf._query_single_data(sector, field, mid_quarter)
+    as_of = sectoral_data_udf._query_single_data(sector, field, mid_quarter, 'as_of')
+    nearest = sectoral_data_udf._query_single_data(sector, field, "2009-06-25", 'nearest')
+    print(f"{mid_quarter}: exact={exact!r}, as_of={as_of!r}; 2009-06-25 nearest={nearest!r}")
+    if as_of == data and nearest == series_data[2][1]:
+        print("SUCCESS: as_of and nearest resolve to the right quarter-ends.")
+    else:
+        print("FAILURE: as_of or nearest returned the wrong value.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 6 FAILED: {e}")
+    print("---------------------------------")
+
+
+# --- Test 7: Materialized Tables ---
+print("\n--- TEST 7: MATERIALIZED TABLES ---")
+import shutil
+import sectoral_materialize
+original_db = sectoral_data_udf.DB_PATH
+try:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sql_matrix = sectoral_data_udf._query_matrix(date_str, field)
+        sql_summary = sectoral_data_udf._query_sector_summary(sector, field)
+        db_copy = shutil.copy(original_db, os.path.join(tmp_dir, 'copy.db'))
+        print(f"Refresh: {sectoral_materialize.refresh_materialized(db_copy, sectoral_data_udf.TABLE_NAME)}")
+        sectoral_data_udf.use_database(db_copy)
+        fresh = sectoral_data_udf._materialized_fresh()
+        mv_matrix = sectoral_data_udf._query_matrix(date_str, field)
+        mv_summary = sectoral_data_udf._query_sector_summary(sector, field)
+        sectoral_data_udf.use_database(original_db)
+    if fresh and mv_matrix == sql_matrix and mv_summary == sql_summary:
+        print("SUCCESS: Materialized matrix and summary match SQL results.")
+    else:
+        print("FAILURE: Materialized tables differ from SQL results.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 7 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    sectoral_data_udf.use_database(original_db)
+
+
+# --- Test 8: Named Sources ---
+print("\n--- TEST 8: NAMED SOURCES ---")
+import sqlite3
+from sectoral_sources import SectoralSource
+try:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        vintage_db = shutil.copy(sectoral_data_udf.DB_PATH, os.path.join(tmp_dir, 'vintage.db'))
+        conn = sqlite3.connect(vintage_db)
+        with conn:
+            conn.execute(f"UPDATE {sectoral_data_udf.TABLE_NAME} SET {field} = {field} + 0.01 WHERE sector = ?", (sector,))
+        conn.close()
+        vintage = sectoral_data_udf.SOURCES['vintage'] = SectoralSource('vintage', vintage_db, sectoral_data_udf.TABLE_NAME)
+        revised = sectoral_data_udf._query_single_data(sector, field, date_str, 'exact', 'vintage')
+        comparison = sectoral_data_udf._query_source_comparison(sector, field, ('default', 'vintage'), date_str, date_str)
+        print(f"Comparison: {comparison}")
+        vintage.close()
+    if abs(revised - data - 0.01) < 1e-9 and comparison[1][:3] == (date_str, data, revised):
+        print("SUCCESS: Named source and cross-source comparison return the revised values.")
+    else:
+        print("FAILURE: Named source results are wrong.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 8 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    sectoral_data_udf.SOURCES.pop('vintage', None)
+
+
+# --- Test 9: Compact Spill Format ---
+print("\n--- TEST 9: COMPACT SPILL FORMAT ---")
+try:
+    sectoral_data_udf.SPILL_FORMAT = 'compact'
+    compact = sectoral_data_udf.get_series(sector, field, start_obj, end_obj)
+    print(f"First rows: {compact[:3].tolist()}")
+    expected = [[sectoral_data_udf._excel_serial(d), v] for d, v in series_data[1:]]
+    if compact[1:].tolist() == expected and compact[0].tolist() == list(series_data[0]):
+        print("SUCCESS: Compact spill matches the row format, with Excel serial dates.")
+    else:
+        print("FAILURE: Compact spill differs from the row format.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 9 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    sectoral_data_udf.SPILL_FORMAT = 'rows'
+
+
+# --- Test 10: Shared Snapshot ---
+print("\n--- TEST 10: SHARED SNAPSHOT ---")
+original_db = sectoral_data_udf.DB_PATH
+original_export_dir = sectoral_data_udf.SNAPSHOT_EXPORT_DIR
+try:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_copy = shutil.copy(original_db, os.path.join(tmp_dir, 'copy.db'))
+        sectoral_data_udf.use_database(db_copy)
+        sectoral_data_udf.SHARE_SNAPSHOT = True
+        sectoral_data_udf.SNAPSHOT_EXPORT_DIR = db_copy + '.snapshot'
+        first = sectoral_data_udf.load_snapshot().version
+        attached = sectoral_data_udf.load_snapshot().version
+        conn = sqlite3.connect(db_copy)
+        with conn:
+            conn.execute(f"UPDATE {sectoral_data_udf.TABLE_NAME} SET {field} = {field} + 0.01 WHERE sector = ?", (sector,))
+        conn.close()
+        republished = sectoral_data_udf.load_snapshot()
+        revised = republished.single(sector, field, date_str)
+        print(f"Versions: {first} -> {attached} -> {republished.version}")
+        sectoral_data_udf.use_database(original_db)
+    if first == attached and republished.version != first and abs(revised - data - 0.01) < 1e-9:
+        print("SUCCESS: Second load attached to the shared export; a DB change republished it.")
+    else:
+        print("FAILURE: Shared snapshot was not reused or not republished.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 10 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    sectoral_data_udf.SHARE_SNAPSHOT = False
+    sectoral_data_udf.SNAPSHOT_EXPORT_DIR = original_export_dir
+    sectoral_data_udf.use_database(original_db)
+
+
+# --- Test 11: Query Plan Guardrails ---
+print("\n--- TEST 11: QUERY PLAN GUARDRAILS ---")
+try:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_copy = shutil.copy(original_db, os.path.join(tmp_dir, 'copy.db'))
+        sectoral_data_udf.use_database(db_copy)
+        before = sectoral_data_udf.check_query_plans(fix=False)
+        after = sectoral_data_udf.check_query_plans(fix=True)
+        indexed_matrix = sectoral_data_udf._query_matrix(date_str, field)
+        sectoral_data_udf.use_database(original_db)
+    print(f"Scans before: {sorted(before['scans'])}; created: {after['created']}")
+    if not after['scans'] and indexed_matrix == sql_matrix:
+        print("SUCCESS: Every UDF query uses an index after the check.")
+    else:
+        print(f"FAILURE: Queries still scan: {after['scans']}")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 11 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    sectoral_data_udf.use_database(original_db)
+
+
+# --- Test 12: Blob Storage ---
+print("\n--- TEST 12: BLOB STORAGE ---")
+import sectoral_blobs
+import sectoral_loader
+import threading
+try:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        blob_db = os.path.join(tmp_dir, 'blobs.db')
+        print(f"Build: {sectoral_blobs.build_blobs(original_db, sectoral_data_udf.TABLE_NAME, blob_db, block_size=8)}")
+        sectoral_data_udf.use_database(blob_db)
+        sectoral_data_udf.STORAGE = 'blobs'
+        blob_series = sectoral_data_udf._query_series(sector, field, start_str, end_str)
+        blob_matrix = sectoral_data_udf._query_matrix(date_str, field)
+        blob_single = sectoral_data_udf._query_single_data(sector, field, date_str)
+
+        # A load under a blob-backed snapshot reloads the snapshot from the
+        # cache's refresh hook; run the query in a thread so a hang fails the test
+        db_copy = shutil.copy(original_db, os.path.join(tmp_dir, 'copy.db'))
+        sectoral_blobs.build_blobs(db_copy, sectoral_data_udf.TABLE_NAME)
+        sectoral_data_udf.use_database(db_copy)
+        sectoral_data_udf._get_pool().check_interval = 0
+        sectoral_data_udf.load_snapshot()
+        csv_path = os.path.join(tmp_dir, 'revised.csv')
+        with open(csv_path, 'w', encoding='utf-8') as f:
+            f.write(f"sector,date,{field}\n{sector},{date_str},{data + 1}\n")
+        sectoral_loader.load_files(db_copy, sectoral_data_udf.TABLE_NAME, [csv_path])
+        reloaded = []
+        reader = threading.Thread(
+            target=lambda: reloaded.append(sectoral_data_udf._query_single_data(sector, field, date_str)), daemon=True
+        )
+        reader.start()
+        reader.join(timeout=10)
+        if reader.is_alive():
+            # The hung query holds the cache's lock, so nothing after this could run
+            print("TEST 12 FAILED: Query hung after a load under a blob-backed snapshot.")
+            os._exit(1)
+
+        # Without a snapshot: the first read after the upsert commit must see the new blobs
+        sectoral_data_udf.use_database(db_copy)
+        sectoral_data_udf._get_pool().check_interval = 0
+        sectoral_data_udf._query_series(sector, field, start_str, '9999-12-31')
+        sectoral_loader.upsert_rows(db_copy, sectoral_data_udf.TABLE_NAME, [field], [(sector, '2099-03-31 00:00:00', 0.5)])
+        appended = sectoral_data_udf._query_series(sector, field, start_str, '9999-12-31')[-1]
+        sectoral_data_udf.use_database(original_db)
+    print(f"After load under a blob snapshot: {reloaded or 'no answer in 10 s'}; after an upsert: {appended}")
+    if (
+        blob_series == series_data and blob_matrix == sql_matrix and blob_single == data
+        and reloaded and abs(reloaded[0] - data - 1) < 1e-9 and tuple(appended) == ('2099-03-31', 0.5)
+    ):
+        print("SUCCESS: Blob storage returns the same series, matrix and value as the row table, and follows loads.")
+    else:
+        print("FAILURE: Blob storage results differ from the row table or missed a load.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 12 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    sectoral_data_udf.STORAGE = 'rows'
+    sectoral_data_udf.use_database(original_db)
+
+
+# --- Test 13: Streaming API and Paged Spills ---
+print("\n--- TEST 13: STREAMING API AND PAGED SPILLS ---")
+import sectoral_api
+try:
+    streamed = list(sectoral_api.iter_series(sector, field, start_obj, end_obj, chunk_size=3))
+    page = list(sectoral_api.iter_series(sector, field, start_str, end_str, offset=2, limit=3))
+    streamed_matrix = list(sectoral_api.iter_matrix(date_str, field, chunk_size=5))
+    table_rows = sum(1 for _ in sectoral_api.iter_table(chunk_size=100))
+    udf_page = sectoral_data_udf.get_series(sector, field, start_obj, end_obj, None, 2, 3)
+
+    # Generators that are never iterated must not leave a connection open
+    def is_open(conn):
+        try:
+            conn.execute("SELECT 1")
+            return True
+        except sqlite3.ProgrammingError:
+            return False
+    opened = []
+    connect = sectoral_api._Reader.connect
+    sectoral_api._Reader.connect = lambda reader: opened.append(connect(reader)) or opened[-1]
+    try:
+        unused = [sectoral_api.iter_series(sector, field), sectoral_api.iter_table(), sectoral_api.value_fields()]
+    finally:
+        sectoral_api._Reader.connect = connect
+    left_open = sum(1 for conn in opened if is_open(conn))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_rows = sectoral_api.export_csv(os.path.join(tmp_dir, 'all.csv'), chunk_size=100)
+        blob_db = os.path.join(tmp_dir, 'blobs.db')
+        sectoral_blobs.build_blobs(original_db, sectoral_data_udf.TABLE_NAME, blob_db, block_size=8)
+        sectoral_data_udf.use_database(blob_db)
+        sectoral_data_udf.STORAGE = 'blobs'
+        blob_page = list(sectoral_api.iter_series(sector, field, start_str, end_str, offset=2, limit=3))
+        sectoral_data_udf.use_database(original_db)
+    print(f"Streamed {len(streamed)} series rows, {table_rows} table rows, {csv_rows} CSV rows")
+    print(f"Connections left open by unused generators: {left_open}")
+    if (
+        streamed == series_data[1:] and page == series_data[3:6] and blob_page == page and left_open == 0
+        and streamed_matrix == sql_matrix[1:] and csv_rows == table_rows
+        and udf_page == [series_data[0]] + series_data[3:6]
+    ):
+        print("SUCCESS: Generators and offset/limit pages match the UDF results.")
+    else:
+        print("FAILURE: Streamed or paged results differ from the UDF results, or a connection leaked.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 13 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    sectoral_data_udf.STORAGE = 'rows'
+    sectoral_data_udf.use_database(original_db)
+
+
+# --- Test 14: Headless Report Generator ---
+print("\n--- TEST 14: HEADLESS REPORT GENERATOR ---")
+try:
+    import openpyxl
+    import sectoral_report
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        wb = openpyxl.Workbook()
+        pack = wb.active
+        pack.title = 'Pack'
+        inputs = wb.create_sheet('My Inputs')
+        inputs['B1'], inputs['B2'] = field, datetime.strptime(date_str, '%Y-%m-%d')
+        sectors = sectoral_data_udf._sector_list()[:3]
+        for row, name in enumerate(sectors, start=2):
+            pack[f'A{row}'] = name
+            pack[f'B{row}'] = f"=get_sectoral_quarterly_data(A{row}, 'My Inputs'!$B$1, 'My Inputs'!$B$2)"
+        pack['D1'] = f'=get_series(A2, \'My Inputs\'!B1, "{start_str}", "{end_str}")'
+        pack['F1'] = '=_xludf.get_available_fields()'
+        pack['G1'] = "=get_sectoral_quarterly_data(A2, F1, 'My Inputs'!B2)"
+        pack['H1'], pack['H3'] = '=get_all_revenue_growth(A2, F1)', 'in the way'
+        # Single cells and literals for ndim=1 parameters arrive as one-element lists
+        pack['J1'] = "=get_sectoral_grid(A2, 'My Inputs'!B2, F1)"
+        pack['L1'] = f'=get_series_multi(A2, "{field}", "{start_str}", "{end_str}")'
+        template = os.path.join(tmp_dir, 'pack.xlsx')
+        wb.save(template)
+
+        jobs = sectoral_report.plan_jobs([template], tmp_dir, each_cell='A2', each_values=[sector])
+        summary = sectoral_report.render_reports(jobs, workers=1)[0]
+        out = openpyxl.load_workbook(summary['out_path'])['Pack']
+    expected = [sectoral_data_udf.get_sectoral_quarterly_data(s, field, date_str) for s in [sector] + sectors[1:]]
+    spilled = [(out.cell(row=r, column=4).value, out.cell(row=r, column=5).value) for r in range(1, len(series_data) + 1)]
+    spilled_multi = [(out.cell(row=r, column=12).value, out.cell(row=r, column=13).value) for r in range(1, len(series_data) + 1)]
+    print(f"Report: {summary}")
+    if (
+        [out[f'B{r}'].value for r in range(2, 5)] == expected and spilled == [tuple(row) for row in series_data]
+        and out['F1'].value == field and out['G1'].value == expected[0]
+        and out['H1'].value == sectoral_report.SPILL_ERROR and summary['errors'] == 1
+        and out['J1'].value == expected[0] and out['J2'].value is None
+        and spilled_multi == [tuple(row) for row in series_data]
+    ):
+        print("SUCCESS: Template formulas, spills and dependent cells resolved without Excel.")
+    else:
+        print("FAILURE: Rendered report values differ from the UDF results.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 14 FAILED: {e}")
+    print("---------------------------------")
+
+
+# --- Test 15: Sector Name Resolution ---
+print("\n--- TEST 15: SECTOR NAME RESOLUTION ---")
+try:
+    sectoral_data_udf.SECTOR_ALIASES = {'my alias': sector}
+    sectoral_data_udf.RESULT_CACHE.invalidate(lambda key: key[0] == '_sector_index')
+    messy = f"  {sector.upper()}\u00a0 "
+    messy_value = sectoral_data_udf.get_sectoral_quarterly_data(messy, field, date_str)
+    alias_value = sectoral_data_udf.get_sectoral_quarterly_data('My  Alias', field, date_str)
+    typo_error = sectoral_data_udf.get_sectoral_quarterly_data(sector[:-2], field, date_str)
+    print(f"Typo: {typo_error}")
+    if messy_value == data and alias_value == data and f"Did you mean '{sector}'" in typo_error:
+        print("SUCCESS: Case, spacing and aliases resolve; a typo suggests the right sector.")
+    else:
+        print("FAILURE: Sector names did not resolve as expected.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 15 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    sectoral_data_udf.SECTOR_ALIASES = {}
+    sectoral_data_udf.RESULT_CACHE.invalidate(lambda key: key[0] == '_sector_index')
+
+
+# --- Test 16: Coverage Index ---
+print("\n--- TEST 16: COVERAGE INDEX ---")
+import sectoral_coverage
+try:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cov_db = os.path.join(tmp_dir, 'coverage.db')
+        shutil.copy(original_db, cov_db)
+        print(f"Build: {sectoral_coverage.refresh_coverage(cov_db, sectoral_data_udf.TABLE_NAME)}")
+        sectoral_data_udf.use_database(cov_db)
+        # Notice the load at once rather than on the pool's next 1 s check
+        sectoral_data_udf._get_pool().check_interval = 0
+        before = dict(sectoral_data_udf.get_coverage(sector)[1:])
+        early = sectoral_data_udf.get_series(sector, field, '1900-01-01', '1900-12-31')
+
+        # Skip a quarter after the last date: the loader must record the gap
+        last = datetime.strptime(before['Last date'], '%Y-%m-%d')
+        new_date = f"{last.year + 1}-{last.month:02d}-{last.day:02d}"
+        csv_path = os.path.join(tmp_dir, 'next.csv')
+        with open(csv_path, 'w', encoding='utf-8') as f:
+            f.write(f"sector,date,{field}\n{sector},{new_date},\n")
+        sectoral_loader.load_files(cov_db, sectoral_data_udf.TABLE_NAME, [csv_path])
+        after = dict(sectoral_data_udf.get_coverage(sector)[1:])
+        history_cached = not sectoral_data_udf.is_missing(sectoral_data_udf.RESULT_CACHE.peek(
+            sectoral_data_udf._sector_history.cache_key(sector, field)
+        ))
+        sectoral_data_udf.use_database(original_db)
+    print(f"Before: {before}")
+    print(f"After:  {after}")
+    if (
+        early == [('Date', field)] and not history_cached
+        and after['Last date'] == new_date and after['Dates'] == before['Dates'] + 1
+        and len(after['Missing quarters'].split(', ')) == 3 and after[f'Blank {field}'] == 1
+    ):
+        print("SUCCESS: Coverage answers out-of-range requests and follows incremental loads.")
+    else:
+        print("FAILURE: Coverage index is wrong or stale.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 16 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    sectoral_data_udf.use_database(original_db)
+
+
+# --- Test 17: Analytics ---
+print("\n--- TEST 17: ANALYTICS ---")
+import statistics
+def analytic_column(rows):
+    return {row[0]: row[2] for row in rows[1:]}
+try:
+    history = dict(sectoral_data_udf.get_series("IT", field, '1900-01-01', '9999-12-31')[1:])
+    dates = sorted(history)
+    last, prev, year_ago = dates[-1], dates[-2], dates[-5]
+    mean, std = statistics.fmean(history.values()), statistics.pstdev(history.values())
+    expected = {
+        'qoq': history[last] - history[prev],
+        'yoy': history[last] - history[year_ago],
+        'rolling': statistics.fmean(history[d] for d in dates[-4:]),
+        'zscore': (history[last] - mean) / std,
+    }
+    got = {
+        'qoq': analytic_column(sectoral_data_udf.get_sector_qoq("IT", field))[last],
+        'yoy': analytic_column(sectoral_data_udf.get_sector_yoy("IT", field))[last],
+        'rolling': analytic_column(sectoral_data_udf.get_rolling_mean("IT", field, 4))[last],
+        'zscore': analytic_column(sectoral_data_udf.get_sector_zscore("IT", field))[last],
+    }
+    print(f"{last}: {got}")
+
+    # Without 2024-06-30 nothing may compare against 2024-03-31 in its place;
+    # a mid-quarter row in another sector must not break the field
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_copy = shutil.copy(original_db, os.path.join(tmp_dir, 'copy.db'))
+        conn = sqlite3.connect(db_copy)
+        with conn:
+            conn.execute(f"DELETE FROM {sectoral_data_udf.TABLE_NAME} WHERE date(date) = '2024-06-30'")
+            conn.execute(
+                f"INSERT INTO {sectoral_data_udf.TABLE_NAME} (sector, date, {field}) VALUES (?, ?, ?)",
+                (sector, '2025-05-15 00:00:00', 0.1),
+            )
+        conn.close()
+        sectoral_data_udf.use_database(db_copy)
+        gap_yoy = analytic_column(sectoral_data_udf.get_sector_yoy("IT", field))
+        gap_qoq = analytic_column(sectoral_data_udf.get_sector_qoq("IT", field))
+        gap_rolling = analytic_column(sectoral_data_udf.get_rolling_mean("IT", field, 4))
+        sectoral_data_udf.use_database(original_db)
+    print(f"With 2024-06-30 missing: YoY 2025-06-30 = {gap_yoy['2025-06-30']}, QoQ 2024-09-30 = {gap_qoq['2024-09-30']}")
+    if (
+        all(abs(got[k] - expected[k]) < 1e-9 for k in expected)
+        and gap_yoy['2025-06-30'] is None and gap_qoq['2024-09-30'] is None and gap_rolling['2025-03-31'] is None
+        and abs(gap_yoy['2025-03-31'] - (history['2025-03-31'] - history['2024-03-31'])) < 1e-9
+        and abs(gap_rolling['2025-06-30'] - expected['rolling']) < 1e-9
+    ):
+        print("SUCCESS: Analytics compare calendar quarters, leave a missing quarter blank and accept mid-quarter dates.")
+    else:
+        print("FAILURE: Analytics results are wrong or shifted across a missing quarter.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 17 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    sectoral_data_udf.use_database(original_db)
+
+
+# --- Test 18: Selective Invalidation ---
+print("\n--- TEST 18: SELECTIVE INVALIDATION ---")
+other_sector = "IT"
+try:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_copy = shutil.copy(original_db, os.path.join(tmp_dir, 'copy.db'))
+        # Only loads after the change log exists are applied selectively
+        conn = sqlite3.connect(db_copy)
+        sectoral_loader.ensure_loader_schema(conn, sectoral_data_udf.TABLE_NAME)
+        conn.close()
+        sectoral_data_udf.use_database(db_copy)
+        sectoral_data_udf._get_pool().check_interval = 0
+        sectoral_data_udf.get_series(sector, field, start_str, end_str)
+        sectoral_data_udf.get_series(other_sector, field, start_str, end_str)
+        sectoral_data_udf.get_sector_qoq(sector, field)
+
+        def cached(key):
+            return not sectoral_data_udf.is_missing(sectoral_data_udf.RESULT_CACHE.peek(key))
+        table_wide_keys = (
+            sectoral_data_udf._field_matrix.cache_key(field),
+            sectoral_data_udf._analytic.cache_key('qoq', field, None),
+        )
+        warmed = all(cached(key) for key in table_wide_keys)
+
+        csv_path = os.path.join(tmp_dir, 'revised.csv')
+        with open(csv_path, 'w', encoding='utf-8') as f:
+            f.write(f"sector,date,{field}\n{sector},{date_str},{data + 1}\n")
+        sectoral_loader.load_files(db_copy, sectoral_data_udf.TABLE_NAME, [csv_path])
+        revised = dict(sectoral_data_udf.get_series(sector, field, start_str, end_str)[1:])[date_str]
+        other_cached = cached(sectoral_data_udf._sector_history.cache_key(other_sector, field))
+        table_wide_cached = [key[0] for key in table_wide_keys if cached(key)]
+
+        # A write that bypasses the loader logs nothing: everything must go
+        sectoral_data_udf._query_single_data(other_sector, field, date_str)
+        conn = sqlite3.connect(db_copy)
+        with conn:
+            conn.execute(
+                f"UPDATE {sectoral_data_udf.TABLE_NAME} SET {field} = 999 WHERE sector = ? AND date(date) = ?",
+                (other_sector, date_str),
+            )
+        conn.close()
+        unlogged = sectoral_data_udf._query_single_data(other_sector, field, date_str)
+        sectoral_data_udf.use_database(original_db)
+    print(f"Revised: {revised}; {other_sector} history cached: {other_cached}; table-wide kept: {table_wide_cached}")
+    print(f"After an unlogged UPDATE: {unlogged}")
+    if (
+        warmed and abs(revised - data - 1) < 1e-9 and other_cached and not table_wide_cached
+        and unlogged == 999
+    ):
+        print("SUCCESS: A load dropped only the touched sector and the table-wide results; an unlogged write dropped all.")
+    else:
+        print("FAILURE: A write left stale results or a load dropped untouched sectors.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 18 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    sectoral_data_udf.use_database(original_db)
+
+
+# --- Test 19: Result Cache ---
+print("\n--- TEST 19: RESULT CACHE ---")
+from sectoral_cache import ResultCache
+try:
+    # A read that started before a DB change must not be stored after it
+    db_version = [1]
+    cache = ResultCache(version_fn=lambda: db_version[0])
+    computing, synced = threading.Event(), threading.Event()
+    def slow_read():
+        computing.set()
+        synced.wait(5)
+        return 'old'
+    racer = threading.Thread(target=lambda: cache.get_or_compute(('key',), slow_read))
+    racer.start()
+    computing.wait(5)
+    db_version[0] = 2
+    cache.sync()
+    synced.set()
+    racer.join(5)
+    after_race = cache.get_or_compute(('key',), lambda: 'new')
+
+    # Failures are recomputed, never stored
+    attempts = []
+    def failing_read():
+        attempts.append(1)
+        raise LookupError("No data found.")
+    for _ in range(2):
+        try:
+            cache.get_or_compute(('missing',), failing_read)
+        except LookupError:
+            pass
+    failure_cached = not sectoral_data_udf.is_missing(cache.peek(('missing',)))
+
+    # On a DB copy: a change drops cached histories, and an earlier miss doesn't stick
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_copy = shutil.copy(original_db, os.path.join(tmp_dir, 'copy.db'))
+        sectoral_data_udf.use_database(db_copy)
+        sectoral_data_udf._get_pool().check_interval = 0
+        before_change = sectoral_data_udf._query_single_data(sector, field, date_str)
+        missing_before = sectoral_data_udf._query_single_data(sector, field, '2030-03-31')
+        conn = sqlite3.connect(db_copy)
+        with conn:
+            conn.execute(
+                f"UPDATE {sectoral_data_udf.TABLE_NAME} SET {field} = {field} + 1 WHERE sector = ? AND date(date) = ?",
+                (sector, date_str),
+            )
+            conn.execute(
+                f"INSERT INTO {sectoral_data_udf.TABLE_NAME} (sector, date, {field}) VALUES (?, ?, ?)",
+                (sector, '2030-03-31 00:00:00', 0.5),
+            )
+        conn.close()
+        after_change = sectoral_data_udf._query_single_data(sector, field, date_str)
+        missing_after = sectoral_data_udf._query_single_data(sector, field, '2030-03-31')
+        sectoral_data_udf.use_database(original_db)
+    print(f"After a sync during a read: {after_race!r}; failing computes: {len(attempts)}")
+    print(f"Value {before_change} -> {after_change}; new date {missing_before!r} -> {missing_after!r}")
+    if (
+        after_race == 'new' and len(attempts) == 2 and not failure_cached
+        and before_change == data and abs(after_change - data - 1) < 1e-9
+        and str(missing_before).startswith("Error") and missing_after == 0.5
+    ):
+        print("SUCCESS: DB changes invalidate cached results; failures and reads across a change aren't cached.")
+    else:
+        print("FAILURE: The cache served stale results or stored a failure.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 19 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    sectoral_data_udf.use_database(original_db)
+
+
+# --- Test 20: Connection Pool ---
+print("\n--- TEST 20: CONNECTION POOL ---")
+from sectoral_db import ReadOnlyConnectionPool
+try:
+    # The service runs one thread per client; their connections must close with them
+    pool = ReadOnlyConnectionPool(original_db)
+    for _ in range(50):
+        worker = threading.Thread(target=lambda: pool.get().execute("SELECT 1"))
+        worker.start()
+        worker.join()
+    left_open = len(pool._connections)
+    pool.close_all()
+
+    # Replacing the file (new inode) must reopen the connection and notify listeners
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_copy = shutil.copy(original_db, os.path.join(tmp_dir, 'copy.db'))
+        replacement = shutil.copy(original_db, os.path.join(tmp_dir, 'replacement.db'))
+        conn = sqlite3.connect(replacement)
+        with conn:
+            conn.execute(f"UPDATE {sectoral_data_udf.TABLE_NAME} SET {field} = 999")
+        conn.close()
+        value_sql = f"SELECT {field} FROM {sectoral_data_udf.TABLE_NAME} LIMIT 1"
+        pool = ReadOnlyConnectionPool(db_copy, check_interval=0)
+        changes = []
+        pool.on_change(lambda: changes.append(1))
+        first = pool.get()
+        before_replace = first.execute(value_sql).fetchone()[0]
+        os.replace(replacement, db_copy)
+        second = pool.get()
+        after_replace = second.execute(value_sql).fetchone()[0]
+        pool.close_all()
+    print(f"Connections left by 50 finished threads: {left_open}")
+    print(f"Value before/after replacing the file: {before_replace} -> {after_replace}; change callbacks: {len(changes)}")
+    if left_open == 0 and second is not first and after_replace == 999 and before_replace != 999 and changes == [1]:
+        print("SUCCESS: Connections of finished threads were closed; a replaced file was reopened.")
+    else:
+        print("FAILURE: The pool kept finished threads' connections open or missed a replaced file.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 20 FAILED: {e}")
+    print("---------------------------------")
+
+
+# --- Test 21: Async Worker Pool ---
+print("\n--- TEST 21: ASYNC WORKER POOL ---")
+import functools
+original_get_series = sectoral_data_udf.get_series
+release = threading.Event()
+try:
+    # Hold every query until all calls are queued, so the identical ones overlap
+    @functools.wraps(original_get_series)
+    def held_get_series(*args):
+        release.wait(10)
+        return original_get_series(*args)
+    sectoral_data_udf.get_series = held_get_series
+
+    before = sectoral_data_udf.ASYNC_POOL.stats()
+    workers = sectoral_data_udf.ASYNC_WORKERS
+    results = []
+    calls = [(start_str, end_str)] * 8 + [(f"{2010 + k}-01-01", end_str) for k in range(2 * workers)]
+    callers = [
+        threading.Thread(target=lambda a=a: results.append((a, sectoral_data_udf.get_series_async(sector, field, *a))))
+        for a in calls
+    ]
+    for caller in callers:
+        caller.start()
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        during = sectoral_data_udf.ASYNC_POOL.stats()
+        if during['submitted'] + during['coalesced'] - before['submitted'] - before['coalesced'] == len(calls):
+            break
+        time.sleep(0.01)
+    pool_threads = sum(1 for t in threading.enumerate() if t.name.startswith('sectoral-udf'))
+    release.set()
+    for caller in callers:
+        caller.join(10)
+    after = sectoral_data_udf.ASYNC_POOL.stats()
+    submitted = after['submitted'] - before['submitted']
+    coalesced = after['coalesced'] - before['coalesced']
+    identical = [r for a, r in results if a == (start_str, end_str)]
+    print(f"Submitted: {submitted}, coalesced: {coalesced}, pool threads: {pool_threads} (max {workers})")
+    if (
+        submitted == 1 + 2 * workers and coalesced == 7 and pool_threads <= workers
+        and len(identical) == 8 and all(r == series_data for r in identical) and after['in_flight'] == 0
+    ):
+        print("SUCCESS: Identical async calls shared one query and the pool stayed at async_workers.")
+    else:
+        print("FAILURE: Async calls were not coalesced or the pool grew past async_workers.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 21 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    release.set()
+    sectoral_data_udf.get_series = original_get_series
+
+
+# --- Test 22: date_key Migration ---
+print("\n--- TEST 22: DATE_KEY MIGRATION ---")
+import contextlib
+import io
+import apply_index
+try:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_copy = shutil.copy(original_db, os.path.join(tmp_dir, 'copy.db'))
+        migration_output = io.StringIO()
+        with contextlib.redirect_stdout(migration_output):
+            apply_index.migrate_date_key(db_copy, sectoral_data_udf.TABLE_NAME)
+            apply_index.migrate_date_key(db_copy, sectoral_data_udf.TABLE_NAME)
+        conn = sqlite3.connect(db_copy)
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({sectoral_data_udf.TABLE_NAME})")]
+        with conn:
+            # The insert trigger fills date_key for rows added after the migration
+            conn.execute(
+                f"INSERT INTO {sectoral_data_udf.TABLE_NAME} (sector, date, {field}) VALUES (?, ?, ?)",
+                (sector, '2030-03-31 00:00:00', 0.5),
+            )
+        conn.close()
+
+        sectoral_data_udf.use_database(db_copy)
+        date_columns = sectoral_data_udf._date_columns()
+        keyed = (
+            sectoral_data_udf._query_single_data(sector, field, date_str),
+            sectoral_data_udf._query_series(sector, field, start_str, end_str),
+            sectoral_data_udf._query_matrix(date_str, field),
+            sectoral_data_udf._query_single_data(sector, field, '2030-03-31'),
+        )
+        sectoral_data_udf.use_database(original_db)
+    backfills = [line for line in migration_output.getvalue().splitlines() if line.startswith('Backfilled')]
+    print(f"Date columns: {date_columns}; backfills: {backfills}")
+    if (
+        columns.count('date_key') == 1 and backfills[1] == "Backfilled date_key for 0 rows."
+        and date_columns == ('date_key', 'date_key')
+        and keyed == (data, series_data, sql_matrix, 0.5)
+    ):
+        print("SUCCESS: The migration is idempotent and date_key queries match the date queries.")
+    else:
+        print("FAILURE: The migration repeated work or date_key queries differ.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 22 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    sectoral_data_udf.use_database(original_db)
+
+
+# --- Test 23: Sectoral Grid ---
+print("\n--- TEST 23: SECTORAL GRID ---")
+try:
+    # Caller's order, not sorted; unknown sectors, missing dates and blanks stay blank
+    grid_sectors = ["IT", sector, "No Such Sector", None]
+    grid_dates = ["2025-06-30", date_str, "2001-01-01", None]
+    def expected_cell(s, d):
+        value = sectoral_data_udf._query_single_data(s, field, d) if s and d else None
+        return value if isinstance(value, float) else None
+    expected_grid = [[expected_cell(s, d) for d in grid_dates] for s in grid_sectors]
+    sql_grid = sectoral_data_udf.get_sectoral_grid(grid_sectors, grid_dates, field)
+    sectoral_data_udf.load_snapshot()
+    snapshot_grid = sectoral_data_udf.get_sectoral_grid(grid_sectors, grid_dates, field)
+    print(f"Grid: {sql_grid}")
+    if (
+        sql_grid == expected_grid and snapshot_grid == expected_grid
+        and sql_grid[0][0] is not None and sql_grid[1][1] == data
+    ):
+        print("SUCCESS: The grid follows the caller's order and leaves misses blank, with or without a snapshot.")
+    else:
+        print("FAILURE: Grid cells are misplaced or misses aren't blank.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 23 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    sectoral_data_udf.SNAPSHOT = None
+    sectoral_data_udf.RESULT_CACHE.clear()
+
+
+# --- Test 24: Telemetry Histogram and Summary CLI ---
+print("\n--- TEST 24: TELEMETRY HISTOGRAM AND SUMMARY CLI ---")
+import json
+import subprocess
+import sys
+from sectoral_telemetry import LatencyHistogram, Telemetry
+temp_dir = tempfile.mkdtemp()
+try:
+    # Bucket bounds overstate a percentile by at most one growth step
+    histogram = LatencyHistogram()
+    for ms in range(1, 101):
+        histogram.add(float(ms))
+    p50, p99 = histogram.percentile(50), histogram.percentile(99)
+    histogram_ok = (
+        histogram.total == 100 and histogram.max_ms == 100.0
+        and 50 <= p50 < 50 * LatencyHistogram.GROWTH
+        and 99 <= p99 <= 100.0 and histogram.percentile(100) == 100.0
+    )
+
+    telemetry_file = os.path.join(temp_dir, 'telemetry.jsonl')
+    telemetry = Telemetry(log_file=telemetry_file, hit_sample_rate=1.0)
+    for source, status in [('sql', 'SUCCESS'), ('cache', 'SUCCESS'), ('cache', 'SUCCESS'), ('sql', 'ERROR')]:
+        token = telemetry.begin()
+        telemetry.mark_source(source)
+        telemetry.end(token, 'get_series', (sector, field), status)
+    # A nested SQL call makes the outer call a SQL call
+    outer = telemetry.begin()
+    telemetry.mark_source('cache')
+    inner = telemetry.begin()
+    telemetry.mark_source('sql')
+    telemetry.end(inner, 'get_data', (sector, field, date_str), 'SUCCESS')
+    telemetry.end(outer, 'get_sectoral_grid', ([sector], [date_str], field), 'SUCCESS')
+    live = {row[0]: row for row in telemetry.summary()}
+    telemetry.close()
+
+    result = subprocess.run(
+        [sys.executable, 'sectoral_telemetry.py', telemetry_file, '--json'],
+        capture_output=True, text=True, timeout=60,
+    )
+    rows = {row['function']: row for row in json.loads(result.stdout)}
+    print(f"p50={p50:.3f} p99={p99:.3f}, CLI rows: {rows}")
+    if (
+        histogram_ok
+        and live['get_series'][1:3] == (4, 50.0) and live['get_series'][6] == 1
+        and rows['get_series']['calls'] == 4 and rows['get_series']['errors'] == 1
+        and rows['get_series']['sources'] == {'cache': 2, 'sql': 2}
+        and rows['get_sectoral_grid']['sources'] == {'sql': 1}
+        and rows['get_data']['calls'] == 1
+    ):
+        print("SUCCESS: Histogram percentiles, live summary and the summary CLI agree with the recorded calls.")
+    else:
+        print("FAILURE: Telemetry percentiles or summaries are wrong.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 24 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+# --- Test 25: Import Without xlwings ---
+print("\n--- TEST 25: IMPORT WITHOUT XLWINGS ---")
+# Imports the module in a fresh interpreter and reports DB connections and
+# threads other than the logging/telemetry listeners
+IMPORT_PROBE = """
+import json, sqlite3, sys, threading
+from logging.handlers import QueueListener
+sys.path.insert(0, sys.argv[1])
+connects = []
+real_connect = sqlite3.connect
+sqlite3.connect = lambda *args, **kwargs: connects.append(args) or real_connect(*args, **kwargs)
+import sectoral_data_udf
+at_import = {
+    'xlwings': 'xlwings' in sys.modules,
+    'connects': len(connects),
+    'pool': sectoral_data_udf.DB_POOL is not None,
+    'threads': sorted(
+        t.name for t in threading.enumerate()
+        if t is not threading.main_thread()
+        and getattr(getattr(t, '_target', None), '__func__', None) is not QueueListener._monitor
+    ),
+}
+for t in threading.enumerate():
+    if t.name == 'sectoral-startup':
+        t.join(timeout=60)
+at_import['pool_after_startup'] = sectoral_data_udf.DB_POOL is not None
+print(json.dumps(at_import))
+"""
+temp_dir = tempfile.mkdtemp()
+try:
+    def probe_import(prewarm):
+        # config.ini in the working directory overrides the repo's [Database] settings
+        with open(os.path.join(temp_dir, 'config.ini'), 'w') as f:
+            f.write(f"[Database]\nprewarm = {str(prewarm).lower()}\nsnapshot_mode = false\nshare_snapshot = false\n")
+        env = {k: v for k, v in os.environ.items() if k != 'SECTORAL_UDF_XLWINGS'}
+        result = subprocess.run(
+            [sys.executable, '-c', IMPORT_PROBE, os.path.dirname(os.path.abspath(sectoral_data_udf.__file__))],
+            cwd=temp_dir, env=env, capture_output=True, text=True, timeout=120,
+        )
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    cold = probe_import(prewarm=False)
+    warm = probe_import(prewarm=True)
+    print(f"Without prewarm: {cold}")
+    print(f"With prewarm: {warm}")
+    if (
+        not cold['xlwings'] and cold['connects'] == 0 and not cold['pool']
+        and cold['threads'] == [] and not cold['pool_after_startup']
+        and warm['threads'] == ['sectoral-startup'] and warm['pool_after_startup']
+    ):
+        print("SUCCESS: Import skips xlwings and touches no DB; only prewarm starts a thread.")
+    else:
+        print("FAILURE: Import loaded xlwings, touched the DB or started a thread.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 25 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+# --- Test 26: Blank Values in Snapshot Mode ---
+print("\n--- TEST 26: BLANK VALUES IN SNAPSHOT MODE ---")
+original_db = sectoral_data_udf.DB_PATH
+try:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_copy = shutil.copy(original_db, os.path.join(tmp_dir, 'copy.db'))
+        conn = sqlite3.connect(db_copy)
+        with conn:
+            conn.execute(
+                f"UPDATE {sectoral_data_udf.TABLE_NAME} SET {field} = NULL WHERE sector = ? AND date(date) = ?",
+                (sector, date_str),
+            )
+        conn.close()
+        sectoral_data_udf.use_database(db_copy)
+        sql_series = sectoral_data_udf._query_series(sector, field, start_str, end_str)
+        sql_cross_section = sectoral_data_udf._query_matrix(date_str, field)
+        sectoral_data_udf.load_snapshot()
+        snap_series = sectoral_data_udf._query_series(sector, field, start_str, end_str)
+        snap_cross_section = sectoral_data_udf._query_matrix(date_str, field)
+        export_dir = os.path.join(tmp_dir, 'export')
+        sectoral_export.export_npy(db_copy, sectoral_data_udf.TABLE_NAME, export_dir)
+        mapped = sectoral_export.open_export(export_dir)
+        mapped_series = mapped.series(sector, field, start_str, end_str)
+        mapped_cross_section = mapped.matrix(date_str, field)
+        del mapped
+        sectoral_data_udf.use_database(original_db)
+    print(f"SQL: {len(sql_series)} series rows, {len(sql_cross_section)} matrix rows; "
+          f"snapshot: {len(snap_series)}, {len(snap_cross_section)}")
+    if (
+        (date_str, None) in sql_series and (sector, date_str, None) in sql_cross_section
+        and snap_series == sql_series and snap_cross_section == sql_cross_section
+        and mapped_series == sql_series[1:] and mapped_cross_section == sql_cross_section[1:]
+    ):
+        print("SUCCESS: Rows with a NULL value come back as blanks with or without the snapshot.")
+    else:
+        print("FAILURE: The snapshot drops or changes rows with a NULL value.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 26 FAILED: {e}")
+    print("---------------------------------")
+finally:
+    sectoral_data_udf.SNAPSHOT = None
+    sectoral_data_udf.use_database(original_db)
+
+
+# --- Test 27: Field Validation ---
+print("\n--- TEST 27: FIELD VALIDATION ---")
+try:
+    # Key columns are real table columns but not metric fields
+    rejected = {
+        key: [
+            sectoral_data_udf._query_series(sector, key, start_str, end_str),
+            sectoral_data_udf._query_matrix(date_str, key),
+            sectoral_data_udf._query_series_multi(sector, [field, key], start_str, end_str),
+        ]
+        for key in ('sector', 'date', 'date_key')
+    }
+    accepted = sectoral_data_udf._query_series(sector, field, start_str, end_str)
+    print(f"Key column results: { {k: [str(r)[:40] for r in v] for k, v in rejected.items()} }")
+    if all(str(r).startswith("Error") for results in rejected.values() for r in results) and accepted == series_data:
+        print("SUCCESS: Key columns are rejected as fields; metric fields still work.")
+    else:
+        print("FAILURE: A key column was accepted as a field.")
+    print("---------------------------------")
+except Exception as e:
+    print(f"TEST 27 FAILED: {e}")
+    print("---------------------------------")
+
+
+# --- Test 28: Check Log File ---
+print("\n--- TEST 28: CHECK LOG FILE ---")
 log_file_path = os.path.join(os.path.dirname(__file__), 'query_log.txt')
 if os.path.exists(log_file_path):
     print(f"SUCCESS: Log file 'query_log.txt' was found!")